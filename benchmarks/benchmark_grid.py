@@ -0,0 +1,102 @@
+"""Benchmark of the WaferMapGrid construction against the legacy per-cell loop"""
+
+import argparse
+import math
+import time
+
+from wafermap import grid, utils
+
+WAFER_RADIUS = 150.0
+CELL_COUNTS = (1e3, 1e4, 1e5, 1e6, 1e7)
+
+
+def legacy_grid(wafer_radius: float, cell_size: tuple[float, float]) -> dict:
+    """The per-cell Python loop used to build the grid up to 0.2.8 (full coverage)"""
+    cell_map = {}
+    num_of_cells_x = math.ceil(2 * wafer_radius / cell_size[0])
+    num_of_cells_y = math.ceil(2 * wafer_radius / cell_size[1])
+    for i_x in range(
+        -math.ceil(num_of_cells_x / 2) - 1, math.ceil(num_of_cells_x / 2) + 1
+    ):
+        for i_y in range(
+            -math.ceil(num_of_cells_y / 2) - 1, math.ceil(num_of_cells_y / 2) + 1
+        ):
+            lower_left = ((i_y - 0.5) * cell_size[1], (i_x - 0.5) * cell_size[0])
+            lower_right = (lower_left[0], lower_left[1] + cell_size[0])
+            upper_left = (lower_left[0] + cell_size[1], lower_left[1])
+            upper_right = (upper_left[0], lower_right[1])
+            bounds = (lower_left, lower_right, upper_left, upper_right)
+            if any(
+                list(
+                    map(
+                        lambda points: utils.euclidean_distance(points) <= wafer_radius,
+                        bounds,
+                    )
+                )
+            ):
+                cell_map[(i_y, i_x)] = bounds
+    return cell_map
+
+
+def timed(func, *args, **kwargs) -> float:
+    """Return the wall time of a single call in seconds"""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--legacy-limit",
+        type=float,
+        default=1e5,
+        help="Largest cell count the legacy loop is timed for",
+    )
+    parser.add_argument(
+        "--grid-limit",
+        type=float,
+        default=1e7,
+        help="Largest cell count the full WaferMapGrid construction is timed for",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'cells':>10} {'engine [s]':>11} {'grid [s]':>10} {'legacy [s]':>11} "
+        f"{'speedup':>8}"
+    )
+    for cell_count in CELL_COUNTS:
+        # square cells so that about cell_count cells cover the wafer
+        cell_side = math.sqrt(math.pi * WAFER_RADIUS**2 / cell_count)
+        engine_time = timed(
+            grid._build_grid,
+            wafer_radius=WAFER_RADIUS,
+            cell_size=(cell_side, cell_side),
+            cell_margin=(0.0, 0.0),
+            cell_origin=(0, 0),
+            grid_offset=(0.0, 0.0),
+            coverage="full",
+        )
+        if cell_count <= args.grid_limit:
+            grid_time = timed(
+                grid.WaferMapGrid,
+                wafer_radius=WAFER_RADIUS,
+                cell_size=(cell_side, cell_side),
+            )
+            grid_column = f"{grid_time:.3f}"
+        else:
+            grid_column = "-"
+        if cell_count <= args.legacy_limit:
+            legacy_time = timed(legacy_grid, WAFER_RADIUS, (cell_side, cell_side))
+            legacy = f"{legacy_time:.3f}"
+            speedup = f"{legacy_time / engine_time:.0f}x"
+        else:
+            legacy, speedup = "-", "-"
+        print(
+            f"{int(cell_count):>10} {engine_time:>11.3f} {grid_column:>10} "
+            f"{legacy:>11} {speedup:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
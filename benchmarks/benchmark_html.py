@@ -0,0 +1,52 @@
+"""Benchmark of the WaferMap HTML export size and time against the die count"""
+
+import argparse
+import math
+import time
+
+from wafermap import WaferMap
+
+WAFER_RADIUS = 150.0
+CELL_COUNTS = (1e3, 1e4, 5e4, 1e5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--limit",
+        type=float,
+        default=1e5,
+        help="Largest cell count the export is timed for",
+    )
+    parser.add_argument(
+        "--grid-rendering",
+        choices=WaferMap.GRID_RENDERINGS,
+        default="geojson",
+        help="The grid_rendering of the WaferMap",
+    )
+    args = parser.parse_args()
+
+    print(f"{'cells':>10} {'init [s]':>9} {'html [s]':>9} {'size [MB]':>10}")
+    for cell_count in CELL_COUNTS:
+        if cell_count > args.limit:
+            break
+        # square cells so that about cell_count cells cover the wafer
+        cell_side = math.sqrt(math.pi * WAFER_RADIUS**2 / cell_count)
+        start = time.perf_counter()
+        wm = WaferMap(
+            wafer_radius=WAFER_RADIUS,
+            cell_size=(cell_side, cell_side),
+            grid_rendering=args.grid_rendering,
+        )
+        init_time = time.perf_counter() - start
+        start = time.perf_counter()
+        html = wm.save_html(None)
+        html_time = time.perf_counter() - start
+        print(
+            f"{len(wm):>10} {init_time:>9.3f} {html_time:>9.3f} "
+            f"{len(html) / 1e6:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark of the import time of the headless grid and of the rendering backend"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+IMPORTS = {
+    "headless (WaferMapGrid)": "import wafermap; wafermap.WaferMapGrid",
+    "rendering (WaferMap)": "from wafermap import WaferMap",
+}
+TIMER = (
+    "import sys, time; start = time.perf_counter(); {statement}; "
+    "print(time.perf_counter() - start, 'folium' in sys.modules)"
+)
+
+
+def import_time(statement: str) -> tuple[float, bool]:
+    """Time statement in a fresh interpreter, return (seconds, folium was imported)"""
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(statement=statement)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    return float(output[0]), output[1] == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of fresh interpreters per import"
+    )
+    args = parser.parse_args()
+
+    print(f"{'import':<25} {'median [s]':>10} {'folium':>7}")
+    for name, statement in IMPORTS.items():
+        timings, folium_imported = zip(
+            *[import_time(statement) for _ in range(args.repeat)]
+        )
+        print(
+            f"{name:<25} {statistics.median(timings):>10.3f} "
+            f"{str(any(folium_imported)):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 """Automated testing functions"""
 
+import base64
+import gzip
+import io
+import math
 import os.path
 
 # pylint: disable=redefined-outer-name, missing-function-docstring, invalid-name
 
 import random as rnd
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+from xml.etree import ElementTree
 
-from wafermap import utils, wafermap
+import numpy
+from branca.element import Element
+from PIL import Image
+
+from wafermap import images, raster, utils, wafermap
+from wafermap.browser import BrowserPool
+from wafermap.layers import LabelLayer, PointLayer, VectorLayer
 
 
 class FunctionalTestsWafermap(unittest.TestCase):
@@ -237,6 +254,256 @@ class FunctionalTestsWafermap(unittest.TestCase):
         )
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_50_10.html"))
 
+    def test_wafermap_grid_cells(self):
+        # the vectorized grid must match the per-cell corner formulas
+        for coverage in ("full", "inner"):
+            grid = wafermap.WaferMapGrid(
+                wafer_radius=100,
+                cell_size=(13.702, 24.846),
+                cell_margin=(0.5, 1.0),
+                cell_origin=(2, 1),
+                grid_offset=(-2.05, -4.1),
+                coverage=coverage,
+            )
+            self.assertGreater(len(grid), 0)
+            for (cell_y, cell_x), (ll, lr, ul, ur, center) in grid._cell_map.items():
+                i_x, i_y = cell_x + 2, cell_y + 1
+                lower_left = (
+                    (i_y - 0.5) * (24.846 + 1.0) - 4.1 + 1.0 / 2,
+                    (i_x - 0.5) * (13.702 + 0.5) - 2.05 + 0.5 / 2,
+                )
+                self.assertEqual(ll, lower_left)
+                self.assertEqual(center, ((ll[0] + ul[0]) / 2, (ll[1] + lr[1]) / 2))
+                corners_in = [
+                    utils.euclidean_distance(point) <= 100 for point in (ll, lr, ul, ur)
+                ]
+                self.assertTrue(
+                    all(corners_in) if coverage == "inner" else any(corners_in)
+                )
+
+    def test_wafermap_cell_store(self):
+        grid = wafermap.WaferMapGrid(
+            wafer_radius=100,
+            cell_size=(13.702, 24.846),
+            cell_origin=(2, 1),
+            grid_offset=(-2.05, -4.1),
+        )
+        self.assertEqual(len(grid), len(grid.cell_indices))
+        self.assertTrue(numpy.shares_memory(grid.cell_indices, grid._cell_map.labels))
+        self.assertFalse(grid.cell_bounds.flags.writeable)
+        for (x, y), bounds in zip(grid.cell_indices.tolist(), grid.cell_bounds):
+            self.assertIn((y, x), grid._cell_map)
+            self.assertEqual(grid.cell_map[(x, y)], tuple(map(tuple, bounds.tolist())))
+        self.assertNotIn((1000, 1000), grid._cell_map)
+        with self.assertRaises(KeyError):
+            grid[(1000, 1000)]
+
+    def test_wafermap_grid_iteration(self):
+        grid = wafermap.WaferMapGrid(
+            wafer_radius=100, cell_size=(13.702, 24.846), grid_offset=(-2.05, -4.1)
+        )
+        cells = list(grid)
+        self.assertEqual(len(cells), len(grid))
+        self.assertEqual(cells, [tuple(cell) for cell in grid.cell_indices.tolist()])
+        # nested iterations are independent
+        pairs = [(a, b) for a in grid for b in grid]
+        self.assertEqual(len(pairs), len(grid) ** 2)
+
+        cell_map = grid.cell_map
+        self.assertIs(cell_map, grid.cell_map)
+        self.assertEqual(list(cell_map), cells)
+        for (x, y), bounds in cell_map.items():
+            self.assertEqual(bounds, tuple((p[1], p[0]) for p in grid[(y, x)]))
+        with self.assertRaises(TypeError):
+            cell_map[(0, 0)] = None
+
+    def test_wafermap_grid_cache(self):
+        grid_parameters = dict(
+            wafer_radius=100, cell_size=(13.702, 24.846), grid_offset=(-2.05, -4.1)
+        )
+        grid_cache = wafermap.WaferMapGrid.GRID_CACHE
+        grid_cache.clear()
+        grid1 = wafermap.WaferMapGrid(**grid_parameters)
+        grid2 = wafermap.WaferMapGrid(**grid_parameters)
+        self.assertIs(grid1._cell_map, grid2._cell_map)
+        grid3 = wafermap.WaferMapGrid(**grid_parameters, coverage="inner")
+        self.assertIsNot(grid1._cell_map, grid3._cell_map)
+        self.assertEqual(len(grid_cache), 2)
+        grid_cache.resize(1)
+        self.assertEqual(len(grid_cache), 1)
+        # grids over the memory limit are not kept
+        grid_cache.resize(32, max_bytes=grid_cache.nbytes - 1)
+        self.assertEqual(len(grid_cache), 0)
+        wafermap.WaferMapGrid(**grid_parameters)
+        self.assertEqual((len(grid_cache), grid_cache.nbytes), (0, 0))
+        grid_cache.resize(1, max_bytes=64 * 2**20)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            grid_cache.cache_dir = cache_dir
+            try:
+                grid_cache.clear()
+                grid4 = wafermap.WaferMapGrid(**grid_parameters)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                grid_cache.clear()
+                grid5 = wafermap.WaferMapGrid(**grid_parameters)
+                self.assertIsNot(grid4._cell_map, grid5._cell_map)
+                self.assertEqual(
+                    list(grid4.cell_map.items()), list(grid5.cell_map.items())
+                )
+                grid_cache.clear(disk=True)
+                self.assertEqual(os.listdir(cache_dir), [])
+                # an unwritable cache_dir falls back to an uncached build
+                grid_cache.cache_dir = os.path.join(cache_dir, "file")
+                open(grid_cache.cache_dir, "w", encoding="utf-8").close()
+                grid_cache.clear()
+                wafermap.WaferMapGrid(**grid_parameters)
+            finally:
+                grid_cache.cache_dir = None
+                grid_cache.resize(32)
+
+    def test_wafermap_wafer_to_cell(self):
+        cell_size, cell_margin = (13.702, 24.846), (0.5, 1.0)
+        grid = wafermap.WaferMapGrid(
+            wafer_radius=100,
+            cell_size=cell_size,
+            cell_margin=cell_margin,
+            cell_origin=(2, -1),
+            grid_offset=(-2.05, -4.1),
+            conversion_factor=0.5,
+        )
+        cells = grid.cell_indices[::7]
+        offsets = numpy.array(
+            [
+                (rnd.uniform(0, cell_size[0]), rnd.uniform(0, cell_size[1]))
+                for _ in range(len(cells))
+            ]
+        )
+        wafer_coordinates = [
+            grid.cell_to_wafer_coordinates((y, x), (0.5 * dy, 0.5 * dx))
+            for (x, y), (dx, dy) in zip(cells.tolist(), offsets.tolist())
+        ]
+        wafer_coordinates = numpy.array(wafer_coordinates)[:, ::-1] / 0.5
+        found_cells, found_offsets, valid = grid.wafer_to_cell(wafer_coordinates)
+        self.assertTrue(valid.all())
+        numpy.testing.assert_array_equal(found_cells, cells)
+        numpy.testing.assert_allclose(found_offsets, offsets, atol=1e-9)
+
+        # points in the margin and outside the map
+        in_margin = grid.cell_bounds[0, 0] / 0.5 - numpy.array(cell_margin) / 4
+        outside = (300.0, 0.0)
+        _, _, valid = grid.wafer_to_cell([in_margin, outside])
+        self.assertFalse(valid.any())
+
+    def test_wafermap_cell_to_wafer(self):
+        grid = wafermap.WaferMapGrid(
+            wafer_radius=100,
+            cell_size=(13.702, 24.846),
+            cell_margin=(0.5, 1.0),
+            cell_origin=(2, -1),
+            grid_offset=(-2.05, -4.1),
+        )
+        cells = numpy.vstack((grid.cell_indices, [(100, 100), (-100, 3)]))
+        offsets = numpy.random.default_rng(0).uniform(0, 10, size=cells.shape)
+        wafer_coordinates, valid = grid.cell_to_wafer(cells, offsets)
+        self.assertEqual(valid.tolist(), [True] * len(grid) + [False, False])
+        self.assertTrue(numpy.isnan(wafer_coordinates[~valid]).all())
+        # the inverse of wafer_to_cell, in (x, y) and mm
+        found_cells, found_offsets, found = grid.wafer_to_cell(wafer_coordinates[valid])
+        self.assertTrue(found.all())
+        numpy.testing.assert_array_equal(found_cells, cells[valid])
+        numpy.testing.assert_allclose(found_offsets, offsets[valid], atol=1e-9)
+        # the (y, x) scalar conversion in internal units
+        (x, y), (dx, dy) = cells[0].tolist(), offsets[0].tolist()
+        self.assertEqual(
+            grid.cell_to_wafer_coordinates((y, x), (dy, dx)),
+            tuple(wafer_coordinates[0, ::-1]),
+        )
+
+        wafer_coordinates, valid = grid.cell_to_wafer(None, offsets)
+        self.assertTrue(valid.all())
+        numpy.testing.assert_array_equal(wafer_coordinates, offsets)
+
+    def test_wafermap_cell_coverage(self):
+        cell_size = (13.702, 24.846)
+        grids = {
+            coverage: wafermap.WaferMapGrid(
+                wafer_radius=100,
+                cell_size=cell_size,
+                grid_offset=(-2.05, -4.1),
+                edge_exclusion=5,
+                coverage=coverage,
+            )
+            for coverage in ("full", "inner", "usable")
+        }
+        # without margins, the full grid covers exactly the wafer area
+        self.assertAlmostEqual(
+            grids["full"].cell_area_fraction.sum() * cell_size[0] * cell_size[1],
+            math.pi * 100**2,
+        )
+        self.assertTrue((grids["inner"].cell_area_fraction == 1).all())
+        # the usable coverage keeps exactly the cells classified as inside
+        inside = grids["full"].cell_class == wafermap.WaferMapGrid.CELL_INSIDE
+        self.assertEqual(
+            grids["full"].cell_indices[inside].tolist(),
+            grids["usable"].cell_indices.tolist(),
+        )
+        self.assertTrue(
+            set(grids["full"].cell_class.tolist())
+            <= {
+                wafermap.WaferMapGrid.CELL_INSIDE,
+                wafermap.WaferMapGrid.CELL_PARTIAL,
+                wafermap.WaferMapGrid.CELL_EDGE_EXCLUSION,
+            }
+        )
+        with self.assertRaises(ValueError):
+            wafermap.WaferMapGrid(
+                wafer_radius=10,
+                cell_size=cell_size,
+                edge_exclusion=10,
+                coverage="usable",
+            )
+
+    def test_wafermap_optimize_grid_offset(self):
+        grid_parameters = dict(
+            wafer_radius=150,
+            cell_size=(13.702, 24.846),
+            cell_margin=(0.1, 0.2),
+            edge_exclusion=3,
+        )
+        for coverage in ("full", "inner", "usable"):
+            grid = wafermap.WaferMapGrid(**grid_parameters, coverage=coverage)
+            sweep = grid.optimize_grid_offset(steps=(17, 13))
+            self.assertEqual(sweep.counts.shape, (17, 13))
+            self.assertEqual(sweep.best_count, sweep.counts.max())
+            # the counts match the grids built at the swept offsets
+            for i_x, i_y in ((0, 0), (5, 7), (16, 12)):
+                offset_grid = wafermap.WaferMapGrid(
+                    **grid_parameters,
+                    grid_offset=(sweep.offsets_x[i_x], sweep.offsets_y[i_y]),
+                    coverage=coverage,
+                )
+                self.assertEqual(len(offset_grid), sweep.counts[i_x, i_y])
+            best_grid = wafermap.WaferMapGrid(
+                **grid_parameters, grid_offset=sweep.best_offset, coverage=coverage
+            )
+            self.assertEqual(len(best_grid), sweep.best_count)
+
+    def test_wafermap_headless_import(self):
+        # the grid must not load the rendering backend
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, wafermap; wafermap.WaferMapGrid(100, (10, 10)); "
+                "print(sorted({'folium', 'branca', 'PIL', 'html2image'} & "
+                "set(sys.modules)))",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
+
     def test_wafermap_cell_margin(self):
         wm = wafermap.WaferMap(
             wafer_radius=100,
@@ -366,6 +633,230 @@ class FunctionalTestsWafermap(unittest.TestCase):
             autocrop=True,
         )
 
+    def test_wafermap_png_tiles(self):
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=(13.702, 24.846))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_file = os.path.join(temp_dir, "scan.png")
+            Image.new("RGB", (64, 64), (255, 0, 0)).save(image_file)
+            # tiles referenced relative to the working directory
+            wm.add_image_tiles(image_file, os.path.relpath(temp_dir))
+            with BrowserPool(resolution=(800, 600)) as browser_pool:
+                with self.assertRaises(ValueError):
+                    wm.to_image(resolution=(640, 480), browser_pool=browser_pool)
+            image = wm.to_array(resolution=(800, 600))
+        self.assertEqual(image.shape, (600, 800, 3))
+        self.assertTrue(wm.map.options["zoomControl"])
+        center = image[250:350, 350:450].reshape(-1, 3).astype(int)
+        red = (center[:, 0] > 200) & (center[:, 1] < 80) & (center[:, 2] < 80)
+        self.assertGreater(red.mean(), 0.5)
+
+    def test_wafermap_png_raster(self):
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=(20, 20),
+            coverage="full",
+            map_bg_color=(1.0, 1.0, 1.0),
+        )
+        wm.style_cells(
+            numpy.array([[0, 0]]),
+            cell_style={
+                "fill": True,
+                "fillColor": "#ff0000",
+                "fillOpacity": 1.0,
+                "stroke": False,
+            },
+        )
+        wm.add_points(
+            None,
+            numpy.array([[50.0, 50.0]]),
+            colors=["#0000ff"],
+            sizes=5,
+            point_style={"fillOpacity": 1.0},
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_file = wm.save_png(
+                os.path.join(temp_dir, "raster.png"),
+                renderer="raster",
+                resolution=(500, 400),
+            )
+            with Image.open(output_file) as image:
+                self.assertEqual(image.size, (500, 400))
+                self.assertEqual(image.getpixel((2, 2)), (255, 255, 255))
+                # 300 px across the 200 mm of the wafer, the edge is black
+                self.assertEqual(image.getpixel((100, 200)), (0, 0, 0))
+                self.assertEqual(image.getpixel((250, 200)), (255, 0, 0))
+                self.assertEqual(image.getpixel((325, 125)), (0, 0, 255))
+
+            output_file = wm.save_png(
+                os.path.join(temp_dir, "raster_autocrop.png"),
+                autocrop=True,
+                renderer="raster",
+                resolution=(500, 400),
+            )
+            with Image.open(output_file) as image:
+                # the box of the cells, 220 mm across, and of their outlines
+                self.assertEqual(image.size, (332, 332))
+
+        with self.assertRaises(ValueError):
+            wm.save_png("wafermap.png", renderer="screenshot")
+
+    def test_wafermap_png_in_memory(self):
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=(20, 20),
+            coverage="inner",
+            map_bg_color=(1.0, 1.0, 1.0),
+        )
+        pixels = wm.to_array(renderer="raster", resolution=(500, 400))
+        self.assertEqual(pixels.shape, (400, 500, 3))
+        self.assertEqual(pixels.dtype, numpy.uint8)
+        # the wafer is 300 px across and centered, with the stroke of its edge
+        self.assertEqual(utils.content_box(pixels), (98, 48, 402, 352))
+        self.assertEqual(utils.content_box(numpy.zeros((4, 6))), (0, 0, 6, 4))
+
+        png = wm.save_png(None, renderer="raster", resolution=(500, 400))
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        with Image.open(io.BytesIO(png)) as image:
+            self.assertEqual(image.size, (500, 400))
+        smaller_png = wm.save_png(
+            None, renderer="raster", resolution=(500, 400), compress_level=9
+        )
+        self.assertLessEqual(len(smaller_png), len(png))
+
+        webp = wm.save_png(
+            None,
+            autocrop=True,
+            renderer="raster",
+            resolution=(500, 400),
+            max_size=(100, 100),
+            image_format="webp",
+            quality=50,
+        )
+        with Image.open(io.BytesIO(webp)) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (100, 100))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_file = wm.save_png(
+                os.path.join(temp_dir, "wafermap.jpg"), renderer="raster"
+            )
+            with Image.open(output_file) as image:
+                self.assertEqual(image.format, "JPEG")
+        with self.assertRaises(ValueError):
+            wm.save_png(None, renderer="raster", image_format="gif")
+
+    def test_wafermap_save_svg(self):
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=(10, 10),
+            coverage="full",
+            edge_exclusion=5,
+            map_bg_color=(1.0, 1.0, 1.0),
+        )
+        wm.style_cells(
+            numpy.array([[0, 0], [1, 0], [3, 0]]),
+            cell_style={"fill": True, "fillColor": "#ff0000"},
+        )
+        points = numpy.array([[10.0, 10.0], [20.0, 20.0], [30.0, 30.0]])
+        wm.add_points(None, points, colors=["#0000ff", "#00ff00", "#0000ff"])
+        wm.add_vectors(None, points, points + 5)
+
+        output_svg = wm.save_svg(None, autocrop=True)
+        svg = ElementTree.fromstring(output_svg)
+        self.assertEqual(svg.get("viewBox"), "0 0 1440 1440")
+        tags = [element.tag.split("}")[-1] for element in svg.iter()]
+        # the wafer edge, the edge exclusion and the points
+        self.assertEqual(tags.count("circle"), 5)
+        # the notch
+        self.assertEqual(tags.count("polygon"), 1)
+        # the cell fills, the cell outlines and the vectors
+        self.assertEqual(tags.count("path"), 3)
+        # the points are grouped by color, with a class per color
+        self.assertEqual(tags.count("g"), 2)
+        fill_classes = re.findall(r"\.(\w+)\{fill:#FF0000", output_svg)
+        self.assertEqual(len(fill_classes), 1)
+        # the cells (0, 0) and (1, 0) are a run of a row, the cell (3, 0) another
+        fills = [
+            path
+            for path in svg.iter("{http://www.w3.org/2000/svg}path")
+            if path.get("class") == fill_classes[0]
+        ]
+        self.assertEqual(fills[0].get("d").count("M"), 2)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_file = wm.save_svg(os.path.join(temp_dir, "wafermap.svg"))
+            with open(output_file, encoding="utf-8") as f:
+                self.assertEqual(ElementTree.fromstring(f.read()).get("width"), "2560")
+
+    def test_wafermap_clone(self):
+        kwargs = dict(
+            wafer_radius=100,
+            cell_size=(10, 10),
+            coverage="full",
+            edge_exclusion=5,
+        )
+        template = wafermap.WaferMap(**kwargs)
+        clone1 = template.clone()
+        clone2 = template.clone()
+        clone1.style_cells(
+            numpy.array([[0, 0], [1, 0]]),
+            cell_style={"fill": True, "fillColor": "#ff0000"},
+        )
+        clone2.add_points(None, numpy.array([[10.0, 10.0], [20.0, 20.0]]))
+
+        # the data of a clone is its own
+        self.assertTrue(numpy.any(clone1._cell_style_ids))
+        self.assertFalse(numpy.any(clone2._cell_style_ids))
+        self.assertFalse(numpy.any(template._cell_style_ids))
+        self.assertEqual(len(clone2._markers_layer._children), 1)
+        self.assertEqual(len(clone1._markers_layer._children), 0)
+        self.assertEqual(len(template._markers_layer._children), 0)
+
+        # a clone renders as a new map of the same arguments
+        def normalized_html(wm):
+            return re.sub(r"_[0-9a-f]{32}", "_ID", wm.save_html(None))
+
+        self.assertEqual(
+            normalized_html(template.clone()),
+            normalized_html(wafermap.WaferMap(**kwargs)),
+        )
+        numpy.testing.assert_array_equal(
+            template.clone().to_array(renderer="raster"),
+            template.to_array(renderer="raster"),
+        )
+
+    def test_wafermap_png_batch(self):
+        wafer_maps = [
+            wafermap.WaferMap(
+                wafer_radius=100,
+                cell_size=(13.702, 24.846),
+                cell_margin=(0.0, 0.0),
+                grid_offset=(-2.05, -4.1),
+                coverage="full",
+                notch_orientation=notch_orientation,
+            )
+            for notch_orientation in (0, 90, 180, 270)
+        ]
+        output_files = [
+            os.path.join(self.output_dir, f"test_wafermap_png_batch_{i}.png")
+            for i in range(len(wafer_maps))
+        ]
+        with self.assertRaises(ValueError):
+            wafermap.WaferMap.save_pngs(wafer_maps, output_files[:2])
+        with self.assertRaises(ValueError):
+            BrowserPool(size=0)
+        with BrowserPool(size=2, timeout=60) as browser_pool:
+            pass
+        with self.assertRaises(RuntimeError):
+            browser_pool.screenshot("<html></html>", output_files[0])
+
+        wafermap.WaferMap.save_pngs(
+            wafer_maps, output_files, autocrop=True, pool_size=2
+        )
+        for output_file in output_files:
+            with Image.open(output_file) as image:
+                self.assertLessEqual(max(image.size), 1440)
+
     def test_wafermap_add_image1(self):
         wm = wafermap.WaferMap(
             wafer_radius=100,
@@ -500,6 +991,230 @@ class FunctionalTestsWafermap(unittest.TestCase):
         )
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_image2.html"))
 
+    def test_wafermap_add_images(self):
+        image_files = [
+            os.path.join(self.input_dir, image_file)
+            for image_file in [
+                "INS3300_Lot_1_Wafer_17_147375.jpg",
+                "INS3300_Lot_1_Wafer_17_147378.jpg",
+                "INS3300_Lot_1_Wafer_2_125416.jpg",
+            ]
+        ]
+        cache = wafermap.WaferMap.THUMBNAIL_CACHE
+        cache.clear()
+        wm = wafermap.WaferMap(wafer_radius=150, cell_size=(13.702, 24.846))
+        cells = wm.cell_indices[:12].tolist()
+        wm.add_images(image_files * 4, cells=cells, offsets=[(0.5, 0.5)] * 12)
+        wm.add_images(image_files, marker_style={})
+
+        # recurring images are read once, the thumbnails are the ones of add_image
+        self.assertEqual(len(cache), 3)
+        thumbnail = cache.get(image_files[0], wafermap.WaferMap.IMAGE_SIZE_IN_POPUP)
+        with Image.open(image_files[0]) as image:
+            image.thumbnail(wafermap.WaferMap.IMAGE_SIZE_IN_POPUP)
+            self.assertEqual(thumbnail.size, image.size)
+            buffered = io.BytesIO()
+            image.save(buffered, "JPEG")
+        self.assertEqual(thumbnail.jpeg, buffered.getvalue())
+        html = wm.save_html(None)
+        self.assertEqual(html.count("<iframe"), 12)
+        self.assertEqual(html.count("L.imageOverlay("), 3)
+
+        # overlays do not need the thumbnails to be encoded
+        cache.clear()
+        wm.add_images(image_files, marker_style={})
+        for image_file in image_files:
+            thumbnail = cache.get(image_file, wafermap.WaferMap.IMAGE_SIZE_IN_POPUP)
+            self.assertIsNone(thumbnail._jpeg)
+
+        # a modified file is read again
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_file = shutil.copy(image_files[0], temp_dir)
+            thumbnail = cache.get(image_file, (100, 100))
+            self.assertIs(cache.get(image_file, (100, 100)), thumbnail)
+            os.utime(image_file, ns=(0, 0))
+            self.assertIsNot(cache.get(image_file, (100, 100)), thumbnail)
+
+        with self.assertRaises(ValueError):
+            wm.add_images(image_files, cells=cells)
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_images.html"))
+
+    def test_wafermap_add_image_tiles(self):
+        wm = wafermap.WaferMap(wafer_radius=150, cell_size=(13.702, 24.846))
+        image = Image.fromarray(
+            numpy.random.default_rng(0).integers(0, 256, (512, 512, 3), numpy.uint8)
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_file = os.path.join(temp_dir, "scan.png")
+            image.save(image_file)
+            tiles_dir = os.path.join(temp_dir, "tiles")
+            # entries of tiles_dir not written by wafermap are left alone
+            os.makedirs(os.path.join(tiles_dir, "3"))
+            # 8 pixels per mm, aligned with the tiles of zoom 3
+            wm.add_image_tiles(image_file, tiles_dir, bounds=((0, 0), (64, 64)))
+            (pyramid,) = set(os.listdir(tiles_dir)) - {"3"}
+            pyramid_dir = os.path.join(tiles_dir, pyramid)
+            self.assertEqual(sorted(os.listdir(pyramid_dir)), ["2", "3"])
+            self.assertEqual(
+                os.listdir(os.path.join(pyramid_dir, "2", "0")), ["-1.png"]
+            )
+            mosaic = Image.new("RGBA", (512, 512))
+            for x, y in [(0, -2), (1, -2), (0, -1), (1, -1)]:
+                with Image.open(
+                    os.path.join(pyramid_dir, "3", str(x), f"{y}.png")
+                ) as tile:
+                    mosaic.paste(tile, (x * 256, (y + 2) * 256))
+            self.assertTrue(
+                numpy.array_equal(numpy.asarray(mosaic)[..., :3], numpy.asarray(image))
+            )
+
+            html_file = wm.save_html(os.path.join(temp_dir, "wafermap.html"))
+            with open(html_file, encoding="utf-8") as f:
+                html = f.read()
+            self.assertIn(f'"tiles/{pyramid}/{{z}}/{{x}}/{{y}}.png"', html)
+            self.assertIn('"bounds": [[0.0, 0.0], [64.0, 64.0]]', html)
+            self.assertIn('"maxNativeZoom": 3', html)
+            self.assertIn('"minNativeZoom": 2', html)
+
+            # a cell, in jpeg, next to the earlier pyramid, and the same pyramid
+            # again is reused
+            wm.add_image_tiles(image_file, tiles_dir, cell=(0, 0), image_format="jpeg")
+            wm.add_image_tiles(image_file, tiles_dir, bounds=((0, 0), (64, 64)))
+            (jpeg_pyramid,) = set(os.listdir(tiles_dir)) - {"3", pyramid}
+            self.assertEqual(os.listdir(os.path.join(tiles_dir, "3")), [])
+            for _, _, tile_files in os.walk(os.path.join(tiles_dir, jpeg_pyramid)):
+                self.assertTrue(all(f.endswith(".jpg") for f in tile_files))
+            html = wm.save_html(None)
+            self.assertEqual(html.count("L.tileLayer("), 4)
+
+            # read by bands of rows, from an uncompressed TIFF
+            tiff_file = os.path.join(temp_dir, "scan.tif")
+            image.save(tiff_file)
+            with images._SourceImage(tiff_file, 512 * 512) as source:
+                self.assertTrue(source.banded)
+                self.assertEqual(source.rows(100, 200)[0].size, (512, 100))
+            pyramid_dir, _, _ = images.build_tile_pyramid(
+                tiff_file, tiles_dir, [[0, 0], [64, 64]]
+            )
+            for x, y in [(0, -2), (1, -1)]:
+                tile_file = os.path.join("3", str(x), f"{y}.png")
+                with Image.open(os.path.join(pyramid_dir, tile_file)) as tiff_tile:
+                    with Image.open(
+                        os.path.join(tiles_dir, pyramid, tile_file)
+                    ) as png_tile:
+                        self.assertEqual(tiff_tile.tobytes(), png_tile.tobytes())
+            # decoded whole if the image cannot be read by bands
+            with unittest.mock.patch.object(
+                images, "_supports_band_reads", return_value=False
+            ):
+                with images._SourceImage(tiff_file, 512 * 512) as source:
+                    self.assertFalse(source.banded)
+                    band, band_top = source.rows(100, 200)
+                    self.assertEqual((band.size, band_top), ((512, 512), 0))
+                fallback_dir = os.path.join(temp_dir, "fallback")
+                fallback_pyramid_dir, _, _ = images.build_tile_pyramid(
+                    tiff_file, fallback_dir, [[0, 0], [64, 64]]
+                )
+            for tile_file in [
+                os.path.join("3", "0", "-2.png"),
+                os.path.join("2", "0", "-1.png"),
+            ]:
+                with Image.open(os.path.join(pyramid_dir, tile_file)) as tiff_tile:
+                    with Image.open(
+                        os.path.join(fallback_pyramid_dir, tile_file)
+                    ) as fallback_tile:
+                        self.assertEqual(tiff_tile.tobytes(), fallback_tile.tobytes())
+            # the size of the image is checked explicitly
+            with self.assertRaises(ValueError):
+                images.build_tile_pyramid(
+                    tiff_file, tiles_dir, [[0, 0], [64, 64]], max_pixels=512 * 511
+                )
+            self.assertEqual(Image.MAX_IMAGE_PIXELS, 89478485)
+            with self.assertRaises(ValueError):
+                wm.add_image_tiles(image_file, tiles_dir, cell=(100, 100))
+            with self.assertRaises(ValueError):
+                wm.add_image_tiles(image_file, tiles_dir, image_format="gif")
+
+    def test_wafermap_save_html_streaming(self):
+        wm = wafermap.WaferMap(wafer_radius=150, cell_size=(13.702, 24.846))
+        wm.add_points(wm.cell_indices, numpy.full((len(wm.cell_indices), 2), 0.5))
+        wm.add_point(cell=(1, 1), offset=(0.5, 0.5), popup_text="point")
+        html = wm.save_html(None)
+        # the scripts of earlier saves are not repeated
+        self.assertEqual(wm.save_html(None), html)
+        self.assertEqual(html.count(".addTo(map_"), 9)
+
+        minified_html = wm.save_html(None, minify=True)
+        lines = minified_html.splitlines()
+        self.assertTrue(all(line and line == line.strip() for line in lines))
+        self.assertLess(len(minified_html), len(html))
+        self.assertEqual(minified_html.count(".addTo(map_"), 9)
+
+        # user content, in popups, <pre> and JS string literals, is left untouched
+        popup_text = "first   // not a comment\n    indented"
+        wm.add_point(cell=(2, 2), popup_text=popup_text)
+        pre = "<pre>\n    // kept\n\n  indented\n</pre>"
+        wm.map.get_root().html.add_child(Element(pre))
+        literal = "var text = `\n    // kept\n\n  indented\n`;"
+        wm.map.get_root().html.add_child(Element(f"<script>\n    {literal}\n</script>"))
+        html = wm.save_html(None)
+        minified_html = wm.save_html(None, minify=True)
+        popup = re.search(r"\$\(`([^`]*// not a comment[^`]*)`\)", html).group(1)
+        self.assertIn(popup, minified_html)
+        self.assertIn(pre, minified_html)
+        self.assertIn(literal, minified_html)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_file = os.path.join(temp_dir, "wafermap.html.gz")
+            self.assertEqual(wm.save_html(output_file), output_file)
+            with gzip.open(output_file, "rt", encoding="utf-8") as f:
+                self.assertEqual(f.read(), html)
+            with self.assertRaises(ValueError):
+                wm.save_html(os.path.join(temp_dir, "wafermap.gz"))
+
+    def test_wafermap_save_html_assets(self):
+        image_files = [
+            os.path.join(self.input_dir, image_file)
+            for image_file in [
+                "INS3300_Lot_1_Wafer_17_147375.jpg",
+                "INS3300_Lot_1_Wafer_17_147378.jpg",
+                "INS3300_Lot_1_Wafer_2_125416.jpg",
+            ]
+        ]
+        wm = wafermap.WaferMap(wafer_radius=150, cell_size=(13.702, 24.846))
+        cells = wm.cell_indices[:30].tolist()
+        wm.add_images(image_files * 10, cells=cells, offsets=[(0.5, 0.5)] * 30)
+        wm.add_images(image_files * 2, marker_style={})
+        inlined_html = wm.save_html(None)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_file = os.path.join(temp_dir, "wafermap.html")
+            assets_dir = os.path.join(temp_dir, "wafermap files")
+            self.assertEqual(wm.save_html(output_file, assets_dir), output_file)
+            with open(output_file, encoding="utf-8") as f:
+                html = f.read()
+
+            # each thumbnail and each overlay image is written once
+            self.assertEqual(len(os.listdir(assets_dir)), 6)
+            self.assertNotIn("data:image/jpg", html)
+            self.assertEqual(html.count('<img src="wafermap%20files/'), 30)
+            self.assertEqual(html.count('"wafermap%20files/'), 36)
+            self.assertLess(len(html), len(inlined_html) / 10)
+            thumbnail = wafermap.WaferMap.THUMBNAIL_CACHE.get(
+                image_files[0], wafermap.WaferMap.IMAGE_SIZE_IN_POPUP
+            )
+            with open(
+                os.path.join(assets_dir, thumbnail.digest[:20] + ".jpg"), "rb"
+            ) as f:
+                self.assertEqual(f.read(), thumbnail.jpeg)
+
+            # saving again reuses the files, and the map is inlined again without
+            wm.save_html(os.path.join(temp_dir, "wafermap2.html"), assets_dir)
+            self.assertEqual(len(os.listdir(assets_dir)), 6)
+        html = wm.save_html(None)
+        self.assertEqual(html.count("data:text/html;charset=utf-8;base64,"), 30)
+        self.assertEqual(html.count("data:image/jpg;base64,"), 6)
+
     def test_wafermap_add_vectors1(self):
         cell_size = (26, 14)
         wm = wafermap.WaferMap(
@@ -594,6 +1309,57 @@ class FunctionalTestsWafermap(unittest.TestCase):
 
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_vectors3.html"))
 
+    def test_wafermap_add_vectors4(self):
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=(26, 14),
+            conversion_factor=2.0,
+        )
+
+        # add_vector leaves its input as it is and adds a single PolyLine
+        vector = [(1.0, 2.0), (3.0, 5.0)]
+        wm.add_vector(vector_points=vector, cell=(1, 0))
+        self.assertEqual(vector, [(1.0, 2.0), (3.0, 5.0)])
+        self.assertNotIn(".setText(", wm.save_html(None))
+
+        cells = numpy.repeat(wm.cell_indices, 10, axis=0)
+        rng = numpy.random.default_rng(0)
+        starts = rng.uniform((0, 0), (26, 14), (len(cells), 2))
+        deltas = rng.normal(0, 0.01, (len(cells), 2))
+        inputs = starts.copy(), deltas.copy()
+        wm.add_vectors(
+            cells,
+            starts,
+            deltas,
+            vector_length_scale=500,
+            colormap=["blue", "red"],
+            root_style={"radius": 1, "color": "black"},
+        )
+        numpy.testing.assert_array_equal(inputs[0], starts)
+        numpy.testing.assert_array_equal(inputs[1], deltas)
+
+        layer = [
+            child
+            for child in wm._vectors_layer._children.values()
+            if isinstance(child, VectorLayer)
+        ][0]
+        i = numpy.flatnonzero(layer.buckets.order == 3)[0]
+        self.assertAlmostEqual(
+            float(layer.dx[i]), deltas[3, 0] * 500 * wm.conversion_factor, places=3
+        )
+        magnitudes = numpy.hypot(*deltas.T)
+        self.assertEqual(
+            layer.palette[layer.colors[layer.buckets.order == magnitudes.argmax()][0]],
+            "#ff0000ff",
+        )
+
+        html = wm.save_html(None)
+        self.assertEqual(html.count("new wafermap.Vectors("), 1)
+        self.assertEqual(html.count("new wafermap.Points("), 1)
+        with self.assertRaises(ValueError):
+            wm.add_vectors(None, starts, deltas[:10])
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_vectors4.html"))
+
     def test_wafermap_add_points1(self):
         cell_size = (26, 14)
         wm = wafermap.WaferMap(
@@ -644,6 +1410,53 @@ class FunctionalTestsWafermap(unittest.TestCase):
 
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_points2.html"))
 
+    def test_wafermap_add_points3(self):
+        cell_size = (26, 14)
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=cell_size,
+            conversion_factor=2.0,
+        )
+        cells = numpy.repeat(wm.cell_indices, 50, axis=0)
+        offsets = numpy.random.default_rng(0).uniform(
+            (0, 0), cell_size, (len(cells), 2)
+        )
+        wm.add_points(
+            cells,
+            offsets,
+            colors=numpy.where(offsets[:, 0] > cell_size[0] / 2, "red", "blue"),
+            sizes=numpy.linspace(1, 3, len(cells)),
+            popup_texts=[f"point {i}" for i in range(len(cells))],
+        )
+        wm.add_points(None, [(0, 0), (10, 10)], point_style={"color": "black"})
+
+        # one layer per call, with the points in map coordinates
+        point_layers = [
+            child
+            for child in wm._markers_layer._children.values()
+            if isinstance(child, PointLayer)
+        ]
+        self.assertEqual(len(point_layers), 2)
+        layer = point_layers[0]
+        expected = wm.cell_to_wafer_coordinates(
+            tuple(cells[7][::-1]), tuple(offsets[7][::-1] * wm.conversion_factor)
+        )
+        i = numpy.flatnonzero(layer.buckets.order == 7)[0]
+        self.assertAlmostEqual(float(layer.y[i]), expected[0], places=4)
+        self.assertAlmostEqual(float(layer.x[i]), expected[1], places=4)
+        self.assertEqual(layer.popups[i], "point 7")
+        self.assertEqual(sorted(layer.palette), ["blue", "red"])
+
+        html = wm.save_html(None)
+        self.assertEqual(html.count("new wafermap.Points("), 2)
+        self.assertNotIn("L.circleMarker(", html)
+
+        with self.assertRaises(ValueError):
+            wm.add_points([(100, 100)], [(0, 0)])
+        with self.assertRaises(ValueError):
+            wm.add_points(None, [(0, 0), (10, 10)], sizes=numpy.array([2.0, 3.0, 4.0]))
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_points3.html"))
+
     def test_wafermap_add_labels1(self):
         cell_size = (26, 14)
         wm = wafermap.WaferMap(
@@ -671,6 +1484,47 @@ class FunctionalTestsWafermap(unittest.TestCase):
 
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_labels1.html"))
 
+    def test_wafermap_add_labels2(self):
+        cell_size = (26, 14)
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=cell_size)
+        cells = wm.cell_indices
+        label_texts = [f"bin {i % 5}" for i in range(len(cells))]
+        wm.add_labels(
+            cells,
+            numpy.tile(numpy.divide(cell_size, 2), (len(cells), 1)),
+            label_texts,
+            label_html_style=[
+                "font-size: 8pt; color: red;" if i % 5 else "font-size: 8pt;"
+                for i in range(len(cells))
+            ],
+            popup_texts=label_texts,
+        )
+        wm.add_labels(None, [(0, 0)], ["center"], min_zoom=2)
+
+        labels = [
+            child
+            for child in wm._labels_layer._children.values()
+            if isinstance(child, LabelLayer)
+        ]
+        self.assertEqual(len(labels), 2)
+        self.assertEqual(len(labels[0].styles), 2)
+        self.assertIsNone(labels[1].spacing)
+        self.assertEqual(labels[1].options["minZoom"], 2)
+
+        # each style is written once, whatever the number of labels
+        html = wm.save_html(None)
+        self.assertEqual(html.count("new wafermap.Labels("), 2)
+        self.assertEqual(html.count("{ font-size: 8pt; color: red; }"), 1)
+        self.assertEqual(html.count("{ font-size: 8pt; }"), 1)
+        self.assertEqual(
+            html.count(f"{{ {wafermap.WaferMap.DEFAULT_LABEL_HTML_STYLE} }}"), 1
+        )
+        self.assertNotIn("L.divIcon(", html)
+
+        with self.assertRaises(ValueError):
+            wm.add_labels(cells, numpy.zeros((len(cells), 2)), ["a"])
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_labels2.html"))
+
     def test_wafermap_style_cells1(self):
         cell_size = (26, 14)
         wm = wafermap.WaferMap(
@@ -713,6 +1567,146 @@ class FunctionalTestsWafermap(unittest.TestCase):
 
         wm.save_html(os.path.join(self.output_dir, "test_wafermap_style_cells1.html"))
 
+    def test_wafermap_style_cells2(self):
+        wm = wafermap.WaferMap(
+            wafer_radius=100,
+            cell_size=(10, 10),
+            coverage="full",
+        )
+        wm.style_cell(cell=None, cell_style={"fill": True, "fillColor": "red"})
+        wm.style_cell(cell=(0, 0), cell_style={"fillColor": "blue"})
+        wm.style_cell(cell=(1, 0), cell_style={"fillColor": "blue"})
+
+        # identical styles are stored once
+        self.assertEqual(len(wm._cell_styles), 3)
+        self.assertEqual(
+            wm._cell_styles[wm._cell_style_ids[wm._cell_map.row((0, 1))]],
+            {"color": "#142d2d", "weight": 0.2, "fill": True, "fillColor": "blue"},
+        )
+        self.assertEqual(numpy.count_nonzero(wm._cell_style_ids == 2), 2)
+
+        # the grid is a single layer, not one object per cell
+        html = wm.save_html(None)
+        self.assertEqual(html.count("L.geoJSON("), 1)
+        self.assertNotIn("L.rectangle(", html)
+        self.assertEqual(html.count('"type":"Polygon"'), len(wm))
+
+    def test_wafermap_style_cells3(self):
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=(10, 10))
+
+        def fill_color(cell):
+            return wm._cell_styles[
+                wm._cell_style_ids[wm._cell_map.row(cell[::-1])]
+            ].get("fillColor")
+
+        # categorical bins
+        bins = numpy.arange(len(wm)) % 3
+        wm.style_cells(None, bins, colormap={0: "red", 1: "green", 2: "blue"})
+        for cell, cell_bin in zip(wm.cell_indices.tolist()[:6], bins[:6]):
+            self.assertEqual(fill_color(cell), ["red", "green", "blue"][cell_bin])
+        with self.assertRaises(ValueError):
+            wm.style_cells(None, bins, colormap={0: "red"})
+        # categorical NaN values are left as they are too
+        wm.style_cells([(0, 0), (1, 0)], [numpy.nan, 2], colormap={0: "red", 2: "blue"})
+        self.assertEqual(
+            fill_color((0, 0)), ["red", "green", "blue"][bins[wm._cell_map.row((0, 0))]]
+        )
+        self.assertEqual(fill_color((1, 0)), "blue")
+        wm.style_cells(
+            [(0, 0), (1, 0)],
+            numpy.array(["a", numpy.nan], dtype=object),
+            colormap={"a": "red"},
+        )
+        self.assertEqual(fill_color((0, 0)), "red")
+        self.assertEqual(fill_color((1, 0)), "blue")
+        wm.style_cells(None, bins, colormap={0: "red", 1: "green", 2: "blue"})
+
+        # continuous values, NaN values are left as they are
+        cells = [(0, 0), (1, 0), (2, 0)]
+        wm.style_cells(cells, [0.0, numpy.nan, 10.0], colormap=["#000000", "#ffffff"])
+        self.assertEqual(fill_color((0, 0)), "#000000ff")
+        self.assertEqual(
+            fill_color((1, 0)), ["red", "green", "blue"][bins[wm._cell_map.row((0, 1))]]
+        )
+        self.assertEqual(fill_color((2, 0)), "#ffffffff")
+        self.assertLessEqual(
+            len(wm._cell_styles), 1 + 3 + wafermap.WaferMap.COLORMAP_LEVELS
+        )
+
+        # a plain style, same as style_cell
+        wm.style_cells([(0, 0)], cell_style={"color": "red"})
+        self.assertEqual(
+            wm._cell_styles[wm._cell_style_ids[wm._cell_map.row((0, 0))]]["color"],
+            "red",
+        )
+        with self.assertRaises(ValueError):
+            wm.style_cells([(100, 100)], cell_style={"color": "red"})
+        with self.assertRaises(ValueError):
+            wm.style_cells(cells, [1.0, 2.0])
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_style_cells3.html"))
+
+    def test_wafermap_grid_rendering(self):
+        with self.assertRaises(ValueError):
+            wafermap.WaferMap(wafer_radius=100, cell_size=(10, 10), grid_rendering="x")
+
+        # the parametric output does not grow with the number of cells
+        html_sizes = []
+        for cell_size in [(10, 10), (1, 1)]:
+            wm = wafermap.WaferMap(
+                wafer_radius=100,
+                cell_size=cell_size,
+                grid_rendering="parametric",
+            )
+            html = wm.save_html(None)
+            self.assertEqual(html.count("new wafermap.CellGrid("), 1)
+            self.assertEqual(html.count("new wafermap.CellLabels("), 1)
+            self.assertNotIn("L.geoJSON(", html)
+            self.assertNotIn("L.marker(", html)
+            html_sizes.append(len(html))
+        self.assertAlmostEqual(html_sizes[0], html_sizes[1], delta=100)
+
+        # styled cells are looked up in a dense box of style indices
+        wm.style_cell(cell=(3, -2), cell_style={"fill": True, "fillColor": "red"})
+        lookup = wm._grid_layer.style_lookup()
+        self.assertEqual(lookup["dtype"], "uint8")
+        dense = numpy.frombuffer(base64.b64decode(lookup["data"]), dtype=numpy.uint8)
+        dense = dense.reshape(lookup["height"], lookup["width"])
+        self.assertEqual(numpy.count_nonzero(dense), 1)
+        self.assertEqual(dense[-2 - lookup["y"], 3 - lookup["x"]], 1)
+        wm.save_html(os.path.join(self.output_dir, "test_wafermap_parametric.html"))
+
+    def test_wafermap_cell_labels(self):
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=(1, 1))
+        html = wm.save_html(None)
+        # a single label layer, without any per-cell marker
+        self.assertEqual(html.count("new wafermap.CellLabels("), 1)
+        self.assertNotIn("L.marker(", html)
+        self.assertNotIn("L.divIcon(", html)
+        self.assertEqual(html.count("var wafermap = (window.wafermap"), 1)
+
+        # drawn without a browser, half a cell size from the lower left corner of the
+        # cells as by the browser, and only if they fit in the cells
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=(30, 40), cell_margin=(4, 4))
+        wm._cell_labels_layer.show = True
+        texts = {
+            text.text: (float(text.get("x")), float(text.get("y")))
+            for text in ElementTree.fromstring(wm.save_svg(None)).iter(
+                "{http://www.w3.org/2000/svg}text"
+            )
+        }
+        self.assertEqual(len(texts), len(wm.cell_indices))
+        viewport = raster.Viewport(
+            wafermap.WaferMap.IMAGE_RESOLUTION,
+            [(-100, -100), (100, 100)],
+            wafermap.WaferMap.MAP_PADDING,
+        )
+        y0, x0 = wm._cell_map.bounds[wm._cell_map.row((0, 0)), 0]
+        x, y = viewport.project(y0 + 20, x0 + 15)
+        numpy.testing.assert_allclose(texts["(0, 0)"], (x, y), atol=0.01)
+        wm = wafermap.WaferMap(wafer_radius=100, cell_size=(1, 1))
+        wm._cell_labels_layer.show = True
+        self.assertNotIn("<text", wm.save_svg(None))
+
     def test_wafermap_example1(self):
         # define the wafermap
         cell_size = (10, 20)
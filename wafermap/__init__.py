@@ -1,5 +1,15 @@
 """Package initialization"""
 
-# from wafermap(package).wafermap(module) we import class WaferMap into the package
-# namespace.
-from wafermap.wafermap import WaferMap, WaferMapGrid
+# from wafermap(package).grid(module) we import class WaferMapGrid into the package
+# namespace. It only depends on NumPy.
+from wafermap.grid import WaferMapGrid
+
+
+def __getattr__(name: str):
+    # class WaferMap from wafermap(package).wafermap(module) is imported on first use,
+    # so that the rendering backend (folium, branca, ...) is only loaded when needed
+    if name == "WaferMap":
+        from wafermap.wafermap import WaferMap
+
+        return WaferMap
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
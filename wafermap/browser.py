@@ -0,0 +1,341 @@
+"""Pool of long-lived headless Chrome processes, driven over the DevTools protocol, to
+take screenshots of many pages without starting a browser for each"""
+
+import base64
+import itertools
+import json
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Union
+
+# resolves once the page has been laid out and painted
+PAINTED_SCRIPT = (
+    "new Promise(resolve => "
+    "requestAnimationFrame(() => requestAnimationFrame(resolve)))"
+)
+# resolves once the document and its resources have loaded
+LOADED_SCRIPT = (
+    "new Promise(resolve => document.readyState === 'complete' ? resolve() : "
+    "window.addEventListener('load', () => resolve(), {once: true}))"
+)
+
+
+class _HeadlessChrome:
+    """
+    A headless Chrome process with a single page, connected to over the websocket of
+    the DevTools protocol. The page is reused for every screenshot.
+    """
+
+    def __init__(
+        self,
+        executable: str,
+        flags: list[str],
+        resolution: tuple[int, int],
+        timeout: float,
+    ):
+        # websocket-client is only needed to take screenshots, so it is not imported
+        # with the module
+        import websocket
+
+        self.user_data_dir = tempfile.mkdtemp(prefix="wafermap-chrome-")
+        self.process = None
+        self.ws = None
+        self.session_id = None
+        self._ids = itertools.count(1)
+        self._events = []
+        self._websocket = websocket
+        self.deadline = time.monotonic() + timeout
+        try:
+            self.process = subprocess.Popen(
+                [
+                    executable,
+                    "--headless=new",
+                    "--remote-debugging-port=0",
+                    f"--user-data-dir={self.user_data_dir}",
+                    "--no-first-run",
+                    "--no-default-browser-check",
+                    "--hide-scrollbars",
+                    f"--window-size={resolution[0]},{resolution[1]}",
+                    *flags,
+                    "about:blank",
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            self.ws = websocket.create_connection(
+                self._devtools_url(), timeout=timeout, suppress_origin=True
+            )
+            target_id = self.send(
+                "Target.createTarget", session=False, url="about:blank"
+            )["targetId"]
+            self.session_id = self.send(
+                "Target.attachToTarget", session=False, targetId=target_id, flatten=True
+            )["sessionId"]
+            self.send("Page.enable")
+            self.send(
+                "Emulation.setDeviceMetricsOverride",
+                width=resolution[0],
+                height=resolution[1],
+                deviceScaleFactor=1,
+                mobile=False,
+            )
+            self.send(
+                "Emulation.setDefaultBackgroundColorOverride",
+                color={"r": 255, "g": 255, "b": 255, "a": 1},
+            )
+        except BaseException:
+            self.close()
+            raise
+
+    def _devtools_url(self) -> str:
+        """The browser websocket, that Chrome writes to its profile once it listens"""
+        port_file = os.path.join(self.user_data_dir, "DevToolsActivePort")
+        while True:
+            if os.path.isfile(port_file):
+                with open(port_file, encoding="utf-8") as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    return f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"Chrome exited on start with code {self.process.returncode}"
+                )
+            if time.monotonic() > self.deadline:
+                raise TimeoutError("Chrome did not start in time")
+            time.sleep(0.05)
+
+    def _receive(self) -> dict:
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Chrome did not respond in time")
+        self.ws.settimeout(remaining)
+        try:
+            return json.loads(self.ws.recv())
+        except self._websocket.WebSocketTimeoutException as e:
+            raise TimeoutError("Chrome did not respond in time") from e
+
+    def send(self, method: str, session: bool = True, **params) -> dict:
+        """Call a DevTools method and return its result, keeping the events received"""
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params}
+        if session:
+            message["sessionId"] = self.session_id
+        self.ws.send(json.dumps(message))
+        while True:
+            message = self._receive()
+            if message.get("id") == message_id:
+                if "error" in message:
+                    raise RuntimeError(
+                        f"{method} failed: {message['error'].get('message')}"
+                    )
+                return message.get("result", {})
+            if "method" in message:
+                self._events.append(message)
+
+    def wait_for(self, event: str) -> dict:
+        """Wait for an event of the page"""
+        while True:
+            while self._events:
+                message = self._events.pop(0)
+                if (
+                    message["method"] == event
+                    and message.get("sessionId") == self.session_id
+                ):
+                    return message.get("params", {})
+            message = self._receive()
+            if "method" in message:
+                self._events.append(message)
+
+    def screenshot(self, html: str, base_dir: str, timeout: float) -> bytes:
+        """
+        Load an HTML page in the page and return the PNG screenshot of it. The HTML is
+        sent over the DevTools protocol as the content of the page of base_dir,
+        without writing it to a file, so that its relative URLs, like those of tiles,
+        resolve against base_dir and local files can be loaded.
+        """
+        self.deadline = time.monotonic() + timeout
+        self._events.clear()
+        base_url = pathlib.Path(os.path.abspath(base_dir)).as_uri() + "/"
+        result = self.send("Page.navigate", url=base_url)
+        if result.get("errorText"):
+            raise RuntimeError(f"Could not load {base_dir}: {result['errorText']}")
+        frame_id = result["frameId"]
+        self.wait_for("Page.loadEventFired")
+        self.send("Page.setDocumentContent", frameId=frame_id, html=html)
+        for script in (LOADED_SCRIPT, PAINTED_SCRIPT):
+            self.send("Runtime.evaluate", expression=script, awaitPromise=True)
+        return base64.b64decode(
+            self.send("Page.captureScreenshot", format="png")["data"]
+        )
+
+    def close(self):
+        """Close the browser, killing it if it does not exit, and remove its profile"""
+        if self.ws is not None:
+            try:
+                self.deadline = time.monotonic() + 5
+                self.send("Browser.close", session=False)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            try:
+                self.ws.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self.ws = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+class BrowserPool:
+    """
+    A pool of headless Chrome processes that take screenshots of HTML pages. The
+    browsers are started on first use, up to size, and kept running between
+    screenshots, so that a batch of maps is bound by rendering instead of by
+    starting browsers. A browser that fails or times out on a page is replaced.
+    Use the pool as a context manager, or close it, to shut the browsers down.
+    :param size: The maximum number of browsers, and of concurrent screenshots.
+    :param timeout: The time limit of a screenshot in seconds, including the wait
+    for a free browser.
+    :param resolution: (width, height) of the screenshots in pixels.
+    :param executable: The path to Chrome or Chromium. If None, it is searched for
+    as by html2image.
+    :param flags: Extra command line flags of the browsers.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        timeout: float = 60.0,
+        resolution: tuple[int, int] = (2560, 1440),
+        executable: Union[str, None] = None,
+        flags: Union[list[str], None] = None,
+    ):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        self.size = size
+        self.timeout = timeout
+        self.resolution = tuple(resolution)
+        self.executable = executable
+        self.flags = list(flags or [])
+        self._idle = queue.LifoQueue()
+        self._browsers = set()
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def __enter__(self) -> "BrowserPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self, deadline: float) -> _HeadlessChrome:
+        if self.executable is None:
+            from html2image.browsers.search_utils import find_chrome
+
+            self.executable = find_chrome()
+        return _HeadlessChrome(
+            self.executable,
+            self.flags,
+            self.resolution,
+            max(deadline - time.monotonic(), 0.001),
+        )
+
+    def _acquire(self, deadline: float) -> _HeadlessChrome:
+        """An idle browser, a new one if the pool is not full, else the next freed"""
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("BrowserPool is closed")
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            start = len(self._browsers) < self.size
+            if start:
+                # a placeholder, so that concurrent starts do not exceed size
+                placeholder = object()
+                self._browsers.add(placeholder)
+        if start:
+            try:
+                browser = self._start(deadline)
+            finally:
+                with self._lock:
+                    self._browsers.discard(placeholder)
+            with self._lock:
+                self._browsers.add(browser)
+            return browser
+        try:
+            browser = self._idle.get(timeout=max(deadline - time.monotonic(), 0.001))
+        except queue.Empty as e:
+            raise TimeoutError("No browser of the pool became free in time") from e
+        if browser is None:
+            raise RuntimeError("BrowserPool is closed")
+        return browser
+
+    def _release(self, browser: _HeadlessChrome, failed: bool):
+        with self._lock:
+            if not failed and not self.closed:
+                self._idle.put(browser)
+                return
+            self._browsers.discard(browser)
+        browser.close()
+
+    def screenshot(
+        self,
+        html: str,
+        output_file: Union[str, None] = None,
+        base_dir: Union[str, None] = None,
+    ) -> Union[str, bytes]:
+        """
+        Save the PNG screenshot of an HTML page, and return output_file. If
+        output_file is None, return the PNG as bytes instead.
+        :param base_dir: The directory that the relative URLs of the page resolve
+        against. If None, the working directory.
+        """
+        deadline = time.monotonic() + self.timeout
+        browser = self._acquire(deadline)
+        failed = True
+        try:
+            png = browser.screenshot(
+                html, base_dir or os.getcwd(), max(deadline - time.monotonic(), 0.001)
+            )
+            failed = False
+        finally:
+            # a browser that failed a page may be stuck on it
+            self._release(browser, failed)
+        if output_file is None:
+            return png
+        with open(output_file, "wb") as f:
+            f.write(png)
+        return output_file
+
+    def close(self):
+        """Shut down the browsers, those busy with a screenshot when it finishes"""
+        with self._lock:
+            self.closed = True
+            idle = []
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            for browser in idle:
+                self._browsers.discard(browser)
+            # wake up the screenshots waiting for a browser
+            for _ in range(self.size):
+                self._idle.put(None)
+        for browser in idle:
+            browser.close()
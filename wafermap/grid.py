@@ -0,0 +1,781 @@
+"""WaferMapGrid class implementation. The geometry core only depends on NumPy."""
+
+import hashlib
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterator, Mapping
+from functools import cached_property
+from typing import Generator, NamedTuple, Union
+
+import numpy
+
+from wafermap import utils
+
+
+def _build_grid(
+    wafer_radius: float,
+    cell_size: tuple[float, float],
+    cell_margin: tuple[float, float],
+    cell_origin: tuple[int, int],
+    grid_offset: tuple[float, float],
+    coverage: str,
+    edge_exclusion: float = 0.0,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Compute the cells of a wafer grid with array operations.
+    All dimensions are expected already multiplied by the conversion factor. The
+    edge_exclusion is only used by the 'usable' coverage.
+    :return: (labels, bounds). labels is an (n, 2) int array of cell indices in (y, x),
+    bounds an (n, 5, 2) float array of (lower_left, lower_right, upper_left,
+    upper_right, center) points in (y, x). Cells are ordered x-major, y-minor.
+    """
+    cell_size_x, cell_size_y = cell_size
+    cell_margin_x, cell_margin_y = cell_margin
+    num_of_cells_x = math.ceil(2 * wafer_radius / cell_size_x)
+    num_of_cells_y = math.ceil(2 * wafer_radius / cell_size_y)
+    i_x = numpy.arange(
+        -math.ceil(num_of_cells_x / 2) - 1, math.ceil(num_of_cells_x / 2) + 1
+    )
+    i_y = numpy.arange(
+        -math.ceil(num_of_cells_y / 2) - 1, math.ceil(num_of_cells_y / 2) + 1
+    )
+
+    # The corner coordinates only depend on the column (x) or on the row (y) of the
+    # cell, so they are computed once per column and row and broadcast over the grid.
+    # The operation order of the scalar formulas is kept, so that the corners are
+    # bit-identical to the ones computed one cell at a time.
+    lower_bound_x = (i_x - 0.5) * (cell_size_x + cell_margin_x) + grid_offset[0]
+    upper_bound_x = (i_x + 0.5) * (cell_size_x + cell_margin_x) + grid_offset[0]
+    lower_bound_y = (i_y - 0.5) * (cell_size_y + cell_margin_y) + grid_offset[1]
+    upper_bound_y = (i_y + 0.5) * (cell_size_y + cell_margin_y) + grid_offset[1]
+    left_x = lower_bound_x + cell_margin_x / 2
+    right_x = lower_bound_x + cell_size_x - cell_margin_x / 2
+    upper_left_x = upper_bound_x - cell_size_x + cell_margin_x / 2
+    upper_right_x = upper_bound_x - cell_margin_x / 2
+    lower_y = lower_bound_y + cell_margin_y / 2
+    upper_y = upper_bound_y - cell_margin_y / 2
+
+    # (x, y) pairs of each corner: lower left, lower right, upper left, upper right
+    corners = (
+        (left_x, lower_y),
+        (right_x, lower_y),
+        (upper_left_x, upper_y),
+        (upper_right_x, upper_y),
+    )
+    reduce = numpy.logical_or if coverage == "full" else numpy.logical_and
+    limit_radius = (
+        wafer_radius - edge_exclusion if coverage == "usable" else wafer_radius
+    )
+    in_map = None
+    for corner_x, corner_y in corners:
+        corner_in = (
+            numpy.sqrt(
+                corner_y[numpy.newaxis, :] ** 2 + corner_x[:, numpy.newaxis] ** 2
+            )
+            <= limit_radius
+        )
+        in_map = corner_in if in_map is None else reduce(in_map, corner_in)
+
+    # x-major order, like the cell map has always been ordered
+    col, row = numpy.nonzero(in_map)
+    labels = numpy.column_stack((i_y[row] - cell_origin[1], i_x[col] - cell_origin[0]))
+    bounds = numpy.empty((col.size, 5, 2))
+    for i, (corner_x, corner_y) in enumerate(corners):
+        bounds[:, i, 0] = corner_y[row]
+        bounds[:, i, 1] = corner_x[col]
+    bounds[:, 4, 0] = (lower_y[row] + upper_y[row]) / 2
+    bounds[:, 4, 1] = (left_x[col] + right_x[col]) / 2
+    return labels, bounds
+
+
+class CellStore(Mapping):
+    """
+    Columnar store of the cells of a grid. It is a read-only mapping of cell index
+    (y, x) to the cell bounds (lower_left, lower_right, upper_left, upper_right,
+    center), where each point is (y, x), backed by contiguous arrays:
+    labels: (n, 2) int array of cell indices in (y, x)
+    bounds: (n, 5, 2) float array of the cell points in (y, x)
+    Cell indices are resolved to rows in O(1) through a dense lookup table that spans
+    the bounding box of the cell indices.
+    """
+
+    ITER_CHUNK_SIZE = 4096
+
+    def __init__(self, labels: numpy.ndarray, bounds: numpy.ndarray):
+        self.labels = numpy.ascontiguousarray(labels, dtype=numpy.int32)
+        self.bounds = numpy.ascontiguousarray(bounds, dtype=numpy.float64)
+        self.labels.flags.writeable = False
+        self.bounds.flags.writeable = False
+
+        if len(self.labels):
+            self._label_min = self.labels.min(axis=0)
+            lookup_shape = self.labels.max(axis=0) - self._label_min + 1
+        else:
+            self._label_min = numpy.zeros(2, dtype=numpy.int32)
+            lookup_shape = (0, 0)
+        self._rows = numpy.full(lookup_shape, -1, dtype=numpy.int32)
+        self._rows[
+            self.labels[:, 0] - self._label_min[0],
+            self.labels[:, 1] - self._label_min[1],
+        ] = numpy.arange(len(self.labels), dtype=numpy.int32)
+
+    def row(self, label: tuple[int, int]) -> int:
+        """Return the row of the cell (y, x) in the arrays, -1 if it does not exist"""
+        i_y = int(label[0]) - int(self._label_min[0])
+        i_x = int(label[1]) - int(self._label_min[1])
+        if 0 <= i_y < self._rows.shape[0] and 0 <= i_x < self._rows.shape[1]:
+            return int(self._rows[i_y, i_x])
+        return -1
+
+    def rows(self, labels: numpy.ndarray) -> numpy.ndarray:
+        """
+        Vectorized row: return the rows of the (n, 2) cell indices (y, x), -1 for the
+        cells that do not exist
+        """
+        labels = numpy.asarray(labels, dtype=numpy.int64).reshape(-1, 2)
+        i_y = labels[:, 0] - self._label_min[0]
+        i_x = labels[:, 1] - self._label_min[1]
+        in_lookup = (
+            (i_y >= 0)
+            & (i_y < self._rows.shape[0])
+            & (i_x >= 0)
+            & (i_x < self._rows.shape[1])
+        )
+        rows = numpy.full(len(labels), -1, dtype=numpy.int64)
+        rows[in_lookup] = self._rows[i_y[in_lookup], i_x[in_lookup]]
+        return rows
+
+    def to_dense(
+        self, values: numpy.ndarray, fill_value=0
+    ) -> tuple[tuple[int, int], numpy.ndarray]:
+        """
+        Scatter per-cell values, in row order, into the dense (y, x) box that spans
+        the cell indices. Positions without a cell are set to fill_value.
+        :return: ((y, x) cell index of the first box element, (height, width) array)
+        """
+        values = numpy.asarray(values)
+        dense = numpy.full(self._rows.shape, fill_value, dtype=values.dtype)
+        in_grid = self._rows >= 0
+        dense[in_grid] = values[self._rows[in_grid]]
+        return (int(self._label_min[0]), int(self._label_min[1])), dense
+
+    def __getitem__(self, label: tuple[int, int]) -> tuple:
+        row = self.row(label)
+        if row < 0:
+            raise KeyError(label)
+        return tuple(map(tuple, self.bounds[row].tolist()))
+
+    def __contains__(self, label) -> bool:
+        try:
+            return self.row(label) >= 0
+        except (TypeError, ValueError, IndexError):
+            return False
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return self.iter_labels()
+
+    def iter_labels(self, swap: bool = False) -> Generator[tuple[int, int], None, None]:
+        """
+        Iterate over the cell indices, (y, x) or (x, y) if swap. A fresh generator is
+        returned on every call, converting the labels array in chunks.
+        """
+        labels = self.labels[:, ::-1] if swap else self.labels
+        for start in range(0, len(labels), CellStore.ITER_CHUNK_SIZE):
+            yield from map(
+                tuple, labels[start : start + CellStore.ITER_CHUNK_SIZE].tolist()
+            )
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class CellMapView(Mapping):
+    """
+    Read-only (x, y) view of a CellStore: maps cell index (x, y) to the cell bounds
+    (lower_left, lower_right, upper_left, upper_right, center), where each point is
+    (x, y). Items are swapped on access, nothing is copied up front.
+    """
+
+    def __init__(self, cell_store: CellStore):
+        self._cell_store = cell_store
+
+    def __getitem__(self, cell: tuple[int, int]) -> tuple:
+        row = self._cell_store.row((cell[1], cell[0]))
+        if row < 0:
+            raise KeyError(cell)
+        return tuple(map(tuple, self._cell_store.bounds[row, :, ::-1].tolist()))
+
+    def __contains__(self, cell) -> bool:
+        try:
+            return self._cell_store.row((cell[1], cell[0])) >= 0
+        except (TypeError, ValueError, IndexError):
+            return False
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return self._cell_store.iter_labels(swap=True)
+
+    def __len__(self) -> int:
+        return len(self._cell_store)
+
+
+class GridCache:
+    """
+    Memoization of grid construction, keyed on the grid parameters. Grids live in an
+    in-process LRU of at most maxsize entries and max_bytes of cell arrays and, if
+    cache_dir is set, are also stored as .npz files in that directory, so they can be
+    shared across processes and runs. A grid larger than max_bytes is not kept in
+    memory. Cached CellStores are immutable and shared by all the grids built with
+    the same parameters. A maxsize or max_bytes of 0 disables the in-process cache.
+    """
+
+    FILE_PREFIX = "wafermap_grid_"
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        maxsize: int = 32,
+        cache_dir: Union[str, None] = None,
+        max_bytes: int = 64 * 2**20,
+    ):
+        if maxsize < 0:
+            raise ValueError("maxsize must be non-negative")
+        if max_bytes < 0:
+            raise ValueError("max_bytes must be non-negative")
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._cell_stores = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the cell arrays kept in memory"""
+        return self._nbytes
+
+    @staticmethod
+    def _cell_store_nbytes(cell_store: CellStore) -> int:
+        return cell_store.labels.nbytes + cell_store.bounds.nbytes
+
+    def _evict(self):
+        while self._cell_stores and (
+            len(self._cell_stores) > self.maxsize or self._nbytes > self.max_bytes
+        ):
+            _, cell_store = self._cell_stores.popitem(last=False)
+            self._nbytes -= GridCache._cell_store_nbytes(cell_store)
+
+    def __len__(self) -> int:
+        return len(self._cell_stores)
+
+    def get(self, key: tuple, build: Callable[[], CellStore]) -> CellStore:
+        """Return the CellStore cached for key, calling build() on a miss"""
+        with self._lock:
+            cell_store = self._cell_stores.get(key)
+            if cell_store is not None:
+                self._cell_stores.move_to_end(key)
+                return cell_store
+
+        cell_store = self._load(key)
+        if cell_store is None:
+            cell_store = build()
+            self._dump(key, cell_store)
+
+        nbytes = GridCache._cell_store_nbytes(cell_store)
+        with self._lock:
+            if key not in self._cell_stores and nbytes <= self.max_bytes:
+                self._cell_stores[key] = cell_store
+                self._nbytes += nbytes
+                self._evict()
+        return cell_store
+
+    def resize(self, maxsize: int, max_bytes: Union[int, None] = None):
+        """
+        Change the number of grids, and if given the bytes of cell arrays, kept in
+        memory, evicting the least recent grids
+        """
+        if maxsize < 0:
+            raise ValueError("maxsize must be non-negative")
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError("max_bytes must be non-negative")
+        with self._lock:
+            self.maxsize = maxsize
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self, disk: bool = False):
+        """Empty the in-process cache and, if disk, delete the cache files too"""
+        with self._lock:
+            self._cell_stores.clear()
+            self._nbytes = 0
+        if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.startswith(GridCache.FILE_PREFIX):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def _cache_file(self, key: tuple) -> str:
+        digest = hashlib.sha1(
+            repr((GridCache.FORMAT_VERSION, key)).encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{GridCache.FILE_PREFIX}{digest}.npz")
+
+    def _load(self, key: tuple) -> Union[CellStore, None]:
+        if not self.cache_dir:
+            return None
+        try:
+            with numpy.load(self._cache_file(key)) as cached:
+                return CellStore(cached["labels"], cached["bounds"])
+        except (OSError, KeyError, ValueError):
+            # missing, unreadable or incomplete file, the grid is rebuilt
+            return None
+
+    def _dump(self, key: tuple, cell_store: CellStore):
+        if not self.cache_dir:
+            return
+        temp_file = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, so that concurrent readers never see a
+            # partially written cache file
+            file_descriptor, temp_file = tempfile.mkstemp(
+                suffix=".npz", prefix=GridCache.FILE_PREFIX, dir=self.cache_dir
+            )
+            with os.fdopen(file_descriptor, "wb") as file:
+                numpy.savez(file, labels=cell_store.labels, bounds=cell_store.bounds)
+            os.replace(temp_file, self._cache_file(key))
+        except OSError:
+            # an unwritable cache_dir only costs the caching of the grid
+            if temp_file is not None and os.path.exists(temp_file):
+                os.remove(temp_file)
+
+
+class GridOffsetSweep(NamedTuple):
+    """Result of WaferMapGrid.optimize_grid_offset"""
+
+    best_offset: tuple[float, float]  # (x, y) grid offset with the most cells
+    best_count: int  # number of cells at best_offset
+    offsets_x: numpy.ndarray  # (kx,) swept x offsets
+    offsets_y: numpy.ndarray  # (ky,) swept y offsets
+    counts: numpy.ndarray  # (kx, ky) number of cells for each (x, y) offset
+
+
+class WaferMapGrid:
+
+    GRID_CACHE = GridCache()
+    # cell classes of cell_class
+    CELL_INSIDE = 0  # fully inside the edge exclusion ring
+    CELL_PARTIAL = 1  # partially inside the edge exclusion ring
+    CELL_EDGE_EXCLUSION = 2  # on the wafer, but fully in the edge exclusion
+    CELL_OFF_WAFER = 3  # fully outside the wafer
+
+    def __init__(
+        self,
+        wafer_radius: float,
+        cell_size: tuple[float, float],
+        cell_margin: tuple[float, float] = (0.0, 0.0),
+        cell_origin: tuple[int, int] = (0, 0),
+        grid_offset: tuple[float, float] = (0.0, 0.0),
+        edge_exclusion: float = 3.0,
+        coverage="full",
+        conversion_factor: float = 1.0,
+    ):
+        """
+        The WaferMap base class. Represents a circular wafer layout, with a grid, an edge exclusion and cells.
+        :param wafer_radius: Wafer radius in mm
+        :param cell_size: Cell size in mm, (x, y)
+        :param cell_margin: Distance between cells in mm, (x, y)
+        :param cell_origin: The cell (x, y), that is the origin of the map (position (0, 0) on the map). (0, 0) is by convention the center of the map.
+        :param grid_offset: Grid offset in mm, (x, y)
+        :param edge_exclusion: Margin from the wafer edge where no cells are allowed. It is honoured by the 'usable' coverage and by cell_class.
+        :param coverage: Options of 'full', 'inner', 'usable'. Option 'full' will cover the whole wafer with cells, so partial cells are allowed. Option 'inner' only allows full cells to be included. Option 'usable' only allows full cells inside the edge exclusion ring
+        :param conversion_factor: Factor to multiply input dimensions with.
+        """
+
+        # input validation
+        if any(
+            [
+                wafer_radius <= 0,
+                len(cell_size) != 2,
+                len(cell_margin) != 2,
+                len(cell_origin) != 2,
+                len(grid_offset) != 2,
+                edge_exclusion < 0,
+                any([cell_size[0] <= 0, cell_size[1] <= 0]),
+                any([cell_margin[0] < 0, cell_margin[1] < 0]),
+                coverage.lower() not in ["inner", "full", "usable"],
+                coverage.lower() == "usable" and edge_exclusion >= wafer_radius,
+            ]
+        ):
+            raise ValueError("Invalid input")
+
+        self.conversion_factor = conversion_factor
+        self.coverage = coverage.lower()
+        self.cell_size_x = self.conversion_factor * cell_size[0]
+        self.cell_size_y = self.conversion_factor * cell_size[1]
+        self.cell_margin_x = self.conversion_factor * cell_margin[0]
+        self.cell_margin_y = self.conversion_factor * cell_margin[1]
+        self.cell_origin_x = int(cell_origin[0])
+        self.cell_origin_y = int(cell_origin[1])
+        self.wafer_radius = self.conversion_factor * wafer_radius
+        self.edge_exclusion = self.conversion_factor * edge_exclusion
+        self.grid_offset_x = self.conversion_factor * grid_offset[0]
+        self.grid_offset_y = self.conversion_factor * grid_offset[1]
+        self._num_of_cells_x = math.ceil(2 * self.wafer_radius / self.cell_size_x)
+        self._num_of_cells_y = math.ceil(2 * self.wafer_radius / self.cell_size_y)
+
+        # init the _cell_map
+        # the cell map is a CellStore that corresponds the pixel coordinates of the
+        # bounding box of each cell to the cell index:
+        # {(cell_y, cell_x): ((y_lower_left, x_lower_left),
+        #                     (y_lower_right, x_lower_right),
+        #                     (y_upper_left, x_upper_left),
+        #                     (y_upper_right, x_upper_right),
+        #                     (y_cell_center, x_cell_center)
+        #                     )}
+        # We consider the cell origin to be its lower left corner
+        # y is latitude, x is longitude
+        # Grids with the same parameters are identical, so they are built once and
+        # shared through the GRID_CACHE
+        grid_parameters = dict(
+            wafer_radius=self.wafer_radius,
+            cell_size=(self.cell_size_x, self.cell_size_y),
+            cell_margin=(self.cell_margin_x, self.cell_margin_y),
+            cell_origin=(self.cell_origin_x, self.cell_origin_y),
+            grid_offset=(self.grid_offset_x, self.grid_offset_y),
+            coverage=self.coverage,
+            edge_exclusion=self.edge_exclusion if self.coverage == "usable" else 0.0,
+        )
+        self._grid_parameters = grid_parameters
+        self._cell_map = WaferMapGrid.GRID_CACHE.get(
+            tuple(grid_parameters.items()),
+            lambda: CellStore(*_build_grid(**grid_parameters)),
+        )
+
+    def __getitem__(self, item):
+        # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we provide
+        # cell_map as a property to interface with outside the class, which fully converts _cell_map from (y,x) to (x,y)
+        y, x = item
+        return self._cell_map[(y, x)]
+
+    def __iter__(self) -> Generator[tuple[int, int], None, None]:
+        # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we yield
+        # cells as (x, y). Every call returns an independent iterator.
+        return self._cell_map.iter_labels(swap=True)
+
+    def __len__(self):
+        return len(self._cell_map)
+
+    @cached_property
+    def cell_map(self) -> CellMapView:
+        # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we provide
+        # cell_map as a read-only view to interface with outside the class, which converts cells of _cell_map from
+        # (y,x) to (x,y) on access
+        return CellMapView(self._cell_map)
+
+    @property
+    def cell_indices(self) -> numpy.ndarray:
+        """Read-only (n, 2) array of the cell indices in (x, y). No copy is made."""
+        return self._cell_map.labels[:, ::-1]
+
+    @property
+    def cell_bounds(self) -> numpy.ndarray:
+        """
+        Read-only (n, 5, 2) array of the cell points (lower_left, lower_right,
+        upper_left, upper_right, center) in (x, y), in the order of cell_indices. No
+        copy is made.
+        """
+        return self._cell_map.bounds[:, :, ::-1]
+
+    @property
+    def cell_area_fraction(self) -> numpy.ndarray:
+        """
+        (n,) array of the fraction of each cell area that lies on the wafer, in the
+        order of cell_indices. The area is computed analytically.
+        """
+        return self._cell_coverage[0]
+
+    @property
+    def cell_class(self) -> numpy.ndarray:
+        """
+        (n,) array of the class of each cell with respect to the edge exclusion, in
+        the order of cell_indices: one of CELL_INSIDE, CELL_PARTIAL,
+        CELL_EDGE_EXCLUSION, CELL_OFF_WAFER.
+        """
+        return self._cell_coverage[1]
+
+    @cached_property
+    def _cell_coverage(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # area fraction and class of all cells, computed in one pass
+        lower_left = self._cell_map.bounds[:, 0]
+        upper_right = self._cell_map.bounds[:, 3]
+        y_min, x_min = lower_left[:, 0], lower_left[:, 1]
+        y_max, x_max = upper_right[:, 0], upper_right[:, 1]
+        usable_radius = self.wafer_radius - self.edge_exclusion
+
+        # distance of the nearest point and of the farthest corner of each cell from
+        # the wafer center
+        nearest = numpy.hypot(
+            numpy.maximum(0.0, numpy.maximum(x_min, -x_max)),
+            numpy.maximum(0.0, numpy.maximum(y_min, -y_max)),
+        )
+        corners = self._cell_map.bounds[:, :4]
+        farthest = numpy.sqrt(corners[..., 0] ** 2 + corners[..., 1] ** 2).max(axis=1)
+
+        area_fraction = utils.circle_rectangle_area(
+            x_min, y_min, x_max, y_max, self.wafer_radius
+        ) / ((x_max - x_min) * (y_max - y_min))
+        area_fraction = numpy.clip(area_fraction, 0.0, 1.0)
+        area_fraction[farthest <= self.wafer_radius] = 1.0
+        area_fraction[nearest >= self.wafer_radius] = 0.0
+
+        cell_class = numpy.select(
+            [
+                farthest <= usable_radius,
+                nearest < usable_radius,
+                nearest < self.wafer_radius,
+            ],
+            [
+                WaferMapGrid.CELL_INSIDE,
+                WaferMapGrid.CELL_PARTIAL,
+                WaferMapGrid.CELL_EDGE_EXCLUSION,
+            ],
+            default=WaferMapGrid.CELL_OFF_WAFER,
+        ).astype(numpy.int8)
+
+        area_fraction.flags.writeable = False
+        cell_class.flags.writeable = False
+        return area_fraction, cell_class
+
+    def optimize_grid_offset(
+        self,
+        offsets_x: Union[numpy.ndarray, None] = None,
+        offsets_y: Union[numpy.ndarray, None] = None,
+        steps: tuple[int, int] = (100, 100),
+        coverage: Union[str, None] = None,
+    ) -> GridOffsetSweep:
+        """
+        Count the cells of the grid for a sweep of grid offsets and find the offset that
+        maximizes them, e.g. the gross die per wafer with coverage 'usable'. Cell size,
+        margin, edge exclusion and wafer radius are the ones of this grid. The counts
+        are computed with binary searches over per-row/per-column corner distances,
+        without building any grid. The cell origin does not change the counts.
+        :param offsets_x: x grid offsets in mm to sweep. If None, steps[0] offsets evenly
+        spaced over one grid pitch are swept, as the count is periodic in the pitch.
+        :param offsets_y: y grid offsets in mm to sweep. If None, see offsets_x.
+        :param steps: Number of (x, y) offsets swept when offsets_x or offsets_y is None.
+        :param coverage: Options of 'full', 'inner', 'usable', see __init__. If None,
+        the coverage of this grid is used.
+        :return: GridOffsetSweep with the best offset and the full count landscape.
+        """
+        coverage = self.coverage if coverage is None else coverage.lower()
+        if coverage not in ["inner", "full", "usable"]:
+            raise ValueError("Invalid input")
+        limit_radius = self.wafer_radius
+        if coverage == "usable":
+            limit_radius -= self.edge_exclusion
+
+        def grid_lines(offsets, steps, cell_size, cell_margin):
+            # offsets swept and, for every offset, the lower and upper bound
+            # coordinates of every row or column, with the formulas of _build_grid:
+            # (k,), (k, n), (k, n)
+            pitch = cell_size + cell_margin
+            if offsets is None:
+                offsets = numpy.arange(steps) * (pitch / steps)
+            else:
+                offsets = numpy.asarray(offsets, dtype=float) * self.conversion_factor
+            num_of_cells = math.ceil(self.wafer_radius / pitch) + 2
+            i_cell = numpy.arange(-num_of_cells, num_of_cells + 1)[numpy.newaxis, :]
+            lower_bound = (i_cell - 0.5) * pitch + offsets[:, numpy.newaxis]
+            upper_bound = (i_cell + 0.5) * pitch + offsets[:, numpy.newaxis]
+            return offsets, lower_bound, upper_bound
+
+        offsets_x, lower_bound_x, upper_bound_x = grid_lines(
+            offsets_x, steps[0], self.cell_size_x, self.cell_margin_x
+        )
+        offsets_y, lower_bound_y, upper_bound_y = grid_lines(
+            offsets_y, steps[1], self.cell_size_y, self.cell_margin_y
+        )
+        # x of the lower (left, right) and upper (left, right) corners of each column
+        lower_corners_x = (
+            lower_bound_x + self.cell_margin_x / 2,
+            lower_bound_x + self.cell_size_x - self.cell_margin_x / 2,
+        )
+        upper_corners_x = (
+            upper_bound_x - self.cell_size_x + self.cell_margin_x / 2,
+            upper_bound_x - self.cell_margin_x / 2,
+        )
+        # for every row: how much of the squared radius is left for the squared x of
+        # the lower and of the upper corners, (ky * ny,)
+        remaining_lower = (
+            limit_radius**2 - (lower_bound_y + self.cell_margin_y / 2) ** 2
+        ).ravel()
+        remaining_upper = (
+            limit_radius**2 - (upper_bound_y - self.cell_margin_y / 2) ** 2
+        ).ravel()
+
+        # A column is in for a row if its lower corners fit in remaining_lower and/or
+        # its upper corners fit in remaining_upper. The nearest ('full') or farthest
+        # corner of each pair decides. On either side of the wafer center these values
+        # grow monotonically with the distance of the column from the center, so the
+        # columns that fit are found with binary searches and the pair of conditions
+        # combines into min (and) or max (or) of the two counts. The few columns that
+        # straddle the center are checked directly.
+        if coverage == "full":
+            select, combine, condition = numpy.minimum, numpy.maximum, numpy.logical_or
+        else:
+            select, combine, condition = numpy.maximum, numpy.minimum, numpy.logical_and
+        lower_distances = select(lower_corners_x[0] ** 2, lower_corners_x[1] ** 2)
+        upper_distances = select(upper_corners_x[0] ** 2, upper_corners_x[1] ** 2)
+        min_x = numpy.minimum(lower_corners_x[0], upper_corners_x[0])
+        max_x = numpy.maximum(lower_corners_x[1], upper_corners_x[1])
+
+        counts = numpy.empty((len(offsets_x), len(offsets_y)), dtype=numpy.int64)
+        for i_offset in range(len(offsets_x)):
+            right = min_x[i_offset] >= 0
+            left = max_x[i_offset] <= 0
+            straddle = ~(right | left)
+            count = numpy.zeros(remaining_lower.shape, dtype=numpy.int64)
+            for side, order in ((right, slice(None)), (left, slice(None, None, -1))):
+                count += combine(
+                    numpy.searchsorted(
+                        lower_distances[i_offset, side][order],
+                        remaining_lower,
+                        side="right",
+                    ),
+                    numpy.searchsorted(
+                        upper_distances[i_offset, side][order],
+                        remaining_upper,
+                        side="right",
+                    ),
+                )
+            count += condition(
+                lower_distances[i_offset, straddle][:, numpy.newaxis]
+                <= remaining_lower,
+                upper_distances[i_offset, straddle][:, numpy.newaxis]
+                <= remaining_upper,
+            ).sum(axis=0)
+            counts[i_offset] = count.reshape(lower_bound_y.shape).sum(axis=1)
+
+        offsets_x = offsets_x / self.conversion_factor
+        offsets_y = offsets_y / self.conversion_factor
+
+        i_best_x, i_best_y = numpy.unravel_index(numpy.argmax(counts), counts.shape)
+        return GridOffsetSweep(
+            best_offset=(float(offsets_x[i_best_x]), float(offsets_y[i_best_y])),
+            best_count=int(counts[i_best_x, i_best_y]),
+            offsets_x=offsets_x,
+            offsets_y=offsets_y,
+            counts=counts,
+        )
+
+    def cell_to_wafer_coordinates(
+        self,
+        cell: Union[tuple[int, int], None] = (0, 0),
+        offset: tuple[float, float] = (0.0, 0.0),
+    ) -> tuple[float, float]:
+        """
+        Convert cell coordinates to wafer coordinates
+        """
+        if cell:
+            row = self._cell_map.row(cell)
+            if row >= 0:
+                # offset is cell coordinates
+                origin = self._cell_map.bounds[row, 0].tolist()
+                wafer_coords = (
+                    offset[0] + origin[0],
+                    offset[1] + origin[1],
+                )
+            else:
+                raise ValueError(f"{str(cell)} does not exist in wafermap.")
+        else:
+            # offset is already wafer coordinates
+            wafer_coords = offset
+
+        return wafer_coords
+
+    def cell_to_wafer(
+        self,
+        cells: Union[numpy.ndarray, None],
+        offsets: numpy.ndarray,
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Vectorized conversion of cell coordinates to wafer coordinates, the inverse of
+        wafer_to_cell. Unlike cell_to_wafer_coordinates, which converts a single cell
+        (y, x) and offset in internal units, cells, offsets and wafer coordinates are
+        (x, y) and in mm, and unknown cells are flagged instead of raising.
+        :param cells: (n, 2) array of cell indices (x, y). If None is passed, the offsets
+        are interpreted as (x, y) wafer coordinates.
+        :param offsets: (n, 2) array of (x, y) offsets from the cell origin in mm. Cell
+        origin is the bottom left corner.
+        :return: (wafer_coordinates, valid). wafer_coordinates is an (n, 2) array of
+        (x, y) wafer coordinates in mm, valid an (n,) bool array, False for cells that
+        do not exist in the wafermap. The coordinates of invalid cells are NaN.
+        """
+        offsets = numpy.asarray(offsets, dtype=float).reshape(-1, 2)
+        if cells is None:
+            return offsets.copy(), numpy.ones(len(offsets), dtype=bool)
+
+        cells = numpy.asarray(cells).reshape(-1, 2)
+        if len(cells) != len(offsets):
+            raise ValueError("cells and offsets must have the same length")
+        rows = self._cell_map.rows(cells[:, ::-1])
+        valid = rows >= 0
+        wafer_coordinates = numpy.full(offsets.shape, numpy.nan)
+        # lower left corner of the cells, swapped from (y, x) to (x, y)
+        origins = self._cell_map.bounds[rows[valid], 0, ::-1]
+        wafer_coordinates[valid] = (
+            offsets[valid] * self.conversion_factor + origins
+        ) / self.conversion_factor
+        return wafer_coordinates, valid
+
+    def wafer_to_cell(
+        self, wafer_coordinates: numpy.ndarray
+    ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        Vectorized conversion of wafer coordinates to cells. The cells are found with
+        closed-form arithmetic on the grid pitch, so the cost is independent of the
+        number of cells.
+        :param wafer_coordinates: (n, 2) array of (x, y) wafer coordinates in mm.
+        :return: (cells, offsets, valid). cells is an (n, 2) int array of cell indices
+        (x, y), offsets an (n, 2) array of (x, y) offsets in mm from the cell origin
+        (bottom left corner) and valid an (n,) bool array, False for the points that
+        fall in a cell margin or in a cell that is not part of the map. cells and
+        offsets of invalid points refer to the nearest grid pitch and are only
+        meaningful for points in a margin.
+        """
+        wafer_coordinates = numpy.asarray(wafer_coordinates, dtype=float).reshape(-1, 2)
+        cells = numpy.empty(wafer_coordinates.shape, dtype=numpy.int64)
+        offsets = numpy.empty(wafer_coordinates.shape)
+        valid = numpy.ones(len(wafer_coordinates), dtype=bool)
+        for axis, (cell_size, cell_margin, grid_offset, cell_origin) in enumerate(
+            (
+                (
+                    self.cell_size_x,
+                    self.cell_margin_x,
+                    self.grid_offset_x,
+                    self.cell_origin_x,
+                ),
+                (
+                    self.cell_size_y,
+                    self.cell_margin_y,
+                    self.grid_offset_y,
+                    self.cell_origin_y,
+                ),
+            )
+        ):
+            pitch = cell_size + cell_margin
+            coordinate = wafer_coordinates[:, axis] * self.conversion_factor
+            # the pitch i spans [(i - 0.5) * pitch, (i + 0.5) * pitch) + grid_offset
+            i_pitch = numpy.floor((coordinate - grid_offset) / pitch + 0.5)
+            lower_left = (i_pitch - 0.5) * pitch + grid_offset + cell_margin / 2
+            offset = coordinate - lower_left
+            if cell_margin > 0:
+                valid &= (offset >= 0) & (offset <= cell_size)
+            cells[:, axis] = i_pitch.astype(numpy.int64) - cell_origin
+            offsets[:, axis] = offset / self.conversion_factor
+
+        valid &= self._cell_map.rows(cells[:, ::-1]) >= 0
+        return cells, offsets, valid
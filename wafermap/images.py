@@ -0,0 +1,523 @@
+"""Image thumbnails, read lazily and shared between maps through a cache, and tile
+pyramids of large images"""
+
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property
+from io import BytesIO
+from typing import Union
+
+from PIL import ExifTags, Image, ImageFile
+
+
+def thumbnail_size(
+    image_size: tuple[int, int], max_size: tuple[int, int]
+) -> tuple[int, int]:
+    """
+    The size of the thumbnail of an image, with the same rounding as
+    PIL.Image.thumbnail, without decoding the image.
+    """
+    width, height = image_size
+    x, y = map(math.floor, max_size)
+    if x >= width and y >= height:
+        return width, height
+
+    def round_aspect(number: float, key) -> int:
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+
+class Thumbnail:
+    """
+    The JPEG thumbnail of an image file. Only the image header is read on creation,
+    the image is decoded and encoded on the first access of jpeg.
+    :param path: The path to the image file.
+    :param max_size: The maximum (width, height) of the thumbnail in pixels.
+    """
+
+    def __init__(self, path: str, max_size: tuple[int, int]):
+        self.path = path
+        self.max_size = tuple(max_size)
+        with Image.open(path) as image:
+            self.image_size = image.size
+        self.size = thumbnail_size(self.image_size, self.max_size)
+        self._jpeg = None
+        self._lock = threading.Lock()
+
+    @property
+    def jpeg(self) -> bytes:
+        """The JPEG encoded thumbnail"""
+        with self._lock:
+            if self._jpeg is None:
+                with Image.open(self.path) as image:
+                    image.thumbnail(self.max_size)
+                    if image.mode not in ("RGB", "L", "CMYK"):
+                        image = image.convert("RGB")
+                    buffered = BytesIO()
+                    image.save(buffered, "JPEG")
+                self._jpeg = buffered.getvalue()
+        return self._jpeg
+
+    @cached_property
+    def digest(self) -> str:
+        """Content hash of the JPEG thumbnail"""
+        return hashlib.sha1(self.jpeg).hexdigest()
+
+
+class ThumbnailCache:
+    """
+    Cache of thumbnails, keyed on the image path, modification time and size and on
+    the thumbnail size, so that images that recur across maps are only read once.
+    Thumbnails live in an in-process LRU of maxsize entries. A maxsize of 0 disables
+    the cache.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        if maxsize < 0:
+            raise ValueError("maxsize must be non-negative")
+        self.maxsize = maxsize
+        self._thumbnails = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._thumbnails)
+
+    def get(self, path: str, max_size: tuple[int, int]) -> Thumbnail:
+        """Return the cached thumbnail of the image file, reading its header on a miss"""
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size, tuple(max_size))
+        with self._lock:
+            thumbnail = self._thumbnails.get(key)
+            if thumbnail is not None:
+                self._thumbnails.move_to_end(key)
+                return thumbnail
+
+        thumbnail = Thumbnail(path, max_size)
+
+        with self._lock:
+            if self.maxsize > 0:
+                # keep the first thumbnail of concurrent misses, it may be encoded
+                thumbnail = self._thumbnails.setdefault(key, thumbnail)
+                self._thumbnails.move_to_end(key)
+                while len(self._thumbnails) > self.maxsize:
+                    self._thumbnails.popitem(last=False)
+        return thumbnail
+
+    def get_many(
+        self,
+        paths: Iterable[str],
+        max_size: tuple[int, int],
+        encode: bool = False,
+        max_workers: Union[int, None] = None,
+    ) -> list[Thumbnail]:
+        """
+        Return the thumbnails of many image files, read in a thread pool. If encode,
+        the thumbnails are also decoded and encoded in the pool.
+        """
+
+        def load(path: str) -> Thumbnail:
+            thumbnail = self.get(path, max_size)
+            if encode:
+                thumbnail.jpeg
+            return thumbnail
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(load, paths))
+
+    def resize(self, maxsize: int):
+        """Change the number of thumbnails kept, evicting the least recent ones"""
+        if maxsize < 0:
+            raise ValueError("maxsize must be non-negative")
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._thumbnails) > self.maxsize:
+                self._thumbnails.popitem(last=False)
+
+    def clear(self):
+        """Empty the cache"""
+        with self._lock:
+            self._thumbnails.clear()
+
+
+TILE_FORMATS = {"png": ("PNG", ".png"), "jpeg": ("JPEG", ".jpg")}
+# the default size limit of the images cut into tile pyramids, instead of the
+# decompression bomb limit of PIL, that large mosaics exceed
+MAX_TILED_IMAGE_PIXELS = 2**34
+# the support of the LANCZOS filter, in pixels of the resampled image
+LANCZOS_SUPPORT = 3.0
+
+
+def tile_pyramid_zooms(
+    image_size: tuple[int, int],
+    bounds: tuple[tuple[float, float], tuple[float, float]],
+    tile_size: int = 256,
+    min_zoom: int = 0,
+) -> tuple[int, int]:
+    """
+    The (min, max) zoom levels of the tile pyramid of an image. At the max zoom, a
+    screen pixel is at most an image pixel. At the min zoom, the image fits in a tile
+    (or min_zoom is reached).
+    :param image_size: (width, height) of the image in pixels.
+    :param bounds: [lower_left, upper_right] of the image in map units (y, x).
+    """
+    (y0, x0), (y1, x1) = bounds
+    extent = max(x1 - x0, y1 - y0)
+    max_zoom = math.ceil(
+        math.log2(max(image_size[0] / (x1 - x0), image_size[1] / (y1 - y0)))
+    )
+    max_zoom = max(max_zoom, min_zoom)
+    fit_zoom = math.floor(math.log2(tile_size / extent))
+    return min(max(fit_zoom, min_zoom), max_zoom), max_zoom
+
+
+def _tile_range(start: float, stop: float, tile_size: int) -> range:
+    """The indices of the tiles that cover the pixels [start, stop)"""
+    return range(math.floor(start / tile_size), math.ceil(stop / tile_size))
+
+
+# serializes the changes of the pixel limit of PIL, that is global
+_PIXEL_LIMIT_LOCK = threading.Lock()
+
+
+@contextmanager
+def _no_pixel_limit():
+    """
+    Lift the decompression bomb limit of PIL while an image is opened or decoded,
+    restoring it on exit. The size of the images of tile pyramids is checked
+    against max_pixels instead, as large mosaics exceed the limit.
+    """
+    with _PIXEL_LIMIT_LOCK:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _supports_band_reads(image: Image.Image) -> bool:
+    """
+    Whether only a band of the rows of an opened image can be decoded. This narrows
+    the tiles and the size of the image before it is loaded, which relies on the
+    internals of PIL's ImageFile, so it is only done if they are as expected, and
+    the image is otherwise decoded whole.
+    """
+    return (
+        isinstance(image, ImageFile.ImageFile)
+        and isinstance(getattr(image, "_size", None), tuple)
+        and isinstance(image.tile, list)
+        and all(len(tile) == 4 for tile in image.tile)
+        # the orientation of TIFF and EXIF is applied to the decoded image
+        and image.getexif().get(ExifTags.Base.Orientation, 1) == 1
+    )
+
+
+class _SourceImage:
+    """
+    The image of a tile pyramid, read by bands of rows. Uncompressed images (like
+    uncompressed TIFF, BMP or PPM) and images stored in independent strips are
+    decoded one band at a time, other formats are decoded once.
+    """
+
+    def __init__(self, image_file: str, max_pixels: int):
+        self.image_file = image_file
+        with _no_pixel_limit():
+            self.image = Image.open(image_file)
+        self.size = self.image.size
+        if self.size[0] * self.size[1] > max_pixels:
+            self.image.close()
+            raise ValueError(
+                f"{image_file} has more than {max_pixels} pixels, raise max_pixels "
+                "to tile it"
+            )
+        self.transparent = self.image.has_transparency_data
+        self.loaded = False
+        self.banded = _supports_band_reads(self.image)
+        if self.banded:
+            self.tiles = list(self.image.tile)
+            self.banded = len(self.tiles) > 1 or (
+                len(self.tiles) == 1 and self._raw_rows(self.tiles[0]) is not None
+            )
+
+    def __enter__(self) -> "_SourceImage":
+        return self
+
+    def __exit__(self, *exc):
+        self.image.close()
+
+    def _raw_rows(self, tile: tuple) -> Union[tuple[int, int, tuple], None]:
+        """
+        (stride, ystep, args) of a tile of uncompressed rows of 8 bit channels, that
+        any band of rows can be read from, else None
+        """
+        name, (x0, _, x1, _), _, args = tile
+        if name != "raw" or x0 != 0 or x1 != self.size[0]:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        # (rawmode, stride, ystep), with the defaults of the raw decoder
+        rawmode, stride, ystep = tuple(args) + (0, 1)[len(args) - 1 :]
+        if ystep not in (1, -1) or not set(rawmode) <= set("RGBAaXLPCMYK"):
+            return None
+        return stride or len(rawmode) * x1, ystep, (rawmode, stride, ystep)
+
+    def _band_tiles(self, top: int, bottom: int) -> list[tuple]:
+        """The tiles of the rows [top, bottom), raw tiles narrowed to those rows"""
+        tiles = []
+        for tile in self.tiles:
+            name, (x0, y0, x1, y1), offset, args = tile
+            if y0 >= bottom or y1 <= top:
+                continue
+            raw_rows = self._raw_rows(tile)
+            if raw_rows is not None:
+                # only the rows of the band, read from their offset in the file
+                stride, ystep, args = raw_rows
+                band_y0, band_y1 = max(y0, top), min(y1, bottom)
+                first_row = band_y0 - y0 if ystep == 1 else y1 - band_y1
+                tile = (
+                    name,
+                    (x0, band_y0, x1, band_y1),
+                    offset + first_row * stride,
+                    args,
+                )
+            tiles.append(tile)
+        return tiles
+
+    def _read_band(self, tiles: list[tuple]) -> tuple[Image.Image, int]:
+        """Decode the tiles of a band from a new opening of the image file"""
+        band_top = min(tile[1][1] for tile in tiles)
+        band_bottom = max(tile[1][3] for tile in tiles)
+        with _no_pixel_limit(), Image.open(self.image_file) as band:
+            band.tile = [
+                (name, (x0, y0 - band_top, x1, y1 - band_top), offset, args)
+                for name, (x0, y0, x1, y1), offset, args in tiles
+            ]
+            band._size = (self.size[0], band_bottom - band_top)
+            # the size TIFF allocates the decoded image with
+            if hasattr(band, "_tile_size"):
+                band._tile_size = band.size
+            band.load()
+            return band.copy(), band_top
+
+    def rows(self, top: int, bottom: int) -> tuple[Image.Image, int]:
+        """An image of at least the rows [top, bottom), and the row it starts at"""
+        if self.banded:
+            try:
+                return self._read_band(self._band_tiles(top, bottom))
+            except Exception:  # pylint: disable=broad-except
+                # PIL does not decode narrowed tiles, the image is decoded whole
+                self.banded = False
+        if not self.loaded:
+            with _no_pixel_limit():
+                self.image.load()
+            self.loaded = True
+        return self.image, 0
+
+
+class _TilePyramid:
+    """The tiles {z}/{x}/{y} of an image in a directory, see build_tile_pyramid"""
+
+    def __init__(
+        self,
+        tiles_dir: str,
+        bounds: tuple[tuple[float, float], tuple[float, float]],
+        tile_size: int,
+        image_format: str,
+    ):
+        self.tiles_dir = tiles_dir
+        self.bounds = bounds
+        self.tile_size = tile_size
+        self.pil_format, self.extension = TILE_FORMATS[image_format]
+        self.mode = "RGBA" if image_format == "png" else "RGB"
+
+    def tile_file(self, zoom: int, x: int, y: int) -> str:
+        return os.path.join(self.tiles_dir, str(zoom), str(x), f"{y}{self.extension}")
+
+    def save(self, tile: Image.Image, zoom: int, x: int, y: int):
+        tile_file = self.tile_file(zoom, x, y)
+        os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+        tile.save(tile_file, self.pil_format)
+
+    def pixel_box(self, zoom: int) -> tuple[float, float, float, float]:
+        """(left, top, right, bottom) of the image in the pixels of a zoom level"""
+        (y0, x0), (y1, x1) = self.bounds
+        scale = 2**zoom
+        return x0 * scale, -y1 * scale, x1 * scale, -y0 * scale
+
+    def resample(self, source: _SourceImage, zoom: int):
+        """
+        Write the tiles of a zoom level, resampled from the source image. Each tile is
+        resampled from a crop of the image, that includes the support of the filter,
+        so only the crop is converted, and the source is read a row of tiles at a
+        time.
+        """
+        tile_size = self.tile_size
+        width, height = source.size
+        left, top, right, bottom = self.pixel_box(zoom)
+        scale_x, scale_y = width / (right - left), height / (bottom - top)
+        margin_x = math.ceil(LANCZOS_SUPPORT * max(scale_x, 1.0)) + 1
+        margin_y = math.ceil(LANCZOS_SUPPORT * max(scale_y, 1.0)) + 1
+        # resampled premultiplied if transparent, so that edges are not darkened
+        region_mode = "RGBa" if self.mode == "RGBA" and source.transparent else "RGB"
+        for ty in _tile_range(top, bottom, tile_size):
+            # the pixels of the row of tiles covered by the image
+            py0 = max(ty * tile_size, round(top))
+            py1 = min((ty + 1) * tile_size, round(bottom))
+            if py1 <= py0:
+                continue
+            y0 = max((py0 - top) * scale_y, 0.0)
+            y1 = min((py1 - top) * scale_y, height)
+            crop_top = max(math.floor(y0) - margin_y, 0)
+            crop_bottom = min(math.ceil(y1) + margin_y, height)
+            band, band_top = source.rows(crop_top, crop_bottom)
+            for tx in _tile_range(left, right, tile_size):
+                px0 = max(tx * tile_size, round(left))
+                px1 = min((tx + 1) * tile_size, round(right))
+                if px1 <= px0:
+                    continue
+                x0 = max((px0 - left) * scale_x, 0.0)
+                x1 = min((px1 - left) * scale_x, width)
+                crop_left = max(math.floor(x0) - margin_x, 0)
+                crop_right = min(math.ceil(x1) + margin_x, width)
+                crop = band.crop(
+                    (
+                        crop_left,
+                        crop_top - band_top,
+                        crop_right,
+                        crop_bottom - band_top,
+                    )
+                ).convert(region_mode)
+                region = crop.resize(
+                    (px1 - px0, py1 - py0),
+                    Image.Resampling.LANCZOS,
+                    (x0 - crop_left, y0 - crop_top, x1 - crop_left, y1 - crop_top),
+                )
+                tile = Image.new(self.mode, (tile_size, tile_size))
+                tile.paste(
+                    region.convert(self.mode),
+                    (px0 - tx * tile_size, py0 - ty * tile_size),
+                )
+                self.save(tile, zoom, tx, ty)
+
+    def downsample(self, zoom: int):
+        """Write the tiles of a zoom level, downsampled from the zoom level above"""
+        tile_size = self.tile_size
+        left, top, right, bottom = self.pixel_box(zoom)
+        for ty in _tile_range(top, bottom, tile_size):
+            for tx in _tile_range(left, right, tile_size):
+                quad = Image.new(self.mode, (2 * tile_size, 2 * tile_size))
+                children = [
+                    (dx, dy, self.tile_file(zoom + 1, 2 * tx + dx, 2 * ty + dy))
+                    for dx in range(2)
+                    for dy in range(2)
+                ]
+                children = [child for child in children if os.path.isfile(child[2])]
+                for dx, dy, child in children:
+                    with Image.open(child) as child_tile:
+                        quad.paste(child_tile, (dx * tile_size, dy * tile_size))
+                if children:
+                    # premultiplied, so that transparent pixels do not darken edges
+                    if self.mode == "RGBA":
+                        quad = quad.convert("RGBa").reduce(2).convert("RGBA")
+                    else:
+                        quad = quad.reduce(2)
+                    self.save(quad, zoom, tx, ty)
+
+
+def _file_digest(path: str) -> str:
+    """Content hash of a file, read in chunks"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_tile_pyramid(
+    image_file: str,
+    tiles_dir: str,
+    bounds: tuple[tuple[float, float], tuple[float, float]],
+    tile_size: int = 256,
+    min_zoom: int = 0,
+    image_format: str = "png",
+    max_pixels: int = MAX_TILED_IMAGE_PIXELS,
+) -> tuple[str, int, int]:
+    """
+    Cut an image into a pyramid of tiles {z}/{x}/{y}, in the tile scheme of Leaflet's
+    CRS.Simple. The tiles of the max zoom are resampled from the image a row of tiles
+    at a time, each lower zoom is downsampled from the tiles of the zoom above, so
+    only a band of the image (or the decoded image, for formats that cannot be read
+    by bands) and a few tiles are held in memory. Tiles outside the image are not
+    written.
+    The pyramid is written to a subdirectory of tiles_dir named from the digest of
+    the image and of the parameters, so that pyramids of different images can share
+    tiles_dir. A pyramid already in tiles_dir is reused, and nothing else in tiles_dir
+    is touched.
+    :param image_file: The path to the image file, of any size.
+    :param tiles_dir: The directory to write the pyramid to.
+    :param bounds: [lower_left, upper_right] of the image in map units (y, x).
+    :param tile_size: The size of the square tiles in pixels.
+    :param min_zoom: The lowest zoom level to build tiles for.
+    :param image_format: 'png' (with transparent margins) or 'jpeg' (smaller, with
+    black margins).
+    :param max_pixels: The size limit of the image, in pixels.
+    :return: (pyramid_dir, min_zoom, max_zoom) the directory of the tiles and the
+    zoom levels of the pyramid.
+    """
+    if image_format not in TILE_FORMATS:
+        raise ValueError(f"image_format must be one of {', '.join(TILE_FORMATS)}")
+    (y0, x0), (y1, x1) = bounds
+    if not (x1 > x0 and y1 > y0):
+        raise ValueError("bounds must be [lower_left, upper_right]")
+
+    with _SourceImage(image_file, max_pixels) as source:
+        min_zoom, max_zoom = tile_pyramid_zooms(
+            source.size, bounds, tile_size, min_zoom
+        )
+        parameters = (
+            [[float(v) for v in point] for point in bounds],
+            tile_size,
+            min_zoom,
+            image_format,
+        )
+        digest = hashlib.sha1(
+            f"{_file_digest(image_file)}{parameters}".encode("utf-8")
+        ).hexdigest()[:16]
+        pyramid_dir = os.path.join(tiles_dir, digest)
+        if os.path.isdir(pyramid_dir):
+            return pyramid_dir, min_zoom, max_zoom
+
+        # built in a temporary directory and moved in place, so that a pyramid in
+        # tiles_dir is always complete
+        os.makedirs(tiles_dir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix=f".{digest}-", dir=tiles_dir)
+        try:
+            pyramid = _TilePyramid(build_dir, bounds, tile_size, image_format)
+            pyramid.resample(source, max_zoom)
+            for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+                pyramid.downsample(zoom)
+            try:
+                os.rename(build_dir, pyramid_dir)
+            except OSError:
+                # built concurrently by another map
+                if not os.path.isdir(pyramid_dir):
+                    raise
+                shutil.rmtree(build_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+    return pyramid_dir, min_zoom, max_zoom
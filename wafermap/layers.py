@@ -0,0 +1,1141 @@
+"""Custom folium layers, that render whole collections as a single Leaflet layer"""
+
+import base64
+import functools
+import hashlib
+import html
+import math
+import os
+import re
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Union
+from urllib.parse import quote
+
+import numpy
+from branca.element import Element, IFrame
+from folium.elements import ElementAddToElement
+from folium.features import DivIcon
+from folium.map import Layer, Marker
+from folium.raster_layers import ImageOverlay
+from folium.template import Template
+from folium.utilities import image_to_url, remove_empty
+from folium.vector_layers import Circle, CircleMarker, Polygon, PolyLine
+from PIL import ImageColor, ImageFont
+
+from wafermap.grid import CellStore
+from wafermap.images import Thumbnail
+
+CLIENT_LIBRARY_FILE = os.path.join(os.path.dirname(__file__), "static", "wafermap.js")
+# as wafermap.js
+MIN_OUTLINE_PITCH = 2
+MAX_LABELS = 2000
+CELL_LABEL_FONT_SIZE = 10.67
+CELL_LABEL_PADDING = 2
+DEFAULT_FONT_SIZE = 16.0
+UNITS_TO_PX = {"px": 1.0, "pt": 4 / 3, "em": 16.0, "rem": 16.0}
+
+
+@functools.cache
+def client_library() -> str:
+    """The JS library that draws the canvas layers, see static/wafermap.js"""
+    with open(CLIENT_LIBRARY_FILE, encoding="utf-8") as f:
+        return f.read()
+
+
+def pack_array(values: numpy.ndarray) -> dict:
+    """Pack an array as a little endian base64 string to be decoded by the client"""
+    values = numpy.ascontiguousarray(values)
+    dtype = values.dtype.newbyteorder("<")
+    return {
+        "dtype": dtype.name,
+        "data": base64.b64encode(values.astype(dtype).tobytes()).decode("ascii"),
+    }
+
+
+def smallest_uint(max_value: int) -> numpy.dtype:
+    """The smallest dtype understood by the client that holds 0...max_value"""
+    for dtype in (numpy.uint8, numpy.uint16):
+        if max_value <= numpy.iinfo(dtype).max:
+            return numpy.dtype(dtype)
+    return numpy.dtype(numpy.int32)
+
+
+def palette_colors(
+    colors: Union[Sequence[str], None], order: numpy.ndarray
+) -> tuple[Union[list[str], None], Union[numpy.ndarray, None]]:
+    """
+    Split a color per item into a palette of the distinct colors and the palette
+    index of each item, reordered by order. (None, None) if colors is None.
+    """
+    if colors is None:
+        return None, None
+    palette, color_index = numpy.unique(
+        numpy.asarray(colors, dtype=str), return_inverse=True
+    )
+    color_index = color_index.ravel()[order]
+    return palette.tolist(), color_index.astype(smallest_uint(len(palette) - 1))
+
+
+class Fragment(Element):
+    """Rendered HTML or JS, added to a page as is instead of as a Jinja template"""
+
+    def __init__(self, text: str):
+        super().__init__()
+        self._name = "Fragment"
+        self.text = text
+
+    def render(self, **kwargs) -> str:
+        return self.text
+
+
+class ClientLayer(Layer):
+    """Base of the layers that are drawn by the wafermap JS library"""
+
+    def render(self, **kwargs):
+        # the library is added once to the header, whatever the number of layers
+        self.get_root().header.add_child(
+            Fragment(f"<script>{client_library()}</script>"), name="wafermap_js"
+        )
+        super().render(**kwargs)
+
+
+class CellGridLayer(Layer):
+    """
+    The cells of a grid as a single GeoJSON FeatureCollection, with one Polygon per
+    cell. Cell styles are kept in a table that is written once, the features only
+    carry the index of their style in the table.
+    :param cell_store: The cells to draw.
+    :param cell_style_ids: (n,) int array with the style index of each cell, in the
+    row order of the cell_store.
+    :param cell_styles: Table of Leaflet path options dicts.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_styles = {{ this.cell_styles|tojson }};
+            var {{ this.get_name() }} = L.geoJSON(
+                {{ this.feature_collection() }},
+                {
+                    style: function (feature) {
+                        return {{ this.get_name() }}_styles[feature.properties.style];
+                    },
+                    interactive: false,
+                }
+            );
+        {% endmacro %}
+        """)
+
+    COORDINATE_DECIMALS = 6
+
+    def __init__(
+        self,
+        cell_store: CellStore,
+        cell_style_ids: numpy.ndarray,
+        cell_styles: list[dict],
+        name: str = None,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+        geometries: Union[list[str], None] = None,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "CellGridLayer"
+        self.cell_store = cell_store
+        self.cell_style_ids = cell_style_ids
+        self.cell_styles = cell_styles
+        self._geometries = geometries
+
+    def geometries(self) -> list[str]:
+        """
+        The GeoJSON geometry of each cell. They only depend on the cell_store, so
+        they are serialized once, and can be shared by the layers of the same grid.
+        """
+        if self._geometries is None:
+            # GeoJSON positions are (x, y) = (lng, lat)
+            y_min, x_min = self.cell_store.bounds[:, 0].T
+            y_max, x_max = self.cell_store.bounds[:, 3].T
+            rings = numpy.column_stack(
+                (x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max, x_min, y_min)
+            ).round(CellGridLayer.COORDINATE_DECIMALS)
+            geometry = (
+                '{{"type":"Polygon","coordinates":[[[{},{}],[{},{}],[{},{}],[{},{}],'
+                "[{},{}]]]}}"
+            )
+            self._geometries = [geometry.format(*ring) for ring in rings.tolist()]
+        return self._geometries
+
+    def feature_collection(self) -> str:
+        """Serialize the cells to a GeoJSON FeatureCollection string"""
+        features = ",".join(
+            f'{{"type":"Feature","properties":{{"style":{style_id}}},'
+            f'"geometry":{geometry}}}'
+            for style_id, geometry in zip(
+                self.cell_style_ids.tolist(), self.geometries()
+            )
+        )
+        return f'{{"type":"FeatureCollection","features":[{features}]}}'
+
+    def render(self, **kwargs):
+        # the script holds every cell, so it is added as a Fragment, compiling it as
+        # a Jinja template would take longer than rendering it, as by Layer.render
+        if self.show:
+            self.add_child(
+                ElementAddToElement(
+                    element_name=self.get_name(),
+                    element_parent_name=self._parent.get_name(),
+                ),
+                name=self.get_name() + "_add",
+            )
+        self.get_root().script.add_child(
+            Fragment(self._template.module.script(self, kwargs)), name=self.get_name()
+        )
+        for child in list(self._children.values()):
+            child.render(**kwargs)
+
+    def _get_self_bounds(self) -> list[list[float]]:
+        if not len(self.cell_store):
+            return [[None, None], [None, None]]
+        lower_left = self.cell_store.bounds[:, 0].min(axis=0)
+        upper_right = self.cell_store.bounds[:, 3].max(axis=0)
+        return [lower_left.tolist(), upper_right.tolist()]
+
+
+class ParametricGridLayer(ClientLayer):
+    """
+    The cells of a grid, generated by the client from the grid parameters, so that
+    the output size does not depend on the number of cells. Only styled grids carry
+    per-cell data: a dense box of style indices, in the smallest unsigned dtype.
+    :param grid_parameters: The parameters of wafermap.grid._build_grid.
+    :param cell_store: The cells of the grid.
+    :param cell_style_ids: (n,) int array with the style index of each cell, in the
+    row order of the cell_store.
+    :param cell_styles: Table of Leaflet path options dicts.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new wafermap.CellGrid(
+                {{ this.grid_parameters|tojson }},
+                {{ this.cell_styles|tojson }},
+                {{ this.style_lookup()|tojson }},
+                {}
+            );
+        {% endmacro %}
+        """)
+
+    def __init__(
+        self,
+        grid_parameters: dict,
+        cell_store: CellStore,
+        cell_style_ids: numpy.ndarray,
+        cell_styles: list[dict],
+        name: str = None,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "ParametricGridLayer"
+        self.grid_parameters = grid_parameters
+        self.cell_store = cell_store
+        self.cell_style_ids = cell_style_ids
+        self.cell_styles = cell_styles
+
+    def style_lookup(self) -> Union[dict, None]:
+        """The dense box of style indices, None if all cells have the first style"""
+        if not self.cell_style_ids.any():
+            return None
+        (y, x), dense = self.cell_store.to_dense(
+            self.cell_style_ids.astype(smallest_uint(len(self.cell_styles) - 1))
+        )
+        height, width = dense.shape
+        return {"y": y, "x": x, "height": height, "width": width} | pack_array(dense)
+
+
+class CellLabelLayer(ClientLayer):
+    """
+    The index labels of the cells of a grid, drawn by the client from the grid
+    parameters. Nothing is computed per cell in Python: the client draws the labels
+    of the visible tiles only, and only at zoom levels where they fit in the cells.
+    :param grid_parameters: The parameters of wafermap.grid._build_grid.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new wafermap.CellLabels(
+                {{ this.grid_parameters|tojson }},
+                {}
+            );
+        {% endmacro %}
+        """)
+
+    def __init__(
+        self,
+        grid_parameters: dict,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "CellLabelLayer"
+        self.grid_parameters = grid_parameters
+
+
+class Buckets:
+    """
+    Uniform grid of buckets over (n, 2) points, so that the client only visits the
+    points near a tile or a click. The points are meant to be reordered by order, the
+    points of bucket i are then start[i]...start[i + 1].
+    """
+
+    MEAN_BUCKET_SIZE = 64
+
+    def __init__(self, points: numpy.ndarray):
+        self.origin = points.min(axis=0) if len(points) else numpy.zeros(2)
+        extent = points.max(axis=0) - self.origin if len(points) else numpy.zeros(2)
+        count = max(1, math.ceil(math.sqrt(len(points) / Buckets.MEAN_BUCKET_SIZE)))
+        self.shape = (count, count)
+        self.size = numpy.where(extent > 0, extent / count, 1.0)
+        columns, rows = numpy.clip(
+            ((points - self.origin) // self.size).astype(numpy.int64), 0, count - 1
+        ).T
+        bucket = rows * count + columns
+        self.order = numpy.argsort(bucket, kind="stable")
+        self.start = numpy.zeros(count * count + 1, dtype=numpy.int32)
+        numpy.cumsum(
+            numpy.bincount(bucket, minlength=count * count), out=self.start[1:]
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "origin": self.origin.tolist(),
+            "size": self.size.tolist(),
+            "shape": list(self.shape),
+            "start": pack_array(self.start),
+        }
+
+
+class PointLayer(ClientLayer):
+    """
+    Many points drawn by the client as circles on canvas tiles. Coordinates are
+    packed as float32 (x, y) columns, colors as indices into a palette, so the
+    output size is proportional to the number of points.
+    :param points: (n, 2) array of (x, y) map coordinates.
+    :param point_style: Leaflet CircleMarker options, radius in pixels.
+    :param colors: (n,) array of a color per point. If None, the point_style color.
+    :param radii: (n,) array of a radius in pixels per point. If None, the
+    point_style radius.
+    :param popups: (n,) sequence of a popup text per point, None for no popup.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new wafermap.Points(
+                {{ this.point_data()|tojson }},
+                {{ this.point_style|tojson }},
+                {}
+            );
+        {% endmacro %}
+        """)
+
+    def __init__(
+        self,
+        points: numpy.ndarray,
+        point_style: dict,
+        colors: Union[Sequence[str], None] = None,
+        radii: Union[numpy.ndarray, None] = None,
+        popups: Union[Sequence[str], None] = None,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = False,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "PointLayer"
+        self.point_style = point_style
+        # the buckets are computed on the float32 coordinates the client sees
+        points = numpy.asarray(points, dtype=numpy.float32).reshape(-1, 2)
+        self.buckets = Buckets(points.astype(float))
+        order = self.buckets.order
+        self.x = points[order, 0]
+        self.y = points[order, 1]
+
+        self.palette, self.colors = palette_colors(colors, order)
+        self.radii = None
+        if radii is not None:
+            self.radii = numpy.broadcast_to(
+                numpy.asarray(radii, dtype=numpy.float32), len(points)
+            )[order]
+        self.popups = None
+        if popups is not None:
+            self.popups = [popups[i] for i in order.tolist()]
+
+    def point_data(self) -> dict:
+        """The packed points, in bucket order"""
+        return {
+            "buckets": self.buckets.to_dict(),
+            "x": pack_array(self.x),
+            "y": pack_array(self.y),
+            "palette": self.palette,
+            "colors": None if self.colors is None else pack_array(self.colors),
+            "radii": None if self.radii is None else pack_array(self.radii),
+            "popups": self.popups,
+            "max_radius": float(
+                self.radii.max()
+                if self.radii is not None and len(self.radii)
+                else self.point_style.get("radius", 10)
+            ),
+        }
+
+
+class VectorLayer(ClientLayer):
+    """
+    Many vectors drawn by the client as line segments on canvas tiles. Starts and
+    deltas are packed as float32 columns, colors as indices into a palette.
+    :param starts: (n, 2) array of (x, y) map coordinates of the vector starts.
+    :param deltas: (n, 2) array of (x, y) vectors in map units.
+    :param vector_style: Leaflet PolyLine options.
+    :param colors: (n,) array of a color per vector. If None, the vector_style color.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new wafermap.Vectors(
+                {{ this.vector_data()|tojson }},
+                {{ this.vector_style|tojson }},
+                {}
+            );
+        {% endmacro %}
+        """)
+
+    def __init__(
+        self,
+        starts: numpy.ndarray,
+        deltas: numpy.ndarray,
+        vector_style: dict,
+        colors: Union[Sequence[str], None] = None,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = False,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "VectorLayer"
+        self.vector_style = vector_style
+        starts = numpy.asarray(starts, dtype=numpy.float32).reshape(-1, 2)
+        deltas = numpy.asarray(deltas, dtype=numpy.float32).reshape(-1, 2)
+        self.buckets = Buckets(starts.astype(float))
+        order = self.buckets.order
+        self.x, self.y = starts[order].T
+        self.dx, self.dy = deltas[order].T
+        self.palette, self.colors = palette_colors(colors, order)
+
+    def vector_data(self) -> dict:
+        """The packed vectors, in bucket order"""
+        lengths = numpy.maximum(numpy.abs(self.dx), numpy.abs(self.dy))
+        return {
+            "buckets": self.buckets.to_dict(),
+            "x": pack_array(self.x),
+            "y": pack_array(self.y),
+            "dx": pack_array(self.dx),
+            "dy": pack_array(self.dy),
+            "palette": self.palette,
+            "colors": None if self.colors is None else pack_array(self.colors),
+            "max_length": float(numpy.nanmax(lengths, initial=0.0)),
+        }
+
+
+class LabelLayer(ClientLayer):
+    """
+    Many HTML labels, added to the DOM by the client for the labels in the view only,
+    once the zoom level makes them readable. Each distinct label style is written
+    once, as a CSS class.
+    :param points: (n, 2) array of (x, y) map coordinates of the label centers.
+    :param texts: (n,) sequence of label texts (HTML).
+    :param styles: (n,) sequence of the inline CSS style of each label, or a single
+    style for all labels.
+    :param popups: (n,) sequence of a popup text per label, None for no popup.
+    :param min_zoom: Zoom level from which the labels are shown. If None, labels are
+    shown once their mean spacing on screen fits the widest label.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = new wafermap.Labels(
+                {{ this.label_data()|tojson }},
+                {{ this.options|tojson }}
+            );
+        {% endmacro %}
+        """)
+
+    # estimated width of a character, relative to the font size
+    CHARACTER_WIDTH = 0.6
+    # the labels are centered on their point
+    BASE_STYLE = (
+        ".wafermap-label { position: absolute; transform: translate(-50%, -50%); "
+        "white-space: nowrap; }"
+    )
+
+    def __init__(
+        self,
+        points: numpy.ndarray,
+        texts: Sequence[str],
+        styles: Union[Sequence[str], str],
+        popups: Union[Sequence[str], None] = None,
+        font_size_px: float = 10.67,
+        min_zoom: Union[float, None] = None,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = False,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "LabelLayer"
+        self.options = {"minZoom": min_zoom}
+        points = numpy.asarray(points, dtype=numpy.float32).reshape(-1, 2)
+        self.buckets = Buckets(points.astype(float))
+        order = self.buckets.order
+        self.x, self.y = points[order].T
+        self.texts = [str(texts[i]) for i in order.tolist()]
+        self.popups = None
+        if popups is not None:
+            self.popups = [popups[i] for i in order.tolist()]
+        if isinstance(styles, str):
+            styles = [styles]
+            style_index = numpy.zeros(len(points), dtype=numpy.int64)
+        else:
+            styles, style_index = numpy.unique(
+                numpy.asarray(styles, dtype=str), return_inverse=True
+            )
+            styles = styles.tolist()
+            style_index = style_index.ravel()[order]
+        self.styles = styles
+        self.class_index = style_index.astype(smallest_uint(len(styles) - 1))
+
+        # the labels are readable once their mean spacing fits the widest label
+        extent = numpy.ptp(points, axis=0) if len(points) else numpy.zeros(2)
+        if len(points) < 2 or not extent.any():
+            self.spacing = None
+        elif extent.all():
+            self.spacing = float(numpy.sqrt(extent.prod() / len(points)))
+        else:
+            self.spacing = float(extent.max() / len(points))
+        self.width = (
+            max(map(len, self.texts), default=0)
+            * font_size_px
+            * LabelLayer.CHARACTER_WIDTH
+        )
+
+    @staticmethod
+    def class_name(style: str) -> str:
+        """The CSS class of a label style, identical styles share the class"""
+        return "wafermap-label-" + hashlib.sha1(style.encode("utf-8")).hexdigest()[:10]
+
+    def label_data(self) -> dict:
+        """The packed labels, in bucket order"""
+        return {
+            "buckets": self.buckets.to_dict(),
+            "x": pack_array(self.x),
+            "y": pack_array(self.y),
+            "texts": self.texts,
+            "classes": [LabelLayer.class_name(style) for style in self.styles],
+            "class_index": pack_array(self.class_index),
+            "popups": self.popups,
+            "spacing": self.spacing,
+            "width": self.width,
+        }
+
+    def render(self, **kwargs):
+        # each style is added once to the header, whatever the number of layers
+        header = self.get_root().header
+        header.add_child(
+            Element(f"<style>{LabelLayer.BASE_STYLE}</style>"), name="wafermap_label"
+        )
+        for style in self.styles:
+            class_name = LabelLayer.class_name(style)
+            header.add_child(
+                Element(f"<style>.{class_name} {{ {style} }}</style>"), name=class_name
+            )
+        super().render(**kwargs)
+
+
+class ImageFileOverlay(Layer):
+    """
+    An ImageOverlay of an image file. The file is read and inlined when the layer is
+    rendered, instead of when it is created.
+    :param image_file: The path to the image file.
+    :param bounds: The [lower_left, upper_right] bounds of the image, in (y, x).
+    """
+
+    _template = ImageOverlay._template
+
+    assets = None
+
+    def __init__(
+        self,
+        image_file: str,
+        bounds: list,
+        pixelated: bool = True,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+        **kwargs,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "ImageOverlay"
+        self.image_file = image_file
+        self.bounds = bounds
+        self.options = remove_empty(**kwargs)
+        self.pixelated = pixelated
+
+    @property
+    def url(self) -> str:
+        if self.assets is not None:
+            return self.assets.add_file(self.image_file)
+        return image_to_url(self.image_file)
+
+    def _get_self_bounds(self) -> list:
+        return self.bounds
+
+
+class ImageTileLayer(Layer):
+    """
+    A TileLayer of a tile pyramid {z}/{x}/{y} on disk, see images.build_tile_pyramid.
+    The tiles are referenced relative to the page, and only the tiles in view are
+    loaded by the browser.
+    :param tiles_dir: The directory of the tiles.
+    :param bounds: The [lower_left, upper_right] bounds of the image, in (y, x).
+    :param zooms: The (min, max) zoom levels of the pyramid.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.tileLayer(
+                {{ this.url|tojson }},
+                {{ this.options|tojson }}
+            );
+        {% endmacro %}
+        """)
+
+    page_dir = None
+
+    def __init__(
+        self,
+        tiles_dir: str,
+        bounds: list,
+        zooms: tuple[int, int],
+        extension: str = ".png",
+        tile_size: int = 256,
+        max_zoom: int = 18,
+        name: str = None,
+        overlay: bool = True,
+        control: bool = True,
+        show: bool = True,
+    ):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "ImageTileLayer"
+        self.tiles_dir = tiles_dir
+        self.bounds = bounds
+        self.extension = extension
+        # tiles are only requested within the bounds and, out of the native zooms,
+        # scaled by Leaflet
+        self.options = {
+            "bounds": bounds,
+            "tileSize": tile_size,
+            "minNativeZoom": zooms[0],
+            "maxNativeZoom": zooms[1],
+            "minZoom": 0,
+            "maxZoom": max_zoom,
+            "zIndex": 2,
+        }
+
+    @property
+    def url(self) -> str:
+        tiles_dir = self.tiles_dir
+        if self.page_dir is not None:
+            tiles_dir = os.path.relpath(os.path.abspath(tiles_dir), self.page_dir)
+        tiles_url = quote(tiles_dir.replace(os.sep, "/").rstrip("/"))
+        return f"{tiles_url}/{{z}}/{{x}}/{{y}}{self.extension}"
+
+    def _get_self_bounds(self) -> list:
+        return self.bounds
+
+
+class ThumbnailHtml(Element):
+    """The HTML page of a thumbnail, the thumbnail is encoded when rendered"""
+
+    def __init__(self, thumbnail: Thumbnail, alt: str):
+        super().__init__()
+        self._name = "ThumbnailHtml"
+        self.thumbnail = thumbnail
+        self.alt = alt
+
+    def render(self, **kwargs) -> str:
+        image = base64.b64encode(self.thumbnail.jpeg).decode("utf-8")
+        return (
+            f'<html><head></head><body><img src="data:image/jpeg;base64,{image}" '
+            f'alt="{self.alt}"></body><html>'
+        )
+
+
+class ThumbnailFrame(IFrame):
+    """
+    The popup content of a thumbnail. An IFrame of the inlined thumbnail, or an image
+    loaded from the asset directory when the page is saved with one.
+    """
+
+    assets = None
+
+    def __init__(self, thumbnail: Thumbnail, alt: str):
+        width, height = thumbnail.size
+        super().__init__(
+            ThumbnailHtml(thumbnail, alt),
+            width=str(width + 20),
+            height=str(height + 20),
+        )
+        self.thumbnail = thumbnail
+        self.alt = alt
+
+    def render(self, **kwargs) -> str:
+        if self.assets is None:
+            return super().render(**kwargs)
+        # relative URLs do not resolve in the data: URL of an IFrame
+        url = self.assets.add(self.thumbnail.jpeg, ".jpg", self.thumbnail.digest)
+        width, height = self.thumbnail.size
+        return (
+            f'<img src="{url}" alt="{self.alt}" width="{width}" height="{height}" '
+            'loading="lazy">'
+        )
+
+
+class AssetDirectory:
+    """
+    A directory the images of a page are written to, instead of being inlined in the
+    HTML. Each distinct file is written once, named after its content hash.
+    :param path: The path to the directory, created on the first asset.
+    :param url: The URL of the directory from the page.
+    """
+
+    def __init__(self, path: str, url: str):
+        self.path = path
+        self.url = url.rstrip("/")
+        self.files = {}
+        self._file_urls = {}
+
+    def add(self, data: bytes, extension: str, digest: Union[str, None] = None) -> str:
+        """Write the data if it is new and return its URL"""
+        if digest is None:
+            digest = hashlib.sha1(data).hexdigest()
+        name = digest[:20] + extension
+        if name not in self.files:
+            os.makedirs(self.path, exist_ok=True)
+            file = os.path.join(self.path, name)
+            # files of earlier saves have the same content
+            if not os.path.isfile(file):
+                with open(file, "wb") as f:
+                    f.write(data)
+            self.files[name] = file
+        return f"{self.url}/{name}"
+
+    def add_file(self, path: str) -> str:
+        """Copy the file if it is new and return its URL"""
+        real_path = os.path.realpath(path)
+        if real_path not in self._file_urls:
+            with open(real_path, "rb") as f:
+                data = f.read()
+            self._file_urls[real_path] = self.add(
+                data, os.path.splitext(path)[1].lower()
+            )
+        return self._file_urls[real_path]
+
+    def attach(self, root: Element) -> list:
+        """
+        Make the elements under root write their images to this directory. Returns the
+        elements, whose assets are to be reset after rendering.
+        """
+        elements = list(iter_elements(root, (ImageFileOverlay, ThumbnailFrame)))
+        for element in elements:
+            element.assets = self
+        return elements
+
+
+class PrerenderedLayer(Layer):
+    """
+    An element of a template map, rendered once. The header, html and script it adds
+    to a page are kept as Fragments, and added to the page of each map the layer is
+    added to, without rendering the element again. The element keeps its name, so the
+    maps must be named as the template map.
+    :param element: The element, a child of a map in a Figure.
+    """
+
+    def __init__(self, element: Element):
+        self.element = element
+        super().__init__(
+            name=getattr(element, "layer_name", None),
+            overlay=getattr(element, "overlay", True),
+            control=isinstance(element, Layer) and element.control,
+            show=getattr(element, "show", True),
+        )
+        self._name = "PrerenderedLayer"
+
+        figure = element.get_root()
+        sections = (figure.header, figure.html, figure.script)
+        children = [section._children for section in sections]
+        for section in sections:
+            section._children = OrderedDict()
+        try:
+            element.render()
+            self.fragments = [
+                [
+                    (name, Fragment(child.render()))
+                    for name, child in section._children.items()
+                ]
+                for section in sections
+            ]
+        finally:
+            for section, section_children in zip(sections, children):
+                section._children = section_children
+
+    def get_name(self) -> str:
+        return self.element.get_name()
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        for section, fragments in zip(
+            (figure.header, figure.html, figure.script), self.fragments
+        ):
+            for name, fragment in fragments:
+                section.add_child(fragment, name=name)
+
+
+def iter_elements(root: Element, element_types: tuple):
+    """Yield the elements of the given types under root"""
+    stack = [root]
+    while stack:
+        element = stack.pop()
+        if isinstance(element, element_types):
+            yield element
+        stack.extend(element._children.values())
+        # the content of popups and tooltips is not among their children
+        html = getattr(element, "html", None)
+        if isinstance(html, Element):
+            stack.append(html)
+
+
+def rgb(color: str) -> tuple[float, float, float]:
+    """A CSS color as (r, g, b) in 0-1, black if it is not a color"""
+    try:
+        return tuple(value / 255 for value in ImageColor.getrgb(color)[:3])
+    except (ValueError, AttributeError):
+        return 0.0, 0.0, 0.0
+
+
+@functools.cache
+def font(size: float) -> ImageFont.FreeTypeFont:
+    return ImageFont.load_default(size=max(size, 1.0))
+
+
+class PathStyle:
+    """The fill and stroke of Leaflet path options, as drawn by wafermap.paint"""
+
+    def __init__(self, style: dict, color: Union[str, None] = None):
+        color = color or style.get("color") or "#3388ff"
+        self.fill = style.get("fill") is not False
+        self.fill_color = rgb(style.get("fillColor") or color)
+        self.fill_opacity = float(style.get("fillOpacity", 0.2))
+        self.stroke = style.get("stroke") is not False
+        self.color = rgb(color)
+        self.opacity = float(style.get("opacity", 1.0))
+        self.weight = float(style.get("weight", 3))
+
+
+def css_font(style: str) -> tuple[float, tuple[float, float, float]]:
+    """The (font size in pixels, color) of an inline CSS style"""
+    size, color = DEFAULT_FONT_SIZE, (0.0, 0.0, 0.0)
+    match = re.search(r"font-size:\s*([\d.]+)\s*(px|pt|em|rem)?", style)
+    if match:
+        size = float(match.group(1)) * UNITS_TO_PX[match.group(2) or "px"]
+    match = re.search(r"(?:^|[;\s])color:\s*([^;]+)", style)
+    if match:
+        color = rgb(match.group(1).strip())
+    return size, color
+
+
+def html_text(markup: str) -> str:
+    return html.unescape(re.sub(r"<[^>]*>", "", markup)).strip()
+
+
+class LayerPainter:
+    """
+    Walks the elements of a folium map in the order of the page, skipping hidden
+    layers, and resolves the layers to shapes in the pixels of a view, placed and
+    styled as by the browser. Subclasses draw the shapes, see raster.Rasterizer and
+    svg.SvgWriter.
+    :param viewport: The pixels of the view, see raster.Viewport.
+    """
+
+    def __init__(self, viewport):
+        self.viewport = viewport
+        self.cell_store = None
+
+    def cells(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        styles: list[PathStyle],
+        style_ids: numpy.ndarray,
+        outline: bool,
+    ):
+        """Draw the pixel boxes of cells of styles, and their outlines if outline"""
+        raise NotImplementedError
+
+    def points(
+        self,
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        radius: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        """
+        Draw circles of pixel radius, in the (color, fill_color) of their palette
+        index, None for those of the style
+        """
+        raise NotImplementedError
+
+    def vectors(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        """
+        Draw line segments between pixel points, in the color of their palette
+        index, None for that of the style
+        """
+        raise NotImplementedError
+
+    def circle(self, x: float, y: float, radius: float, style: PathStyle):
+        raise NotImplementedError
+
+    def path(self, x: numpy.ndarray, y: numpy.ndarray, style: PathStyle, closed: bool):
+        """Draw a polygon, if closed, or a polyline of pixel points"""
+        raise NotImplementedError
+
+    def image(self, image_file: str, x0: float, y0: float, x1: float, y1: float):
+        """Draw an image file stretched over a pixel box"""
+        raise NotImplementedError
+
+    def text(
+        self,
+        x: float,
+        y: float,
+        text: str,
+        size: float,
+        color: tuple[float, float, float],
+    ):
+        """Draw a text centered on a pixel point"""
+        raise NotImplementedError
+
+    def draw(self, element: Element):
+        """Draw an element and its children, skipping hidden layers"""
+        if isinstance(element, Layer) and not element.show:
+            return
+        for element_type, draw in (
+            (PrerenderedLayer, self.draw_prerendered),
+            ((CellGridLayer, ParametricGridLayer), self.draw_grid),
+            (CellLabelLayer, self.draw_cell_labels),
+            (PointLayer, self.draw_points),
+            (VectorLayer, self.draw_vectors),
+            (LabelLayer, self.draw_labels),
+            (ImageFileOverlay, self.draw_image),
+            ((Circle, CircleMarker), self.draw_circle),
+            ((Polygon, PolyLine), self.draw_path),
+            (Marker, self.draw_marker),
+        ):
+            if isinstance(element, element_type):
+                draw(element)
+                break
+        for child in list(element._children.values()):
+            self.draw(child)
+
+    @staticmethod
+    def palette(
+        colors: Union[numpy.ndarray, None], palette: Union[list[str], None], size: int
+    ) -> tuple[list, numpy.ndarray]:
+        """
+        The (r, g, b) colors of a palette, with None for the color of the style last,
+        and the palette index of each of size items
+        """
+        if colors is None:
+            return [None], numpy.zeros(size, dtype=int)
+        return [rgb(color) for color in palette] + [None], numpy.asarray(colors)
+
+    def draw_prerendered(self, layer: PrerenderedLayer):
+        self.draw(layer.element)
+
+    def draw_grid(self, layer: Union[CellGridLayer, ParametricGridLayer]):
+        viewport = self.viewport
+        self.cell_store = layer.cell_store
+        bounds = layer.cell_store.bounds
+        if not len(bounds):
+            return
+        x0, y1 = viewport.project(bounds[:, 0, 0], bounds[:, 0, 1])
+        x1, y0 = viewport.project(bounds[:, 3, 0], bounds[:, 3, 1])
+        # the browser only outlines cells that are large enough, see wafermap.js
+        outline = not isinstance(layer, ParametricGridLayer) or (
+            numpy.median(numpy.minimum(x1 - x0, y1 - y0)) >= MIN_OUTLINE_PITCH
+        )
+        self.cells(
+            x0,
+            y0,
+            x1,
+            y1,
+            [PathStyle(style) for style in layer.cell_styles],
+            numpy.asarray(layer.cell_style_ids),
+            outline,
+        )
+
+    def draw_cell_labels(self, layer: CellLabelLayer):
+        cell_store: CellStore = self.cell_store
+        if cell_store is None or not len(cell_store):
+            return
+        viewport = self.viewport
+        # the widest label is that of a corner of the grid, as by the browser
+        low, high = cell_store.labels.min(axis=0), cell_store.labels.max(axis=0)
+        widest = max(
+            (f"({y}, {x})" for y in (low[0], high[0]) for x in (low[1], high[1])),
+            key=len,
+        )
+        left, top, right, bottom = font(CELL_LABEL_FONT_SIZE).getbbox(widest)
+        # only drawn if the widest label fits in the cells, so labels are only
+        # formatted if they are drawn
+        size_x, size_y = layer.grid_parameters["cell_size"]
+        if (
+            size_x * viewport.scale < right - left + 2 * CELL_LABEL_PADDING
+            or size_y * viewport.scale < bottom - top + 2 * CELL_LABEL_PADDING
+        ):
+            return
+        # half a cell size from the lower left corner, as by the browser
+        lower_left = cell_store.bounds[:, 0]
+        x, y = viewport.project(
+            lower_left[:, 0] + size_y / 2, lower_left[:, 1] + size_x / 2
+        )
+        visible = (x >= 0) & (x <= viewport.width) & (y >= 0) & (y <= viewport.height)
+        for (label_y, label_x), cell_x, cell_y in zip(
+            cell_store.labels[visible].tolist(),
+            x[visible].tolist(),
+            y[visible].tolist(),
+        ):
+            self.text(
+                cell_x,
+                cell_y,
+                f"({label_y}, {label_x})",
+                CELL_LABEL_FONT_SIZE,
+                (0.0, 0.0, 0.0),
+            )
+
+    def draw_points(self, layer: PointLayer):
+        style = PathStyle(layer.point_style)
+        x, y = self.viewport.project(layer.y, layer.x)
+        radius = numpy.broadcast_to(
+            (
+                numpy.asarray(layer.radii, dtype=float)
+                if layer.radii is not None
+                else numpy.float64(layer.point_style.get("radius", 10))
+            ),
+            x.shape,
+        )
+        colors, color_index = LayerPainter.palette(layer.colors, layer.palette, len(x))
+        # the color of a point also fills it, unless the style has a fill color
+        palette = [
+            (color, None if layer.point_style.get("fillColor") else color)
+            for color in colors
+        ]
+        self.points(x, y, radius, style, palette, color_index)
+
+    def draw_vectors(self, layer: VectorLayer):
+        viewport = self.viewport
+        style = PathStyle({"fill": False, **layer.vector_style})
+        x0, y0 = viewport.project(layer.y, layer.x)
+        x1, y1 = viewport.project(layer.y + layer.dy, layer.x + layer.dx)
+        palette, color_index = LayerPainter.palette(
+            layer.colors, layer.palette, len(x0)
+        )
+        self.vectors(x0, y0, x1, y1, style, palette, color_index)
+
+    def draw_labels(self, layer: LabelLayer):
+        viewport = self.viewport
+        min_zoom = layer.options.get("minZoom")
+        if min_zoom is not None:
+            if viewport.zoom < min_zoom:
+                return
+        elif layer.spacing is not None and layer.spacing * viewport.scale < layer.width:
+            return
+        x, y = viewport.project(layer.y, layer.x)
+        visible = (x >= 0) & (x <= viewport.width) & (y >= 0) & (y <= viewport.height)
+        if visible.sum() > MAX_LABELS:
+            return
+        fonts = [css_font(style) for style in layer.styles]
+        for i in numpy.flatnonzero(visible).tolist():
+            size, color = fonts[layer.class_index[i]]
+            self.text(float(x[i]), float(y[i]), html_text(layer.texts[i]), size, color)
+
+    def draw_image(self, layer: ImageFileOverlay):
+        viewport = self.viewport
+        (y0, x0), (y1, x1) = layer.bounds
+        left, top = viewport.project(y1, x0)
+        right, bottom = viewport.project(y0, x1)
+        self.image(
+            layer.image_file, float(left), float(top), float(right), float(bottom)
+        )
+
+    def draw_circle(self, marker: Union[Circle, CircleMarker]):
+        viewport = self.viewport
+        x, y = viewport.project(*marker.location)
+        radius = float(marker.options.get("radius", 10))
+        # the radius of a Circle is in map units, of a CircleMarker in pixels
+        if isinstance(marker, Circle):
+            radius *= viewport.scale
+        self.circle(float(x), float(y), radius, PathStyle(marker.options))
+
+    def draw_path(self, path: Union[Polygon, PolyLine]):
+        style = PathStyle(path.options)
+        closed = isinstance(path, Polygon)
+        if not closed:
+            style.fill = False
+        locations = numpy.asarray(path.locations, dtype=float)
+        # lines of a single ring or of several
+        for ring in locations.reshape(-1, *locations.shape[-2:]):
+            x, y = self.viewport.project(ring[:, 0], ring[:, 1])
+            self.path(x, y, style, closed)
+
+    def draw_marker(self, marker: Marker):
+        icons = [
+            icon for icon in marker._children.values() if isinstance(icon, DivIcon)
+        ]
+        if not icons:
+            return
+        options = icons[0].options
+        markup = options.get("html") or ""
+        size, color = css_font(" ".join(re.findall(r'style="([^"]*)"', markup)))
+        x, y = self.viewport.project(*marker.location)
+        width, height = options.get("icon_size") or (0, 0)
+        anchor_x, anchor_y = options.get("icon_anchor") or (width / 2, height / 2)
+        self.text(
+            float(x) - anchor_x + width / 2,
+            float(y) - anchor_y + height / 2,
+            html_text(markup),
+            size,
+            color,
+        )
@@ -0,0 +1,700 @@
+"""
+Rasterizer that draws the layers of a wafermap to an image with NumPy and PIL, without
+a browser. Shapes are drawn with their analytic pixel coverage, which anti-aliases
+them at any resolution, and with the Leaflet styles the browser would use.
+"""
+
+import math
+from collections.abc import Iterator
+from typing import Union
+
+import numpy
+from branca.element import Element
+from PIL import Image, ImageDraw
+
+from wafermap.layers import LayerPainter, PathStyle, font
+
+# pixels drawn per batch of shapes, bounding the memory used
+BATCH_PIXELS = 1 << 22
+# circles above this radius in pixels are stroked as polylines of segments
+LARGE_CIRCLE_RADIUS = 16
+ARC_SEGMENT_LENGTH = 4
+
+
+def line_coverage(distance: numpy.ndarray, weight: float) -> numpy.ndarray:
+    """Coverage of pixels at a distance from the center of a line of a width"""
+    return numpy.clip(weight / 2 + 0.5 - distance, 0.0, min(weight, 1.0))
+
+
+def merge_segments(
+    position: numpy.ndarray, start: numpy.ndarray, end: numpy.ndarray, decimals: int
+) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Merge the segments [start, end] of lines at position that touch or overlap, like
+    the shared edges of the cells of a grid, into the longest segments. Coordinates
+    are compared rounded to decimals.
+    """
+    position, start, end = (
+        numpy.round(values, decimals) for values in (position, start, end)
+    )
+    order = numpy.lexsort((start, position))
+    position, start, end = position[order], start[order], end[order]
+    new = numpy.ones(len(order), dtype=bool)
+    new[1:] = (position[1:] != position[:-1]) | (start[1:] > end[:-1])
+    first = numpy.flatnonzero(new)
+    return position[first], start[first], numpy.maximum.reduceat(end, first)
+
+
+def pixel_spans(
+    start: numpy.ndarray, stop: numpy.ndarray
+) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    The coverage of pixels by the intervals [start, stop), as (n, 3) spans of pixels
+    [span_start, span_stop) of constant coverage: the first pixel, the pixels fully
+    covered and the last pixel.
+    """
+    first = numpy.floor(start).astype(numpy.int64)
+    last = numpy.maximum(numpy.ceil(stop).astype(numpy.int64) - 1, first)
+    single = first == last
+    span_start = numpy.column_stack((first, first + 1, last))
+    span_stop = numpy.column_stack(
+        (first + 1, numpy.maximum(last, first + 1), last + 1)
+    )
+    coverage = numpy.column_stack(
+        (
+            numpy.where(single, stop - start, first + 1 - start),
+            numpy.ones(len(first)),
+            numpy.where(single, 0.0, stop - last),
+        )
+    )
+    return span_start, span_stop, coverage
+
+
+def composite_sums(pixels: numpy.ndarray, sums: numpy.ndarray):
+    """
+    Draw (4, ...) sums of the alpha and of the premultiplied colors of shapes that
+    do not overlap on (..., 3) pixels, as Canvas.composite. The sums are planes of a
+    channel each, so that they are processed contiguously.
+    """
+    alpha = sums[0]
+    scale = 1 / numpy.maximum(alpha, 1)
+    numpy.minimum(alpha, 1, out=alpha)
+    numpy.subtract(1, alpha, out=alpha)
+    for channel in range(3):
+        color = pixels[..., channel]
+        color *= alpha
+        sums[channel + 1] *= scale
+        color += sums[channel + 1]
+
+
+def fill_area(
+    pixels: numpy.ndarray,
+    row_spans: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+    column_spans: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+    values: numpy.ndarray,
+):
+    """
+    Fill boxes of (n, 4) values, the row and column spans of their pixels, on the
+    (height, width, 3) pixels. The 3 x 3 blocks of each box are added at their
+    corners to a 2D difference array over the bounding box of the boxes, that is
+    summed back with a cumulative sum along each axis.
+    """
+    (row0, row1, row_coverage), (column0, column1, column_coverage) = (
+        row_spans,
+        column_spans,
+    )
+    top, left = row0.min(), column0.min()
+    height, width = row1.max() - top + 1, column1.max() - left + 1
+    row0, row1, column0, column1 = (
+        row0 - top,
+        row1 - top,
+        column0 - left,
+        column1 - left,
+    )
+    # the blocks of the boxes, as (n, 3, 3)
+    coverage = row_coverage[:, :, None] * column_coverage[:, None, :]
+    index, sign = [], []
+    for rows, row_sign in ((row0, 1.0), (row1, -1.0)):
+        for columns, column_sign in ((column0, 1.0), (column1, -1.0)):
+            index.append(rows[:, :, None] * width + columns[:, None, :])
+            sign.append(numpy.broadcast_to(row_sign * column_sign, coverage.shape))
+    index = numpy.stack(index).reshape(4, -1)
+    weights = (numpy.stack(sign) * coverage).reshape(4, -1)
+    boxes = numpy.broadcast_to(
+        numpy.arange(len(values))[:, None, None], coverage.shape
+    ).reshape(-1)
+    sums = numpy.empty((4, height, width), dtype=numpy.float32)
+    for channel in range(4):
+        sums[channel] = numpy.bincount(
+            index.reshape(-1),
+            (weights * values[boxes, channel]).reshape(-1),
+            minlength=height * width,
+        ).reshape(height, width)
+    numpy.cumsum(sums, axis=1, out=sums)
+    numpy.cumsum(sums, axis=2, out=sums)
+    composite_sums(
+        pixels[top : top + height - 1, left : left + width - 1], sums[:, :-1, :-1]
+    )
+
+
+def fill_rows(
+    pixels: numpy.ndarray,
+    row_spans: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+    column_spans: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+    values: numpy.ndarray,
+):
+    """
+    Fill boxes of few rows, like horizontal lines, as fill_area but with a 1D
+    difference array along each of the rows the boxes cross.
+    """
+    (row0, row1, row_coverage), (column0, column1, column_coverage) = (
+        row_spans,
+        column_spans,
+    )
+    left = column0.min()
+    width = column1.max() - left + 1
+    # each pixel row of each box, with its coverage
+    counts = (row1 - row0).reshape(-1)
+    blocks = numpy.repeat(numpy.arange(counts.size), counts)
+    offsets = numpy.arange(len(blocks)) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts
+    )
+    rows, inverse = numpy.unique(
+        row0.reshape(-1)[blocks] + offsets, return_inverse=True
+    )
+    boxes = blocks // 3
+    weights = row_coverage.reshape(-1)[blocks, None] * column_coverage[boxes]
+    index = numpy.concatenate(
+        (
+            inverse[:, None] * width + column0[boxes] - left,
+            inverse[:, None] * width + column1[boxes] - left,
+        ),
+        axis=1,
+    ).reshape(-1)
+    weights = numpy.concatenate((weights, -weights), axis=1)
+    boxes = numpy.repeat(boxes, 6)
+    sums = numpy.empty((4, len(rows), width), dtype=numpy.float32)
+    for channel in range(4):
+        sums[channel] = numpy.bincount(
+            index,
+            weights.reshape(-1) * values[boxes, channel],
+            minlength=len(rows) * width,
+        ).reshape(len(rows), width)
+    numpy.cumsum(sums, axis=2, out=sums)
+    band = pixels[rows, left : left + width - 1]
+    composite_sums(band, sums[:, :, :-1])
+    pixels[rows, left : left + width - 1] = band
+
+
+class Viewport:
+    """
+    The pixels of a view of a map, with Leaflet's fitBounds framing of the map bounds.
+    :param size: (width, height) of the view in pixels.
+    :param bounds: [lower_left, upper_right] of the map in map units (y, x).
+    :param padding: (x, y) padding around the bounds in pixels.
+    """
+
+    def __init__(self, size: tuple[int, int], bounds: list, padding: tuple[int, int]):
+        self.width, self.height = int(size[0]), int(size[1])
+        (y0, x0), (y1, x1) = bounds
+        self.scale = min(
+            (self.width - 2 * padding[0]) / (x1 - x0),
+            (self.height - 2 * padding[1]) / (y1 - y0),
+        )
+        self.zoom = math.log2(self.scale)
+        self.origin_x = self.width / 2 - self.scale * (x0 + x1) / 2
+        self.origin_y = self.height / 2 + self.scale * (y0 + y1) / 2
+
+    def project(self, y, x) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """Pixel (x, y) of map (y, x), y pointing down"""
+        px = self.origin_x + numpy.asarray(x, dtype=float) * self.scale
+        py = self.origin_y - numpy.asarray(y, dtype=float) * self.scale
+        return px, py
+
+
+class Canvas(Viewport):
+    """
+    An RGB image of a map, see Viewport.
+    :param background: (r, g, b) background color in 0-255.
+    """
+
+    def __init__(
+        self,
+        size: tuple[int, int],
+        bounds: list,
+        padding: tuple[int, int],
+        background: tuple[int, int, int],
+    ):
+        super().__init__(size, bounds, padding)
+        self.pixels = numpy.empty((self.height * self.width, 3), dtype=numpy.float32)
+        self.pixels[:] = numpy.asarray(background[:3], dtype=float) / 255
+        self.texts = []
+
+    def _batches(
+        self, x0: numpy.ndarray, y0: numpy.ndarray, x1: numpy.ndarray, y1: numpy.ndarray
+    ) -> Iterator[tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+        """
+        Yield the (shape, column, row) of the pixels of the boxes of shapes, in
+        batches of shapes of similar size.
+        """
+        column0 = numpy.clip(numpy.floor(x0), 0, self.width).astype(numpy.int64)
+        column1 = numpy.clip(numpy.ceil(x1), 0, self.width).astype(numpy.int64)
+        row0 = numpy.clip(numpy.floor(y0), 0, self.height).astype(numpy.int64)
+        row1 = numpy.clip(numpy.ceil(y1), 0, self.height).astype(numpy.int64)
+        widths, heights = column1 - column0, row1 - row0
+        areas = widths * heights
+        shapes = numpy.flatnonzero(areas > 0)
+        shapes = shapes[numpy.argsort(areas[shapes], kind="stable")]
+        max_widths = numpy.maximum.accumulate(widths[shapes])
+        max_heights = numpy.maximum.accumulate(heights[shapes])
+        start = 0
+        while start < len(shapes):
+            # the largest batch whose padded boxes fit in BATCH_PIXELS
+            counts = numpy.arange(1, len(shapes) - start + 1)
+            pixels = counts * max_widths[start:] * max_heights[start:]
+            stop = start + max(int(numpy.searchsorted(pixels, BATCH_PIXELS)), 1)
+            batch = shapes[start:stop]
+            width, height = max_widths[stop - 1], max_heights[stop - 1]
+            columns = column0[batch, None] + numpy.arange(width)
+            rows = row0[batch, None] + numpy.arange(height)
+            inside = (columns < column1[batch, None])[:, None, :] & (
+                rows < row1[batch, None]
+            )[:, :, None]
+            shape, row, column = numpy.nonzero(inside)
+            yield batch[shape], columns[shape, column], rows[shape, row]
+            start = stop
+
+    def composite(
+        self,
+        column: numpy.ndarray,
+        row: numpy.ndarray,
+        coverage: numpy.ndarray,
+        colors: numpy.ndarray,
+        overlapping: bool = False,
+    ):
+        """
+        Draw pixels of the given coverage (alpha) and (n, 3) colors. Pixels of shapes
+        that do not overlap, like cells, add up, so that shared edges are seamless.
+        Overlapping shapes, like strokes, are drawn with their largest coverage.
+        """
+        drawn = numpy.flatnonzero(coverage > 0)
+        index = row[drawn] * self.width + column[drawn]
+        coverage, colors = coverage[drawn], colors[drawn]
+        if not len(index):
+            return
+        # only the drawn pixels are sorted, instead of accumulating over the image
+        if overlapping:
+            # the largest coverage of each pixel, the last drawn of ties
+            order = numpy.lexsort((-drawn, -coverage, index))
+            index = index[order]
+            first = numpy.r_[True, index[1:] != index[:-1]]
+            top = order[first]
+            index, colors, alpha = index[first], colors[top], coverage[top, None]
+        else:
+            index, inverse = numpy.unique(index, return_inverse=True)
+            alpha = numpy.bincount(inverse, coverage)
+            colors = numpy.column_stack(
+                [numpy.bincount(inverse, coverage * colors[:, i]) for i in range(3)]
+            )
+            colors /= alpha[:, None]
+            alpha = numpy.minimum(alpha, 1.0)[:, None]
+        self.pixels[index] = self.pixels[index] * (1 - alpha) + colors * alpha
+
+    def fill_rects(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        colors: numpy.ndarray,
+        opacity: numpy.ndarray,
+    ):
+        """
+        Fill pixel boxes [x0, x1) x [y0, y1) that do not overlap, like cells, with
+        (n, 3) colors, in one pass. The coverage of a pixel by a box is the product of
+        the coverage of its column and of its row, so a box is at most 3 x 3 blocks
+        of constant coverage, that are summed with difference arrays over the bounds
+        of the boxes. Boxes that only cross a few rows (or columns), like lines, are
+        summed over those rows only. Pixels shared by boxes add up, so that shared
+        edges are seamless, as by composite.
+        """
+        x0, x1 = numpy.clip(x0, 0, self.width), numpy.clip(x1, 0, self.width)
+        y0, y1 = numpy.clip(y0, 0, self.height), numpy.clip(y1, 0, self.height)
+        drawn = (x1 > x0) & (y1 > y0) & (opacity > 0)
+        if not drawn.any():
+            return
+        x0, y0, x1, y1 = x0[drawn], y0[drawn], x1[drawn], y1[drawn]
+        # alpha and the premultiplied colors of the boxes
+        values = numpy.column_stack(
+            (opacity[drawn], opacity[drawn, None] * colors[drawn])
+        )
+        pixels = self.pixels.reshape(self.height, self.width, 3)
+        row_spans, column_spans = pixel_spans(y0, y1), pixel_spans(x0, x1)
+        rows = (row_spans[1][:, 2] - row_spans[0][:, 0]).sum()
+        columns = (column_spans[1][:, 2] - column_spans[0][:, 0]).sum()
+        if 2 * rows < math.ceil(y1.max()) - math.floor(y0.min()):
+            fill_rows(pixels, row_spans, column_spans, values)
+        elif 2 * columns < math.ceil(x1.max()) - math.floor(x0.min()):
+            # the rows of the transposed pixels are the columns
+            fill_rows(pixels.transpose(1, 0, 2), column_spans, row_spans, values)
+        else:
+            fill_area(pixels, row_spans, column_spans, values)
+
+    def outlines(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        style_ids: numpy.ndarray,
+        styles: list[PathStyle],
+    ):
+        """
+        Stroke the outlines of pixel boxes of styles, like cells. The edges of the
+        boxes with the same stroke are merged into the lines of a grid, and the
+        horizontal and the vertical lines are each filled in one pass.
+        """
+        strokes = {}
+        stroke_ids = numpy.asarray(
+            [
+                strokes.setdefault((style.color, style.opacity, style.weight), i)
+                for i, style in enumerate(styles)
+            ]
+        )[style_ids]
+        lines = {"horizontal": [], "vertical": []}
+        for stroke_id in numpy.unique(stroke_ids).tolist():
+            style = styles[stroke_id]
+            boxes = stroke_ids == stroke_id
+            bx0, by0, bx1, by1 = x0[boxes], y0[boxes], x1[boxes], y1[boxes]
+            for name, position, start, end in (
+                ("horizontal", (by0, by1), (bx0, bx0), (bx1, bx1)),
+                ("vertical", (bx0, bx1), (by0, by0), (by1, by1)),
+            ):
+                merged = merge_segments(
+                    *(numpy.concatenate(values) for values in (position, start, end)),
+                    decimals=3,
+                )
+                lines[name].append((*merged, style))
+        for name, groups in lines.items():
+            if not groups:
+                continue
+            position, start, end = (
+                numpy.concatenate([group[i] for group in groups]) for i in range(3)
+            )
+            half = numpy.concatenate(
+                [numpy.full(len(group[0]), group[3].weight / 2) for group in groups]
+            )
+            colors = numpy.concatenate(
+                [numpy.tile(group[3].color, (len(group[0]), 1)) for group in groups]
+            )
+            opacity = numpy.concatenate(
+                [numpy.full(len(group[0]), group[3].opacity) for group in groups]
+            )
+            # the lines are thin boxes, with the square caps of the outlines
+            across = (position - half, position + half)
+            along = (start - half, end + half)
+            if name == "horizontal":
+                self.fill_rects(
+                    along[0], across[0], along[1], across[1], colors, opacity
+                )
+            else:
+                self.fill_rects(
+                    across[0], along[0], across[1], along[1], colors, opacity
+                )
+
+    def circles(
+        self,
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        radius: numpy.ndarray,
+        style: PathStyle,
+        colors: Union[numpy.ndarray, None] = None,
+        fill_colors: Union[numpy.ndarray, None] = None,
+    ):
+        """Fill and stroke circles of pixel radius, colors default to the style"""
+        x, y = numpy.atleast_1d(x, y)
+        radius = numpy.broadcast_to(radius, x.shape)
+        if colors is None:
+            colors = numpy.broadcast_to(style.color, (len(x), 3))
+        if fill_colors is None:
+            fill_colors = numpy.broadcast_to(style.fill_color, (len(x), 3))
+        reach = radius + (style.weight / 2 if style.stroke else 0) + 1
+        if style.fill:
+            for shape, column, row in self._batches(
+                x - reach, y - reach, x + reach, y + reach
+            ):
+                distance = numpy.hypot(column + 0.5 - x[shape], row + 0.5 - y[shape])
+                coverage = numpy.clip(radius[shape] + 0.5 - distance, 0.0, 1.0)
+                self.composite(
+                    column,
+                    row,
+                    coverage * style.fill_opacity,
+                    fill_colors[shape],
+                    overlapping=True,
+                )
+        if style.stroke:
+            # large circles are stroked as polylines, instead of over their whole box
+            large = radius > LARGE_CIRCLE_RADIUS
+            for i in numpy.flatnonzero(large).tolist():
+                count = max(math.ceil(2 * math.pi * radius[i] / ARC_SEGMENT_LENGTH), 8)
+                angles = numpy.linspace(0, 2 * math.pi, count + 1)
+                arc_x = x[i] + radius[i] * numpy.cos(angles)
+                arc_y = y[i] + radius[i] * numpy.sin(angles)
+                self.lines(
+                    arc_x[:-1],
+                    arc_y[:-1],
+                    arc_x[1:],
+                    arc_y[1:],
+                    style,
+                    numpy.broadcast_to(colors[i], (count, 3)),
+                )
+            small = numpy.flatnonzero(~large)
+            x, y, radius, colors, reach = (
+                x[small],
+                y[small],
+                radius[small],
+                colors[small],
+                reach[small],
+            )
+            for shape, column, row in self._batches(
+                x - reach, y - reach, x + reach, y + reach
+            ):
+                distance = numpy.hypot(column + 0.5 - x[shape], row + 0.5 - y[shape])
+                coverage = line_coverage(
+                    numpy.abs(distance - radius[shape]), style.weight
+                )
+                self.composite(
+                    column,
+                    row,
+                    coverage * style.opacity,
+                    colors[shape],
+                    overlapping=True,
+                )
+
+    def lines(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        style: PathStyle,
+        colors: Union[numpy.ndarray, None] = None,
+    ):
+        """Stroke line segments between pixel points, with round caps"""
+        if not style.stroke:
+            return
+        if colors is None:
+            colors = numpy.broadcast_to(style.color, (len(x0), 3))
+        reach = style.weight / 2 + 1
+        dx, dy = x1 - x0, y1 - y0
+        length2 = numpy.maximum(dx**2 + dy**2, 1e-12)
+        for shape, column, row in self._batches(
+            numpy.minimum(x0, x1) - reach,
+            numpy.minimum(y0, y1) - reach,
+            numpy.maximum(x0, x1) + reach,
+            numpy.maximum(y0, y1) + reach,
+        ):
+            px, py = column + 0.5 - x0[shape], row + 0.5 - y0[shape]
+            t = numpy.clip((px * dx[shape] + py * dy[shape]) / length2[shape], 0, 1)
+            distance = numpy.hypot(px - t * dx[shape], py - t * dy[shape])
+            coverage = line_coverage(distance, style.weight)
+            self.composite(
+                column, row, coverage * style.opacity, colors[shape], overlapping=True
+            )
+
+    def polygon(self, x: numpy.ndarray, y: numpy.ndarray, style: PathStyle):
+        """Fill a polygon of pixel points, supersampled, and stroke its outline"""
+        if style.fill and len(x) > 2:
+            supersampling = 4
+            left, top = math.floor(x.min()), math.floor(y.min())
+            right = min(math.ceil(x.max()), self.width)
+            bottom = min(math.ceil(y.max()), self.height)
+            left, top = max(left, 0), max(top, 0)
+            if right > left and bottom > top:
+                mask = Image.new(
+                    "L",
+                    ((right - left) * supersampling, (bottom - top) * supersampling),
+                )
+                ImageDraw.Draw(mask).polygon(
+                    list(
+                        zip(
+                            ((x - left) * supersampling).tolist(),
+                            ((y - top) * supersampling).tolist(),
+                        )
+                    ),
+                    fill=255,
+                )
+                coverage = numpy.asarray(mask.reduce(supersampling), dtype=float) / 255
+                row, column = numpy.nonzero(coverage)
+                self.composite(
+                    column + left,
+                    row + top,
+                    coverage[row, column] * style.fill_opacity,
+                    numpy.broadcast_to(style.fill_color, (len(row), 3)),
+                )
+        closed_x, closed_y = numpy.append(x, x[0]), numpy.append(y, y[0])
+        self.lines(closed_x[:-1], closed_y[:-1], closed_x[1:], closed_y[1:], style)
+
+    def paste(self, image: Image.Image, x0: float, y0: float, x1: float, y1: float):
+        """Draw an image stretched over a pixel box"""
+        left, top = round(min(x0, x1)), round(min(y0, y1))
+        right, bottom = round(max(x0, x1)), round(max(y0, y1))
+        if right <= left or bottom <= top:
+            return
+        image = image.convert("RGBA").resize((right - left, bottom - top))
+        pixels = numpy.asarray(image, dtype=float) / 255
+        row, column = numpy.nonzero(pixels[..., 3])
+        column_offset, row_offset = column + left, row + top
+        inside = (
+            (column_offset >= 0)
+            & (column_offset < self.width)
+            & (row_offset >= 0)
+            & (row_offset < self.height)
+        )
+        row, column = row[inside], column[inside]
+        self.composite(
+            column + left,
+            row + top,
+            pixels[row, column, 3],
+            pixels[row, column, :3],
+            overlapping=True,
+        )
+
+    def text(
+        self,
+        x: float,
+        y: float,
+        text: str,
+        size: float,
+        color: tuple[float, float, float],
+    ):
+        """Queue a text centered on a pixel point, texts are drawn over the shapes"""
+        if text and -size * len(text) < x < self.width + size * len(text):
+            if -size < y < self.height + size:
+                self.texts.append((x, y, text, size, color))
+
+    def image(self) -> Image.Image:
+        """The RGB image of the canvas, with the texts"""
+        pixels = numpy.round(self.pixels * 255).astype(numpy.uint8)
+        image = Image.fromarray(pixels.reshape(self.height, self.width, 3), "RGB")
+        draw = ImageDraw.Draw(image)
+        for x, y, text, size, color in self.texts:
+            fill = tuple(round(value * 255) for value in color)
+            draw.text((x, y), text, fill=fill, font=font(size), anchor="mm")
+        return image
+
+
+class Rasterizer(LayerPainter):
+    """Draws the elements of a folium map to a Canvas, see LayerPainter"""
+
+    def __init__(self, canvas: Canvas):
+        super().__init__(canvas)
+        self.canvas = canvas
+
+    def cells(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        styles: list[PathStyle],
+        style_ids: numpy.ndarray,
+        outline: bool,
+    ):
+        def column(attribute: str) -> numpy.ndarray:
+            return numpy.asarray([getattr(style, attribute) for style in styles])
+
+        filled = column("fill")[style_ids]
+        ids = style_ids[filled]
+        self.canvas.fill_rects(
+            x0[filled],
+            y0[filled],
+            x1[filled],
+            y1[filled],
+            column("fill_color")[ids],
+            column("fill_opacity")[ids],
+        )
+        if outline:
+            stroked = column("stroke")[style_ids]
+            self.canvas.outlines(
+                x0[stroked],
+                y0[stroked],
+                x1[stroked],
+                y1[stroked],
+                style_ids[stroked],
+                styles,
+            )
+
+    def points(
+        self,
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        radius: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        colors = numpy.asarray([color or style.color for color, _ in palette])
+        fill_colors = numpy.asarray(
+            [fill_color or style.fill_color for _, fill_color in palette]
+        )
+        self.canvas.circles(
+            x, y, radius, style, colors[color_index], fill_colors[color_index]
+        )
+
+    def vectors(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        colors = numpy.asarray([color or style.color for color in palette])
+        self.canvas.lines(x0, y0, x1, y1, style, colors[color_index])
+
+    def circle(self, x: float, y: float, radius: float, style: PathStyle):
+        self.canvas.circles(x, y, numpy.float64(radius), style)
+
+    def path(self, x: numpy.ndarray, y: numpy.ndarray, style: PathStyle, closed: bool):
+        if closed:
+            self.canvas.polygon(x, y, style)
+        else:
+            self.canvas.lines(x[:-1], y[:-1], x[1:], y[1:], style)
+
+    def image(self, image_file: str, x0: float, y0: float, x1: float, y1: float):
+        with Image.open(image_file) as image:
+            self.canvas.paste(image, x0, y0, x1, y1)
+
+    def text(
+        self,
+        x: float,
+        y: float,
+        text: str,
+        size: float,
+        color: tuple[float, float, float],
+    ):
+        self.canvas.text(x, y, text, size, color)
+
+
+def rasterize(
+    root: Element,
+    bounds: list,
+    size: tuple[int, int],
+    padding: tuple[int, int],
+    background: tuple[int, int, int],
+) -> Image.Image:
+    """
+    Draw a folium map as framed by fit_bounds(bounds, padding) in a browser window of
+    the given size.
+    :param root: The root (Figure) of the map.
+    :param bounds: [lower_left, upper_right] of the view in map units (y, x).
+    :param size: (width, height) of the image in pixels.
+    :param padding: (x, y) padding around the bounds in pixels.
+    :param background: (r, g, b) background color in 0-255.
+    """
+    canvas = Canvas(size, bounds, padding, background)
+    Rasterizer(canvas).draw(root)
+    return canvas.image()
@@ -0,0 +1,629 @@
+/*
+ * Client side rendering of wafermap layers.
+ * Layers that would need one Leaflet object per cell or per marker are drawn here
+ * on canvas tiles instead, from compact data written by wafermap.layers.
+ */
+(function () {
+    "use strict";
+
+    var wafermap = (window.wafermap = window.wafermap || {});
+
+    // Typed array of the given dtype from a base64 string of little endian values
+    wafermap.decode = function (data, dtype) {
+        var binary = atob(data),
+            bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var types = {
+            uint8: Uint8Array,
+            uint16: Uint16Array,
+            int32: Int32Array,
+            float32: Float32Array,
+            float64: Float64Array,
+        };
+        return new types[dtype](bytes.buffer);
+    };
+
+    // The cell geometry of a grid, given the parameters of wafermap.grid._build_grid.
+    // The corners are computed with the same operations in the same order, so the
+    // client draws exactly the cells of the Python grid.
+    function Grid(parameters) {
+        this.sizeX = parameters.cell_size[0];
+        this.sizeY = parameters.cell_size[1];
+        this.marginX = parameters.cell_margin[0];
+        this.marginY = parameters.cell_margin[1];
+        this.originX = parameters.cell_origin[0];
+        this.originY = parameters.cell_origin[1];
+        this.offsetX = parameters.grid_offset[0];
+        this.offsetY = parameters.grid_offset[1];
+        this.pitchX = this.sizeX + this.marginX;
+        this.pitchY = this.sizeY + this.marginY;
+        var numX = Math.ceil((2 * parameters.wafer_radius) / this.sizeX),
+            numY = Math.ceil((2 * parameters.wafer_radius) / this.sizeY);
+        // inclusive index ranges
+        this.minX = -Math.ceil(numX / 2) - 1;
+        this.maxX = Math.ceil(numX / 2);
+        this.minY = -Math.ceil(numY / 2) - 1;
+        this.maxY = Math.ceil(numY / 2);
+        this.full = parameters.coverage === "full";
+        this.limit =
+            parameters.coverage === "usable"
+                ? parameters.wafer_radius - parameters.edge_exclusion
+                : parameters.wafer_radius;
+    }
+
+    // x of the lower left, lower right, upper left and upper right corners of column i
+    Grid.prototype.column = function (i) {
+        var lower = (i - 0.5) * this.pitchX + this.offsetX,
+            upper = (i + 0.5) * this.pitchX + this.offsetX;
+        return [
+            lower + this.marginX / 2,
+            lower + this.sizeX - this.marginX / 2,
+            upper - this.sizeX + this.marginX / 2,
+            upper - this.marginX / 2,
+        ];
+    };
+
+    // y of the lower and upper corners of row i
+    Grid.prototype.row = function (i) {
+        var lower = (i - 0.5) * this.pitchY + this.offsetY,
+            upper = (i + 0.5) * this.pitchY + this.offsetY;
+        return [lower + this.marginY / 2, upper - this.marginY / 2];
+    };
+
+    Grid.prototype.contains = function (column, row) {
+        var limit = this.limit,
+            corners = [
+                Math.sqrt(row[0] * row[0] + column[0] * column[0]) <= limit,
+                Math.sqrt(row[0] * row[0] + column[1] * column[1]) <= limit,
+                Math.sqrt(row[1] * row[1] + column[2] * column[2]) <= limit,
+                Math.sqrt(row[1] * row[1] + column[3] * column[3]) <= limit,
+            ];
+        return this.full
+            ? corners[0] || corners[1] || corners[2] || corners[3]
+            : corners[0] && corners[1] && corners[2] && corners[3];
+    };
+
+    // Calls fn(iX, iY, column, row) for the cells that intersect the given box
+    Grid.prototype.eachCell = function (xMin, yMin, xMax, yMax, fn) {
+        var firstX = Math.max(this.minX, Math.floor((xMin - this.offsetX) / this.pitchX - 0.5)),
+            lastX = Math.min(this.maxX, Math.ceil((xMax - this.offsetX) / this.pitchX + 0.5)),
+            firstY = Math.max(this.minY, Math.floor((yMin - this.offsetY) / this.pitchY - 0.5)),
+            lastY = Math.min(this.maxY, Math.ceil((yMax - this.offsetY) / this.pitchY + 0.5)),
+            rows = [];
+        for (var iY = firstY; iY <= lastY; iY++) {
+            rows.push(this.row(iY));
+        }
+        for (var iX = firstX; iX <= lastX; iX++) {
+            var column = this.column(iX);
+            for (iY = firstY; iY <= lastY; iY++) {
+                if (this.contains(column, rows[iY - firstY])) {
+                    fn(iX, iY, column, rows[iY - firstY]);
+                }
+            }
+        }
+    };
+
+    wafermap.Grid = Grid;
+
+    // Base of the layers drawn on canvas tiles. Subclasses implement
+    // drawTile(ctx, tile), where tile maps map coordinates to tile pixels.
+    wafermap.CanvasLayer = L.GridLayer.extend({
+        options: {
+            pane: "overlayPane",
+        },
+
+        createTile: function (coords) {
+            var tile = L.DomUtil.create("canvas", "leaflet-tile"),
+                size = this.getTileSize(),
+                ratio = window.devicePixelRatio || 1;
+            tile.width = size.x * ratio;
+            tile.height = size.y * ratio;
+            var ctx = tile.getContext("2d");
+            ctx.scale(ratio, ratio);
+            this.drawTile(ctx, this._tile(coords, size));
+            return tile;
+        },
+
+        // The (linear) transformation of map coordinates to the pixels of a tile
+        _tile: function (coords, size) {
+            var origin = coords.scaleBy(size),
+                zero = this._map.project([0, 0], coords.z),
+                one = this._map.project([1, 1], coords.z),
+                scaleX = one.x - zero.x,
+                scaleY = one.y - zero.y,
+                shiftX = zero.x - origin.x,
+                shiftY = zero.y - origin.y,
+                x0 = -shiftX / scaleX,
+                x1 = (size.x - shiftX) / scaleX,
+                y0 = -shiftY / scaleY,
+                y1 = (size.y - shiftY) / scaleY;
+            return {
+                zoom: coords.z,
+                // pixels per map unit
+                scaleX: Math.abs(scaleX),
+                scaleY: Math.abs(scaleY),
+                x: function (x) {
+                    return shiftX + x * scaleX;
+                },
+                y: function (y) {
+                    return shiftY + y * scaleY;
+                },
+                // map box of the tile, grown by the given margin in pixels
+                box: function (marginX, marginY) {
+                    var mx = marginX / Math.abs(scaleX),
+                        my = marginY / Math.abs(scaleY);
+                    return [
+                        Math.min(x0, x1) - mx,
+                        Math.min(y0, y1) - my,
+                        Math.max(x0, x1) + mx,
+                        Math.max(y0, y1) + my,
+                    ];
+                },
+            };
+        },
+    });
+
+    // Fill and stroke a Path2D, or the current path of ctx, with Leaflet path options
+    wafermap.paint = function (ctx, style, stroke, path) {
+        var color = style.color || "#3388ff";
+        if (style.fill !== false) {
+            ctx.globalAlpha = style.fillOpacity === undefined ? 0.2 : style.fillOpacity;
+            ctx.fillStyle = style.fillColor || color;
+            path ? ctx.fill(path) : ctx.fill();
+        }
+        if (stroke && style.stroke !== false) {
+            ctx.globalAlpha = style.opacity === undefined ? 1 : style.opacity;
+            ctx.lineWidth = style.weight === undefined ? 3 : style.weight;
+            ctx.strokeStyle = color;
+            ctx.setLineDash(
+                style.dashArray ? String(style.dashArray).split(/[ ,]+/).map(Number) : []
+            );
+            path ? ctx.stroke(path) : ctx.stroke();
+        }
+        ctx.globalAlpha = 1;
+    };
+
+    // Uniform grid of buckets over packed items, written by wafermap.layers.Buckets.
+    // The items are sorted by bucket, the items of bucket i are start[i]...start[i+1].
+    function Buckets(buckets) {
+        this.x = buckets.origin[0];
+        this.y = buckets.origin[1];
+        this.width = buckets.size[0];
+        this.height = buckets.size[1];
+        this.columns = buckets.shape[0];
+        this.rows = buckets.shape[1];
+        this.start = wafermap.decode(buckets.start.data, buckets.start.dtype);
+    }
+
+    // Calls fn(i) for the items of the buckets that intersect the given box
+    Buckets.prototype.each = function (xMin, yMin, xMax, yMax, fn) {
+        var clamp = function (value, count) {
+                return Math.min(count - 1, Math.max(0, value));
+            },
+            firstX = clamp(Math.floor((xMin - this.x) / this.width), this.columns),
+            lastX = clamp(Math.floor((xMax - this.x) / this.width), this.columns),
+            firstY = clamp(Math.floor((yMin - this.y) / this.height), this.rows),
+            lastY = clamp(Math.floor((yMax - this.y) / this.height), this.rows);
+        for (var bucketY = firstY; bucketY <= lastY; bucketY++) {
+            var first = bucketY * this.columns + firstX,
+                last = bucketY * this.columns + lastX;
+            for (var i = this.start[first]; i < this.start[last + 1]; i++) {
+                fn(i);
+            }
+        }
+    };
+
+    wafermap.Buckets = Buckets;
+
+    // The cells of a grid, generated from the grid parameters. Cell styles are
+    // looked up in a dense (y, x) box of style indices, cells outside the box or
+    // without a lookup use the first style.
+    wafermap.CellGrid = wafermap.CanvasLayer.extend({
+        options: {
+            // below this cell pitch in pixels, cell outlines are not drawn
+            minPitch: 2,
+        },
+
+        initialize: function (grid, styles, lookup, options) {
+            L.GridLayer.prototype.initialize.call(this, options);
+            this._grid = new Grid(grid);
+            this._styles = styles;
+            this._lookup = lookup;
+            if (lookup) {
+                this._lookup.values = wafermap.decode(lookup.data, lookup.dtype);
+            }
+        },
+
+        styleId: function (labelY, labelX) {
+            var lookup = this._lookup;
+            if (!lookup) {
+                return 0;
+            }
+            var row = labelY - lookup.y,
+                column = labelX - lookup.x;
+            if (row < 0 || row >= lookup.height || column < 0 || column >= lookup.width) {
+                return 0;
+            }
+            return lookup.values[row * lookup.width + column];
+        },
+
+        drawTile: function (ctx, tile) {
+            var grid = this._grid,
+                self = this,
+                paths = {},
+                maxWeight = 0;
+            this._styles.forEach(function (style) {
+                maxWeight = Math.max(maxWeight, style.weight === undefined ? 3 : style.weight);
+            });
+            var box = tile.box(maxWeight, maxWeight);
+            grid.eachCell(box[0], box[1], box[2], box[3], function (iX, iY, column, row) {
+                var id = self.styleId(iY - grid.originY, iX - grid.originX),
+                    x0 = tile.x(column[0]),
+                    y0 = tile.y(row[0]),
+                    x1 = tile.x(column[3]),
+                    y1 = tile.y(row[1]);
+                (paths[id] = paths[id] || []).push(
+                    Math.min(x0, x1),
+                    Math.min(y0, y1),
+                    Math.abs(x1 - x0),
+                    Math.abs(y1 - y0)
+                );
+            });
+            var stroke =
+                grid.pitchX * tile.scaleX >= this.options.minPitch &&
+                grid.pitchY * tile.scaleY >= this.options.minPitch;
+            Object.keys(paths).forEach(function (id) {
+                var rects = paths[id];
+                ctx.beginPath();
+                for (var i = 0; i < rects.length; i += 4) {
+                    ctx.rect(rects[i], rects[i + 1], rects[i + 2], rects[i + 3]);
+                }
+                wafermap.paint(ctx, self._styles[id], stroke);
+            });
+        },
+    });
+
+    // The index labels of the cells of a grid, generated from the grid parameters.
+    // Labels are only drawn for the visible tiles, and only when the cells are
+    // large enough on screen for the labels to be readable.
+    wafermap.CellLabels = wafermap.CanvasLayer.extend({
+        options: {
+            font: "8pt sans-serif",
+            color: "black",
+            // minimum free space around a label in the cell, in pixels
+            padding: 2,
+        },
+
+        initialize: function (grid, options) {
+            L.GridLayer.prototype.initialize.call(this, options);
+            this._grid = new Grid(grid);
+            this._widestLabel = [
+                this.label(this._grid.minX, this._grid.minY),
+                this.label(this._grid.minX, this._grid.maxY),
+                this.label(this._grid.maxX, this._grid.minY),
+                this.label(this._grid.maxX, this._grid.maxY),
+            ].reduce(function (widest, label) {
+                return label.length > widest.length ? label : widest;
+            });
+        },
+
+        // the label of the cell at column iX and row iY, which is the (y, x) index
+        label: function (iX, iY) {
+            return "(" + (iY - this._grid.originY) + ", " + (iX - this._grid.originX) + ")";
+        },
+
+        drawTile: function (ctx, tile) {
+            var grid = this._grid,
+                self = this,
+                padding = this.options.padding;
+            ctx.font = this.options.font;
+            var metrics = ctx.measureText(this._widestLabel),
+                width = metrics.width,
+                height =
+                    metrics.actualBoundingBoxAscent + metrics.actualBoundingBoxDescent ||
+                    parseFloat(this.options.font) * 1.4;
+            if (
+                grid.sizeX * tile.scaleX < width + 2 * padding ||
+                grid.sizeY * tile.scaleY < height + 2 * padding
+            ) {
+                return;
+            }
+            var box = tile.box(width / 2, height / 2);
+            ctx.fillStyle = this.options.color;
+            ctx.textAlign = "center";
+            ctx.textBaseline = "middle";
+            grid.eachCell(box[0], box[1], box[2], box[3], function (iX, iY, column, row) {
+                // the label is placed half a cell size from the lower left corner
+                ctx.fillText(
+                    self.label(iX, iY),
+                    tile.x(column[0] + 0.5 * grid.sizeX),
+                    tile.y(row[0] + 0.5 * grid.sizeY)
+                );
+            });
+        },
+    });
+
+    // Points packed by wafermap.layers.PointLayer, drawn as circles. Points of the
+    // same color are drawn as a single path. Popups are resolved on click, by
+    // looking up the point under the cursor in the buckets.
+    wafermap.Points = wafermap.CanvasLayer.extend({
+        options: {
+            zIndex: 3,
+        },
+
+        initialize: function (points, style, options) {
+            L.GridLayer.prototype.initialize.call(this, options);
+            this._style = style;
+            this._buckets = new Buckets(points.buckets);
+            this._x = wafermap.decode(points.x.data, points.x.dtype);
+            this._y = wafermap.decode(points.y.data, points.y.dtype);
+            this._palette = points.palette;
+            this._colors = points.colors && wafermap.decode(points.colors.data, points.colors.dtype);
+            this._radii = points.radii && wafermap.decode(points.radii.data, points.radii.dtype);
+            this._popups = points.popups;
+            this._maxRadius = points.max_radius;
+        },
+
+        onAdd: function (map) {
+            L.GridLayer.prototype.onAdd.call(this, map);
+            if (this._popups) {
+                map.on("click", this._openPopup, this);
+            }
+        },
+
+        onRemove: function (map) {
+            map.off("click", this._openPopup, this);
+            L.GridLayer.prototype.onRemove.call(this, map);
+        },
+
+        radius: function (i) {
+            return this._radii ? this._radii[i] : this._style.radius === undefined ? 10 : this._style.radius;
+        },
+
+        // the reach of a point around its center in pixels
+        _reach: function () {
+            return this._maxRadius + (this._style.weight === undefined ? 3 : this._style.weight);
+        },
+
+        drawTile: function (ctx, tile) {
+            var self = this,
+                paths = {},
+                reach = this._reach(),
+                box = tile.box(reach, reach);
+            this._buckets.each(box[0], box[1], box[2], box[3], function (i) {
+                var x = self._x[i],
+                    y = self._y[i];
+                if (x < box[0] || x > box[2] || y < box[1] || y > box[3]) {
+                    return;
+                }
+                var color = self._colors ? self._colors[i] : -1,
+                    path = paths[color] || (paths[color] = new Path2D()),
+                    radius = self.radius(i),
+                    px = tile.x(x),
+                    py = tile.y(y);
+                path.moveTo(px + radius, py);
+                path.arc(px, py, radius, 0, 2 * Math.PI);
+            });
+            Object.keys(paths).forEach(function (color) {
+                var style = self._style;
+                if (color >= 0) {
+                    style = L.extend({}, style, { color: self._palette[color] });
+                    if (!self._style.fillColor) {
+                        style.fillColor = style.color;
+                    }
+                }
+                wafermap.paint(ctx, style, true, paths[color]);
+            });
+        },
+
+        _openPopup: function (event) {
+            var map = this._map,
+                zoom = map.getZoom(),
+                origin = map.project([0, 0], zoom),
+                unit = map.project([1, 1], zoom),
+                scaleX = Math.abs(unit.x - origin.x),
+                scaleY = Math.abs(unit.y - origin.y),
+                reach = this._reach(),
+                x = event.latlng.lng,
+                y = event.latlng.lat,
+                self = this,
+                nearest = -1,
+                nearestDistance = Infinity;
+            this._buckets.each(
+                x - reach / scaleX,
+                y - reach / scaleY,
+                x + reach / scaleX,
+                y + reach / scaleY,
+                function (i) {
+                    var dx = (self._x[i] - x) * scaleX,
+                        dy = (self._y[i] - y) * scaleY,
+                        distance = Math.sqrt(dx * dx + dy * dy);
+                    if (distance <= self.radius(i) + 3 && distance < nearestDistance) {
+                        nearest = i;
+                        nearestDistance = distance;
+                    }
+                }
+            );
+            if (nearest >= 0 && this._popups[nearest]) {
+                L.popup()
+                    .setLatLng([this._y[nearest], this._x[nearest]])
+                    .setContent(this._popups[nearest])
+                    .openOn(map);
+            }
+        },
+    });
+
+    // Vectors packed by wafermap.layers.VectorLayer, drawn as line segments from
+    // (x, y) to (x + dx, y + dy). Vectors of the same color are drawn as a single path.
+    wafermap.Vectors = wafermap.CanvasLayer.extend({
+        options: {
+            zIndex: 3,
+        },
+
+        initialize: function (vectors, style, options) {
+            L.GridLayer.prototype.initialize.call(this, options);
+            this._style = L.extend({ fill: false }, style);
+            this._buckets = new Buckets(vectors.buckets);
+            this._x = wafermap.decode(vectors.x.data, vectors.x.dtype);
+            this._y = wafermap.decode(vectors.y.data, vectors.y.dtype);
+            this._dx = wafermap.decode(vectors.dx.data, vectors.dx.dtype);
+            this._dy = wafermap.decode(vectors.dy.data, vectors.dy.dtype);
+            this._palette = vectors.palette;
+            this._colors = vectors.colors && wafermap.decode(vectors.colors.data, vectors.colors.dtype);
+            // the vectors are bucketed by their start, so a tile also visits the
+            // buckets within the longest vector
+            this._maxLength = vectors.max_length;
+        },
+
+        drawTile: function (ctx, tile) {
+            var self = this,
+                paths = {},
+                weight = this._style.weight === undefined ? 3 : this._style.weight,
+                box = tile.box(weight, weight),
+                reach = this._maxLength;
+            this._buckets.each(
+                box[0] - reach,
+                box[1] - reach,
+                box[2] + reach,
+                box[3] + reach,
+                function (i) {
+                    var x = self._x[i],
+                        y = self._y[i],
+                        dx = self._dx[i],
+                        dy = self._dy[i];
+                    if (
+                        Math.max(x, x + dx) < box[0] ||
+                        Math.min(x, x + dx) > box[2] ||
+                        Math.max(y, y + dy) < box[1] ||
+                        Math.min(y, y + dy) > box[3]
+                    ) {
+                        return;
+                    }
+                    var color = self._colors ? self._colors[i] : -1,
+                        path = paths[color] || (paths[color] = new Path2D());
+                    path.moveTo(tile.x(x), tile.y(y));
+                    path.lineTo(tile.x(x + dx), tile.y(y + dy));
+                }
+            );
+            Object.keys(paths).forEach(function (color) {
+                var style = self._style;
+                if (color >= 0) {
+                    style = L.extend({}, style, { color: self._palette[color] });
+                }
+                wafermap.paint(ctx, style, true, paths[color]);
+            });
+        },
+    });
+
+    // Labels packed by wafermap.layers.LabelLayer. Only the labels in the view are
+    // added to the DOM, and only when the zoom level spreads them enough to be
+    // readable (or above minZoom, if given). Label styles are CSS classes.
+    wafermap.Labels = L.Layer.extend({
+        options: {
+            pane: "markerPane",
+            minZoom: null,
+            // above this number of labels in the view, none is shown
+            maxLabels: 2000,
+        },
+
+        initialize: function (labels, options) {
+            L.setOptions(this, options);
+            this._buckets = new Buckets(labels.buckets);
+            this._x = wafermap.decode(labels.x.data, labels.x.dtype);
+            this._y = wafermap.decode(labels.y.data, labels.y.dtype);
+            this._texts = labels.texts;
+            this._classes = labels.classes;
+            this._classIndex = wafermap.decode(labels.class_index.data, labels.class_index.dtype);
+            this._popups = labels.popups;
+            this._spacing = labels.spacing;
+            this._width = labels.width;
+        },
+
+        onAdd: function (map) {
+            this._container = L.DomUtil.create(
+                "div",
+                "wafermap-labels leaflet-zoom-hide",
+                this.getPane()
+            );
+            if (this._popups) {
+                L.DomEvent.on(this._container, "click", this._openPopup, this);
+            }
+            map.on("moveend zoomend viewreset", this._update, this);
+            this._update();
+        },
+
+        onRemove: function (map) {
+            map.off("moveend zoomend viewreset", this._update, this);
+            L.DomUtil.remove(this._container);
+        },
+
+        _readable: function () {
+            var map = this._map,
+                zoom = map.getZoom();
+            if (this.options.minZoom !== null) {
+                return zoom >= this.options.minZoom;
+            }
+            if (this._spacing === null) {
+                return true;
+            }
+            var origin = map.project([0, 0], zoom),
+                unit = map.project([1, 1], zoom);
+            return this._spacing * Math.abs(unit.x - origin.x) >= this._width;
+        },
+
+        _update: function () {
+            var map = this._map,
+                container = this._container,
+                self = this,
+                visible = [];
+            container.innerHTML = "";
+            if (!this._readable()) {
+                return;
+            }
+            var bounds = map.getBounds(),
+                xMin = bounds.getWest(),
+                xMax = bounds.getEast(),
+                yMin = bounds.getSouth(),
+                yMax = bounds.getNorth();
+            this._buckets.each(xMin, yMin, xMax, yMax, function (i) {
+                var x = self._x[i],
+                    y = self._y[i];
+                if (x >= xMin && x <= xMax && y >= yMin && y <= yMax) {
+                    visible.push(i);
+                }
+            });
+            if (visible.length > this.options.maxLabels) {
+                return;
+            }
+            var fragment = document.createDocumentFragment();
+            visible.forEach(function (i) {
+                var label = L.DomUtil.create("div", "wafermap-label " + self._classes[self._classIndex[i]]),
+                    point = map.latLngToLayerPoint([self._y[i], self._x[i]]);
+                label.innerHTML = self._texts[i];
+                label.style.left = point.x + "px";
+                label.style.top = point.y + "px";
+                if (self._popups && self._popups[i]) {
+                    label.dataset.index = i;
+                    L.DomUtil.addClass(label, "leaflet-interactive");
+                }
+                fragment.appendChild(label);
+            });
+            container.appendChild(fragment);
+        },
+
+        _openPopup: function (event) {
+            var label = event.target.closest(".wafermap-label");
+            if (!label || label.dataset.index === undefined) {
+                return;
+            }
+            var i = Number(label.dataset.index);
+            L.DomEvent.stopPropagation(event);
+            L.popup()
+                .setLatLng([this._y[i], this._x[i]])
+                .setContent(this._popups[i])
+                .openOn(this._map);
+        },
+    });
+})();
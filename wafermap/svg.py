@@ -0,0 +1,307 @@
+"""
+SVG writer that draws the layers of a wafermap as vector graphics, without a browser.
+The SVG is framed as the PNG images, in pixels, so strokes and point radii keep their
+Leaflet sizes, and it scales to any resolution.
+"""
+
+import base64
+import html
+import mimetypes
+from typing import Union
+
+import numpy
+from branca.element import Element
+
+from wafermap import utils
+from wafermap.layers import LayerPainter, PathStyle
+from wafermap.raster import Viewport, merge_segments
+
+# decimals of the pixel coordinates
+PRECISION = 2
+
+
+def numbers(values) -> numpy.ndarray:
+    """
+    Pixel coordinates as short strings. The coordinates of a grid take few values, so
+    each value is only formatted once.
+    """
+    values, inverse = numpy.unique(
+        numpy.round(numpy.asarray(values, dtype=float), PRECISION), return_inverse=True
+    )
+    strings = numpy.asarray([format(value, "g") for value in values.tolist()], object)
+    return strings[inverse.reshape(-1)]
+
+
+def hex_color(color: tuple[float, float, float]) -> str:
+    return utils.rgb_to_html(*color)
+
+
+class SvgWriter(LayerPainter):
+    """
+    Draws the elements of a folium map to SVG, see LayerPainter. Identical styles are
+    shared as CSS classes, and the cells of a grid are drawn as a path per style, with
+    a rectangle per run of adjacent cells of a row.
+    """
+
+    def __init__(self, viewport: Viewport, background: tuple[int, int, int]):
+        super().__init__(viewport)
+        self.background = background
+        self.classes = {}
+        self.body = []
+
+    def css_class(self, **properties) -> str:
+        """The name of the class of the CSS properties, added on first use"""
+        key = tuple(properties.items())
+        if key not in self.classes:
+            self.classes[key] = f"s{len(self.classes)}"
+        return self.classes[key]
+
+    def path_class(
+        self,
+        style: PathStyle,
+        color: Union[tuple, None] = None,
+        fill_color: Union[tuple, None] = None,
+    ) -> str:
+        properties = {"fill": "none"}
+        if style.fill:
+            properties = {
+                "fill": hex_color(fill_color or style.fill_color),
+                "fill-opacity": format(style.fill_opacity, "g"),
+            }
+        if style.stroke:
+            properties.update(
+                {
+                    "stroke": hex_color(color or style.color),
+                    "stroke-opacity": format(style.opacity, "g"),
+                    "stroke-width": format(style.weight, "g"),
+                    "stroke-linecap": "round",
+                    "stroke-linejoin": "round",
+                }
+            )
+        return self.css_class(**properties)
+
+    def text(
+        self,
+        x: float,
+        y: float,
+        text: str,
+        size: float,
+        color: tuple[float, float, float],
+    ):
+        if text:
+            name = self.css_class(
+                **{"font-size": f"{size:.4g}px", "fill": hex_color(color)}
+            )
+            x, y = numbers([x, y])
+            self.body.append(
+                f'<text class="{name}" x="{x}" y="{y}">{html.escape(text)}</text>'
+            )
+
+    def cells(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        styles: list[PathStyle],
+        style_ids: numpy.ndarray,
+        outline: bool,
+    ):
+        # the fills of the runs of adjacent cells of a row with the same fill
+        fill_classes = numpy.asarray(
+            [
+                (
+                    self.css_class(
+                        **{
+                            "fill": hex_color(style.fill_color),
+                            "fill-opacity": format(style.fill_opacity, "g"),
+                        }
+                    )
+                    if style.fill
+                    else ""
+                )
+                for style in styles
+            ],
+            dtype=object,
+        )[style_ids]
+        order = numpy.lexsort((x0, y0))
+        fill_classes = fill_classes[order]
+        run_start = numpy.ones(len(order), dtype=bool)
+        run_start[1:] = (
+            (
+                numpy.round(y0[order][1:], PRECISION)
+                != numpy.round(y0[order][:-1], PRECISION)
+            )
+            | (
+                numpy.round(x0[order][1:], PRECISION)
+                != numpy.round(x1[order][:-1], PRECISION)
+            )
+            | (fill_classes[1:] != fill_classes[:-1])
+        )
+        starts = numpy.flatnonzero(run_start)
+        ends = numpy.append(starts[1:], len(order)) - 1
+        run_classes = fill_classes[starts]
+        run_x0, run_y0 = numbers(x0[order][starts]), numbers(y0[order][starts])
+        run_x1, run_y1 = numbers(x1[order][ends]), numbers(y1[order][starts])
+        for name in dict.fromkeys(run_classes.tolist()):
+            if name:
+                runs = numpy.flatnonzero(run_classes == name).tolist()
+                path = "".join(
+                    f"M{run_x0[i]} {run_y0[i]}H{run_x1[i]}V{run_y1[i]}H{run_x0[i]}Z"
+                    for i in runs
+                )
+                self.body.append(f'<path class="{name}" d="{path}"/>')
+
+        if not outline:
+            return
+        # the edges of the cells with the same outline, as the lines of a grid
+        outline_classes = numpy.asarray(
+            [
+                (
+                    self.css_class(
+                        **{
+                            "fill": "none",
+                            "stroke": hex_color(style.color),
+                            "stroke-opacity": format(style.opacity, "g"),
+                            "stroke-width": format(style.weight, "g"),
+                        }
+                    )
+                    if style.stroke
+                    else ""
+                )
+                for style in styles
+            ],
+            dtype=object,
+        )[style_ids]
+        for name in dict.fromkeys(outline_classes.tolist()):
+            if not name:
+                continue
+            cells = outline_classes == name
+            cx0, cy0, cx1, cy1 = x0[cells], y0[cells], x1[cells], y1[cells]
+            vertical = merge_segments(
+                numpy.concatenate([cx0, cx1]),
+                numpy.concatenate([cy0, cy0]),
+                numpy.concatenate([cy1, cy1]),
+                PRECISION,
+            )
+            horizontal = merge_segments(
+                numpy.concatenate([cy0, cy1]),
+                numpy.concatenate([cx0, cx0]),
+                numpy.concatenate([cx1, cx1]),
+                PRECISION,
+            )
+            x, y_start, y_end = (numbers(values) for values in vertical)
+            y, x_start, x_end = (numbers(values) for values in horizontal)
+            path = "".join(
+                [
+                    *(f"M{a} {b}V{c}" for a, b, c in zip(x, y_start, y_end)),
+                    *(f"M{b} {a}H{c}" for a, b, c in zip(y, x_start, x_end)),
+                ]
+            )
+            self.body.append(f'<path class="{name}" d="{path}"/>')
+
+    def points(
+        self,
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        radius: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        xs, ys, radii = numbers(x), numbers(y), numbers(radius)
+        for color_id, (color, fill_color) in enumerate(palette):
+            points = numpy.flatnonzero(color_index == color_id).tolist()
+            if not points:
+                continue
+            name = self.path_class(style, color, fill_color)
+            circles = "".join(
+                f'<circle cx="{xs[i]}" cy="{ys[i]}" r="{radii[i]}"/>' for i in points
+            )
+            self.body.append(f'<g class="{name}">{circles}</g>')
+
+    def vectors(
+        self,
+        x0: numpy.ndarray,
+        y0: numpy.ndarray,
+        x1: numpy.ndarray,
+        y1: numpy.ndarray,
+        style: PathStyle,
+        palette: list,
+        color_index: numpy.ndarray,
+    ):
+        x0s, y0s, x1s, y1s = numbers(x0), numbers(y0), numbers(x1), numbers(y1)
+        for color_id, color in enumerate(palette):
+            vectors = numpy.flatnonzero(color_index == color_id).tolist()
+            if not vectors:
+                continue
+            name = self.path_class(style, color)
+            path = "".join(f"M{x0s[i]} {y0s[i]}L{x1s[i]} {y1s[i]}" for i in vectors)
+            self.body.append(f'<path class="{name}" d="{path}"/>')
+
+    def circle(self, x: float, y: float, radius: float, style: PathStyle):
+        name = self.path_class(style)
+        x, y, radius = numbers([x, y, radius])
+        self.body.append(f'<circle class="{name}" cx="{x}" cy="{y}" r="{radius}"/>')
+
+    def path(self, x: numpy.ndarray, y: numpy.ndarray, style: PathStyle, closed: bool):
+        name = self.path_class(style)
+        points = " ".join(f"{px},{py}" for px, py in zip(numbers(x), numbers(y)))
+        tag = "polygon" if closed else "polyline"
+        self.body.append(f'<{tag} class="{name}" points="{points}"/>')
+
+    def image(self, image_file: str, x0: float, y0: float, x1: float, y1: float):
+        mime_type = mimetypes.guess_type(image_file)[0] or "image/png"
+        with open(image_file, "rb") as f:
+            data = base64.b64encode(f.read()).decode("ascii")
+        x, y, width, height = numbers([x0, y0, x1 - x0, y1 - y0])
+        self.body.append(
+            f'<image x="{x}" y="{y}" width="{width}" height="{height}" '
+            f'preserveAspectRatio="none" href="data:{mime_type};base64,{data}"/>'
+        )
+
+    def svg(self) -> str:
+        """The SVG document"""
+        viewport = self.viewport
+        width, height = viewport.width, viewport.height
+        rules = "\n".join(
+            f".{name}{{{';'.join(f'{key}:{value}' for key, value in properties)}}}"
+            for properties, name in self.classes.items()
+        )
+        return "\n".join(
+            [
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+                f'height="{height}" viewBox="0 0 {width} {height}">',
+                "<style>",
+                "text{text-anchor:middle;dominant-baseline:central;"
+                "font-family:sans-serif}",
+                rules,
+                "</style>",
+                f'<rect width="100%" height="100%" '
+                f'fill="{utils.rgb_to_html(*(c / 255 for c in self.background))}"/>',
+                *self.body,
+                "</svg>",
+                "",
+            ]
+        )
+
+
+def write_svg(
+    root: Element,
+    bounds: list,
+    size: tuple[int, int],
+    padding: tuple[int, int],
+    background: tuple[int, int, int],
+) -> str:
+    """
+    Draw a folium map to SVG, as framed by fit_bounds(bounds, padding) in a browser
+    window of the given size.
+    :param root: The root (Figure) of the map.
+    :param bounds: [lower_left, upper_right] of the view in map units (y, x).
+    :param size: (width, height) of the SVG in pixels.
+    :param padding: (x, y) padding around the bounds in pixels.
+    :param background: (r, g, b) background color in 0-255.
+    """
+    writer = SvgWriter(Viewport(size, bounds, padding), background)
+    writer.draw(root)
+    return writer.svg()
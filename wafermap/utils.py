@@ -37,6 +37,36 @@ def euclidean_distance(point: (float, float), origin: (float, float) = None) ->
     return math.sqrt(sum(((p - o) ** 2 for p, o in zip(point, origin))))
 
 
+def content_box(pixels: numpy.ndarray, tolerance: int = 8) -> (int, int, int, int):
+    """
+    Find the box of the content of an image, the pixels that differ from the
+    background by more than tolerance in any channel. The background is the most
+    common color of the border of the image.
+    :param pixels: (height, width) or (height, width, channels) array of the image.
+    :return: (left, top, right, bottom) of the box, the whole image if it is empty.
+    """
+    pixels = numpy.asarray(pixels)
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    height, width = pixels.shape[:2]
+    border = numpy.concatenate(
+        [pixels[0], pixels[-1], pixels[1:-1, 0], pixels[1:-1, -1]]
+    )
+    colors, counts = numpy.unique(border, axis=0, return_counts=True)
+    background = colors[counts.argmax()].astype(numpy.int16)
+    content = numpy.zeros((height, width), dtype=bool)
+    for channel in range(pixels.shape[2]):
+        content |= (
+            numpy.abs(pixels[..., channel].astype(numpy.int16) - background[channel])
+            > tolerance
+        )
+    rows = numpy.flatnonzero(content.any(axis=1))
+    columns = numpy.flatnonzero(content.any(axis=0))
+    if not len(rows):
+        return 0, 0, width, height
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
 def bounded_rectangle(
     rect: [(float, float)], bounds: [(float, float)]
 ) -> [(float, float)]:
@@ -94,6 +124,52 @@ def rotate(
     )
 
 
+def circle_rectangle_area(
+    x_min: numpy.ndarray,
+    y_min: numpy.ndarray,
+    x_max: numpy.ndarray,
+    y_max: numpy.ndarray,
+    radius: float,
+) -> numpy.ndarray:
+    """
+    Exact area of the intersection of axis-aligned rectangles [x_min, x_max] x
+    [y_min, y_max] with the circle of the given radius centered at the origin.
+    Vectorized over the rectangles.
+    """
+    return (
+        _circle_quadrant_area(x_max, y_max, radius)
+        - _circle_quadrant_area(x_min, y_max, radius)
+        - _circle_quadrant_area(x_max, y_min, radius)
+        + _circle_quadrant_area(x_min, y_min, radius)
+    )
+
+
+def _circle_quadrant_area(
+    x: numpy.ndarray, y: numpy.ndarray, radius: float
+) -> numpy.ndarray:
+    """Signed area of the circle centered at the origin within [0, x] x [0, y]"""
+    sign = numpy.sign(x) * numpy.sign(y)
+    x = numpy.minimum(numpy.abs(x), radius)
+    y = numpy.minimum(numpy.abs(y), radius)
+    # x where the circle crosses the horizontal line at y: the rectangle is within
+    # the circle up to there, beyond it the area is bounded by the circle arc
+    x_cross = numpy.sqrt(radius**2 - y**2)
+    x_arc = numpy.maximum(x, x_cross)
+
+    def arc_integral(t):
+        # antiderivative of sqrt(radius**2 - t**2)
+        return 0.5 * (
+            t * numpy.sqrt(radius**2 - t**2) + radius**2 * numpy.arcsin(t / radius)
+        )
+
+    area = numpy.where(
+        x <= x_cross,
+        x * y,
+        y * x_cross + arc_integral(x_arc) - arc_integral(x_cross),
+    )
+    return sign * area
+
+
 def cart2pol(x: float, y: float) -> (float, float):
     """Convert cartesian coordinates x, y into polar rho, phi"""
     rho = numpy.sqrt(x**2 + y**2)
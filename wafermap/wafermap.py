@@ -1,221 +1,44 @@
 """Wafermap class implementation"""
 
-import base64
-import math
+import copy
+import json
 import os
-from io import BytesIO
-from typing import Union, Generator
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from typing import Union
+from urllib.parse import quote
 
 import branca
 import folium
-from folium import IFrame, plugins
-from html2image import Html2Image
+import numpy
+from folium import plugins
 from PIL import Image
 
-from wafermap import utils
-
-
-class WaferMapGrid:
-
-    def __init__(
-        self,
-        wafer_radius: float,
-        cell_size: tuple[float, float],
-        cell_margin: tuple[float, float] = (0.0, 0.0),
-        cell_origin: tuple[int, int] = (0, 0),
-        grid_offset: tuple[float, float] = (0.0, 0.0),
-        edge_exclusion: float = 3.0,
-        coverage="full",
-        conversion_factor: float = 1.0,
-    ):
-        """
-        The WaferMap base class. Represents a circular wafer layout, with a grid, an edge exclusion and cells.
-        :param wafer_radius: Wafer radius in mm
-        :param cell_size: Cell size in mm, (x, y)
-        :param cell_margin: Distance between cells in mm, (x, y)
-        :param cell_origin: The cell (x, y), that is the origin of the map (position (0, 0) on the map). (0, 0) is by convention the center of the map.
-        :param grid_offset: Grid offset in mm, (x, y)
-        :param edge_exclusion: Margin from the wafer edge where no cells are allowed.
-        :param coverage: Options of 'full', 'inner'. Option 'full' will cover the whole wafer with cells, so partial cells are allowed. Option 'inner' only allows full cells to be included
-        :param conversion_factor: Factor to multiply input dimensions with.
-        """
-
-        # input validation
-        if any(
-            [
-                wafer_radius <= 0,
-                len(cell_size) != 2,
-                len(cell_margin) != 2,
-                len(cell_origin) != 2,
-                len(grid_offset) != 2,
-                edge_exclusion < 0,
-                any([cell_size[0] <= 0, cell_size[1] <= 0]),
-                any([cell_margin[0] < 0, cell_margin[1] < 0]),
-                coverage.lower() not in ["inner", "full"],
-            ]
-        ):
-            raise ValueError("Invalid input")
-
-        self.conversion_factor = conversion_factor
-        self.coverage = coverage.lower()
-        self.cell_size_x = self.conversion_factor * cell_size[0]
-        self.cell_size_y = self.conversion_factor * cell_size[1]
-        self.cell_margin_x = self.conversion_factor * cell_margin[0]
-        self.cell_margin_y = self.conversion_factor * cell_margin[1]
-        self.cell_origin_x = int(cell_origin[0])
-        self.cell_origin_y = int(cell_origin[1])
-        self.wafer_radius = self.conversion_factor * wafer_radius
-        self.edge_exclusion = self.conversion_factor * edge_exclusion
-        self.grid_offset_x = self.conversion_factor * grid_offset[0]
-        self.grid_offset_y = self.conversion_factor * grid_offset[1]
-        self._num_of_cells_x = math.ceil(2 * self.wafer_radius / self.cell_size_x)
-        self._num_of_cells_y = math.ceil(2 * self.wafer_radius / self.cell_size_y)
-
-        # init the _cell_map
-        # the cell map is a dict that corresponds the pixel coordinates of the bounding
-        # box of each cell to the cell index:
-        # {(cell_y, cell_x): ((y_lower_left, x_lower_left),
-        #                     (y_lower_right, x_lower_right),
-        #                     (y_upper_left, x_upper_left),
-        #                     (y_upper_right, x_upper_right),
-        #                     (y_cell_center, x_cell_center)
-        #                     )}
-        # We consider the cell origin to be its lower left corner
-        # y is latitude, x is longitude
-        self._cell_map = {}
-
-        # Add grid
-        min_index_x = -math.ceil(self._num_of_cells_x / 2) - 1
-        max_index_x = math.ceil(self._num_of_cells_x / 2) + 1
-        min_index_y = -math.ceil(self._num_of_cells_y / 2) - 1
-        max_index_y = math.ceil(self._num_of_cells_y / 2) + 1
-        for i_x in range(min_index_x, max_index_x):
-            for i_y in range(min_index_y, max_index_y):
-                cell_label = (i_y - self.cell_origin_y, i_x - self.cell_origin_x)
-                # print a box
-                lower_bound = (
-                    (i_y - 0.5) * (self.cell_size_y + self.cell_margin_y)
-                    + self.grid_offset_y,
-                    (i_x - 0.5) * (self.cell_size_x + self.cell_margin_x)
-                    + self.grid_offset_x,
-                )
-                upper_bound = (
-                    (i_y + 0.5) * (self.cell_size_y + self.cell_margin_y)
-                    + self.grid_offset_y,
-                    (i_x + 0.5) * (self.cell_size_x + self.cell_margin_x)
-                    + self.grid_offset_x,
-                )
-                lower_left = (
-                    lower_bound[0] + self.cell_margin_y / 2,
-                    lower_bound[1] + self.cell_margin_x / 2,
-                )
-                lower_right = (
-                    lower_bound[0] + self.cell_margin_y / 2,
-                    lower_bound[1] + self.cell_size_x - self.cell_margin_x / 2,
-                )
-                upper_left = (
-                    upper_bound[0] - self.cell_margin_y / 2,
-                    upper_bound[1] - self.cell_size_x + self.cell_margin_x / 2,
-                )
-                upper_right = (
-                    upper_bound[0] - self.cell_margin_y / 2,
-                    upper_bound[1] - self.cell_margin_x / 2,
-                )
-                bounds = (lower_left, lower_right, upper_left, upper_right)
-                center = (
-                    (lower_left[0] + upper_left[0]) / 2,
-                    (lower_left[1] + lower_right[1]) / 2,
-                )
-
-                in_for_full = any(
-                    list(
-                        map(
-                            lambda points: utils.euclidean_distance(points)
-                            <= self.wafer_radius,
-                            bounds,
-                        )
-                    )
-                )
-                in_for_inner = all(
-                    list(
-                        map(
-                            lambda points: utils.euclidean_distance(points)
-                            <= self.wafer_radius,
-                            bounds,
-                        )
-                    )
-                )
-
-                if (self.coverage == "full" and in_for_full) or (
-                    self.coverage == "inner" and in_for_inner
-                ):
-                    self._cell_map[cell_label] = bounds + (center,)  # in (y,x)
-
-        self.current_cell_idx = 0
-
-    def __getitem__(self, item):
-        # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we provide
-        # cell_map as a property to interface with outside the class, which fully converts _cell_map from (y,x) to (x,y)
-        y, x = item
-        return self._cell_map[(y, x)]
-
-    def __next__(self):
-        try:
-            cell_ = list(self._cell_map.keys())[self.current_cell_idx]
-            # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we transform cell
-            # from (y, x) to (x, y)
-            cell = (cell_[1], cell_[0])
-        except IndexError:
-            raise StopIteration()
-        self.current_cell_idx += 1
-        return cell
-
-    def __iter__(self):
-        self.current_cell_idx = 0
-        return self
-
-    def __len__(self):
-        return len(self._cell_map)
-
-    @property
-    def cell_map(self):
-        # Internal attribute _cell_map uses (y,x) convention while we interface with (x,y). Therefore, we provide
-        # cell_map as a property to interface with outside the class, which fully converts _cell_map from (y,x) to (x,y)
-        cell_map = {}
-        for _cell_idx, _cell in self._cell_map.items():
-            cell_idx = _cell_idx[1], _cell_idx[0]
-            cell = ()
-            for _cell_item in _cell:
-                if type(_cell_item) is tuple:
-                    cell += ((_cell_item[1], _cell_item[0]),)
-                else:
-                    cell += (_cell_item,)
-            cell_map[cell_idx] = cell
-        return cell_map
-
-    def cell_to_wafer_coordinates(
-        self,
-        cell: Union[tuple[int, int], None] = (0, 0),
-        offset: tuple[float, float] = (0.0, 0.0),
-    ) -> tuple[float, float]:
-        """
-        Convert cell coordinates to wafer coordinates
-        """
-        if cell:
-            if cell in self._cell_map:
-                # offset is cell coordinates
-                origin = self._cell_map[cell][0]
-                wafer_coords = (
-                    offset[0] + origin[0],
-                    offset[1] + origin[1],
-                )
-            else:
-                raise ValueError(f"{str(cell)} does not exist in wafermap.")
-        else:
-            # offset is already wafer coordinates
-            wafer_coords = offset
-
-        return wafer_coords
+from wafermap import raster, svg, utils, writer
+from wafermap.browser import BrowserPool
+from wafermap.grid import (
+    CellMapView,
+    CellStore,
+    GridCache,
+    GridOffsetSweep,
+    WaferMapGrid,
+)
+from wafermap.images import TILE_FORMATS, Thumbnail, ThumbnailCache, build_tile_pyramid
+from wafermap.layers import (
+    AssetDirectory,
+    CellGridLayer,
+    CellLabelLayer,
+    ImageFileOverlay,
+    ImageTileLayer,
+    LabelLayer,
+    ParametricGridLayer,
+    PointLayer,
+    PrerenderedLayer,
+    ThumbnailFrame,
+    VectorLayer,
+    iter_elements,
+)
 
 
 class WaferMap(WaferMapGrid):
@@ -223,6 +46,9 @@ class WaferMap(WaferMapGrid):
     IMAGE_RESOLUTION = (2560, 1440)
     NOTCH_HEIGHT = 1
     NOTCH_WIDTH = 2.8284
+    DEFAULT_CELL_STYLE = {"color": "#142d2d", "weight": 0.2, "fill": False}
+    DEFAULT_BIN_STYLE = {"fill": True, "fillOpacity": 0.8}
+    COLORMAP_LEVELS = 256
     DEFAULT_MARKER_STYLE = {"color": "#ff0000", "fill": True}
     DEFAULT_VECTOR_STYLE = {"color": "#009900", "weight": 1}
     DEFAULT_POINT_STYLE = {"radius": 0.5, "fill": True}
@@ -232,6 +58,10 @@ class WaferMap(WaferMapGrid):
     )
     IMAGE_SIZE_IN_POPUP = (400, 400)
     MAP_PADDING = (50, 50)  # in pixels (x, y)
+    GRID_RENDERINGS = ("geojson", "parametric")
+    PNG_RENDERERS = ("browser", "raster")
+    IMAGE_FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+    THUMBNAIL_CACHE = ThumbnailCache()
 
     def __init__(
         self,
@@ -246,6 +76,7 @@ class WaferMap(WaferMapGrid):
         wafer_edge_color: tuple[float, float, float] = (0.0, 0.0, 0.0),
         map_bg_color: Union[None, tuple[float, float, float]] = None,
         conversion_factor: float = 1.0,
+        grid_rendering: str = "geojson",
     ):
         """
         Main WaferMap class. Represents a circular wafer layout, with a grid, an edge exclusion, cells and several types
@@ -257,12 +88,16 @@ class WaferMap(WaferMapGrid):
         :param grid_offset: Grid offset in mm, (x, y)
         :param edge_exclusion: Margin from the wafer edge where a red edge exclusion
         ring is drawn in mm.
-        :param coverage: Options of 'full', 'inner'. Option 'full' will cover wafer with
-         cells, partial cells allowed, 'inner' will only allow full cells
+        :param coverage: Options of 'full', 'inner', 'usable'. Option 'full' will cover
+         wafer with cells, partial cells allowed, 'inner' will only allow full cells,
+         'usable' will only allow full cells inside the edge exclusion ring
         :param wafer_edge_color: tuple of (r, g, b), 0-1 for the wafer edge color.
         :param map_bg_color: tuple of (r, g, b), 0-1 for the map background color. If
         None, the inverted wafer_edge_color will be selected
         :param conversion_factor: Factor to multiply input dimensions with.
+        :param grid_rendering: Options of 'geojson', 'parametric'. Option 'geojson'
+        writes every cell to the output, option 'parametric' only writes the grid
+        parameters and the cells are drawn by the browser.
         """
 
         # input validation
@@ -270,6 +105,7 @@ class WaferMap(WaferMapGrid):
             [
                 len(wafer_edge_color) != 3,
                 any([x < 0 for x in wafer_edge_color]),
+                grid_rendering not in WaferMap.GRID_RENDERINGS,
             ]
         ):
             raise ValueError("Invalid input")
@@ -290,22 +126,11 @@ class WaferMap(WaferMapGrid):
             map_bg_color = utils.to255(*utils.invert(*wafer_edge_color))
         else:
             map_bg_color = utils.to255(*map_bg_color)
+        self._map_bg_color = map_bg_color
         wafer_edge_color = utils.rgb_to_html(*wafer_edge_color)
 
         # Init the folium map
-        folium_map = folium.Map(
-            tiles=None,
-            crs="Simple",
-            prefer_canvas=True,
-            control_scale=False,
-            zoom_control=False,
-            zoom_start=1,
-            min_zoom=1,
-            max_zoom=1000,
-            zoomSnap=0,
-            zoomDelta=0.1,
-            png_enabled=True,
-        )
+        folium_map = WaferMap._folium_map()
 
         # Add the base layer
         # Create a white image of 4 pixels, and embed it in an url.
@@ -321,15 +146,14 @@ class WaferMap(WaferMapGrid):
         self._tile_layer.add_to(folium_map)
 
         # Init rest of layers
-        self._grid_layer = folium.map.FeatureGroup(name="grid")
-        self._cell_labels_layer = folium.map.FeatureGroup(
-            name="cell labels", show=False
+        self.grid_rendering = grid_rendering
+        self._init_data_layers()
+        # the cell labels are drawn by the browser for the visible cells only, when
+        # they are large enough to be readable
+        self._cell_labels_layer = CellLabelLayer(
+            self._grid_parameters, name="cell labels", show=False
         )
-        self._labels_layer = folium.map.FeatureGroup(name="labels", show=False)
         self._edge_exclusion_layer = folium.map.FeatureGroup(name="edge exclusion")
-        self._images_layer = folium.map.FeatureGroup(name="images")
-        self._markers_layer = folium.map.FeatureGroup(name="markers")
-        self._vectors_layer = folium.map.FeatureGroup(name="vectors")
 
         # Add wafer edge
         folium.Circle(
@@ -373,41 +197,6 @@ class WaferMap(WaferMapGrid):
                 fill=False,
             ).add_to(self._edge_exclusion_layer)
 
-        # Add grid
-        for cell_label, (
-            lower_left,
-            lower_right,
-            upper_left,
-            upper_right,
-            center,
-        ) in self._cell_map.items():
-            # add the folium Rectangle to the _cell_map
-            self._cell_map[cell_label] += (
-                folium.vector_layers.Rectangle(
-                    [lower_left, upper_right],
-                    popup=None,
-                    tooltip=None,
-                    color="#142d2d",
-                    weight=0.2,
-                    fill=False,
-                ),
-            )
-            self._cell_map[cell_label][5].add_to(self._grid_layer)
-
-            # print labels
-            folium.map.Marker(
-                [
-                    lower_left[0] + (0.5 * self.cell_size_y),
-                    lower_left[1] + (0.5 * self.cell_size_x),
-                ],
-                icon=folium.features.DivIcon(
-                    icon_size=(50, 20),
-                    icon_anchor=(25, 10),
-                    html=f'<div style="font-size: 8pt; color: black;'
-                    f'text-align: center">{str(cell_label)}</div>',
-                ),
-            ).add_to(self._cell_labels_layer)
-
         self._grid_layer.add_to(folium_map)
         self._cell_labels_layer.add_to(folium_map)
         self._labels_layer.add_to(folium_map)
@@ -440,63 +229,349 @@ class WaferMap(WaferMapGrid):
         self._labels_layer.show = False
         self._cell_labels_layer.show = False
 
+        # the static layers of the map, rendered on the first clone
+        self._prerendered_layers = None
+
+    @staticmethod
+    def _folium_map() -> folium.Map:
+        return folium.Map(
+            tiles=None,
+            crs="Simple",
+            prefer_canvas=True,
+            control_scale=False,
+            zoom_control=False,
+            zoom_start=1,
+            min_zoom=1,
+            max_zoom=1000,
+            zoomSnap=0,
+            zoomDelta=0.1,
+            png_enabled=True,
+        )
+
+    def _init_data_layers(self, geometries: Union[list[str], None] = None):
+        """Init the cell styles and the layers of the data added to the map"""
+        # cell styles are kept columnar: a table of distinct styles and the index
+        # of the style of each cell, in the row order of the _cell_map
+        self._cell_styles = [dict(WaferMap.DEFAULT_CELL_STYLE)]
+        self._cell_style_index = {self._style_key(WaferMap.DEFAULT_CELL_STYLE): 0}
+        self._cell_style_ids = numpy.zeros(len(self._cell_map), dtype=numpy.int32)
+        if self.grid_rendering == "parametric":
+            self._grid_layer = ParametricGridLayer(
+                self._grid_parameters,
+                self._cell_map,
+                self._cell_style_ids,
+                self._cell_styles,
+                name="grid",
+            )
+        else:
+            self._grid_layer = CellGridLayer(
+                self._cell_map,
+                self._cell_style_ids,
+                self._cell_styles,
+                name="grid",
+                geometries=geometries,
+            )
+        self._labels_layer = folium.map.FeatureGroup(name="labels", show=False)
+        self._images_layer = folium.map.FeatureGroup(name="images")
+        self._markers_layer = folium.map.FeatureGroup(name="markers")
+        self._vectors_layer = folium.map.FeatureGroup(name="vectors")
+
+    def clone(self) -> "WaferMap":
+        """
+        Create a WaferMap of the same wafer and grid, as WaferMap(...) with the same
+        arguments would, without the cell styles and data added to this map. The
+        static layers (base tile, wafer edge, notch, edge exclusion, cell labels and
+        controls) are rendered once, on the first clone, and shared by all clones as
+        pre-rendered HTML. Only the data layers are built for each clone, so a
+        template map can cheaply stamp out the maps of the wafers of a lot.
+        Changes to the static layers of this map after its first clone are not seen
+        by the clones.
+        """
+        data_layers = (
+            self._grid_layer,
+            self._labels_layer,
+            self._images_layer,
+            self._markers_layer,
+            self._vectors_layer,
+        )
+        if self._prerendered_layers is None:
+            self._prerendered_layers = {
+                name: PrerenderedLayer(child)
+                for name, child in self.map._children.items()
+                if not isinstance(child, folium.LayerControl)
+                and not any(child is layer for layer in data_layers)
+            }
+
+        wafer_map = copy.copy(self)
+        wafer_map._init_data_layers(
+            self._grid_layer.geometries()
+            if isinstance(self._grid_layer, CellGridLayer)
+            else None
+        )
+        clone_layers = dict(
+            zip(
+                (id(layer) for layer in data_layers),
+                (
+                    wafer_map._grid_layer,
+                    wafer_map._labels_layer,
+                    wafer_map._images_layer,
+                    wafer_map._markers_layer,
+                    wafer_map._vectors_layer,
+                ),
+            )
+        )
+        wafer_map.map = WaferMap._folium_map()
+        # the pre-rendered layers refer to the map by its name
+        wafer_map.map._id = self.map._id
+        for name, child in self.map._children.items():
+            if id(child) in clone_layers:
+                clone_layers[id(child)].add_to(wafer_map.map)
+            elif isinstance(child, folium.LayerControl):
+                folium.LayerControl().add_to(wafer_map.map)
+            else:
+                wafer_map.map.add_child(self._prerendered_layers[name], name=name)
+        return wafer_map
+
     def save_html(
-        self, output_file: Union[str, None] = "wafermap.html"
+        self,
+        output_file: Union[str, None] = "wafermap.html",
+        assets_dir: Union[str, None] = None,
+        minify: bool = False,
     ) -> Union[str, None]:
-        """Save current Folium Map to HTML with the given filename. If output_file is None, then return the html as string"""
+        """
+        Save current Folium Map to HTML with the given filename. If output_file is None, then return the html as string
+        The page is written layer by layer, and gzip compressed if output_file ends with .html.gz.
+        :param assets_dir: If given, the images are written to this directory once each,
+        named after their content hash, and referenced by URLs relative to output_file
+        (or to the working directory if output_file is None) instead of being inlined.
+        Popup images are then only loaded when their popup opens.
+        :param minify: Strip the indentation, blank lines and comment lines of the page.
+        The content of string literals, <pre> and <textarea> is kept as it is.
+        """
         if output_file:
-            if os.path.splitext(output_file)[1].lower() != ".html":
-                raise ValueError("output_file must have an html extension")
+            if not output_file.lower().endswith((".html", ".html.gz")):
+                raise ValueError("output_file must have an html or html.gz extension")
         # turn on/off relevant layers/controls
         self.map.options["zoomControl"] = True
-        if output_file is None:
-            output_html = self.map.get_root().render()
-            return output_html
+        # files on disk are referenced relative to the page
+        page_dir = os.path.dirname(os.path.abspath(output_file or "wafermap.html"))
+        tile_layers = list(iter_elements(self.map.get_root(), (ImageTileLayer,)))
+        for tile_layer in tile_layers:
+            tile_layer.page_dir = page_dir
+        elements = []
+        if assets_dir is not None:
+            url = os.path.relpath(os.path.abspath(assets_dir), page_dir)
+            assets = AssetDirectory(assets_dir, quote(url.replace(os.sep, "/")))
+            elements = assets.attach(self.map.get_root())
+        try:
+            if output_file is None:
+                output_html = StringIO()
+                writer.write_html(self.map.get_root(), output_html, minify)
+                return output_html.getvalue()
+            else:
+                writer.save_html(self.map.get_root(), output_file, minify)
+                return output_file
+        finally:
+            for element in elements:
+                element.assets = None
+            for tile_layer in tile_layers:
+                tile_layer.page_dir = None
+
+    def to_image(
+        self,
+        renderer: str = "browser",
+        autocrop: bool = False,
+        resolution: Union[tuple[int, int], None] = None,
+        max_size: Union[tuple[int, int], None] = None,
+        browser_pool: Union[BrowserPool, None] = None,
+    ) -> Image.Image:
+        """
+        Render current Folium Map to an RGB image in memory, see save_png.
+        :param max_size: If given, the image is downscaled to fit (width, height) in
+        pixels, keeping its aspect ratio.
+        """
+        if renderer not in WaferMap.PNG_RENDERERS:
+            raise ValueError(
+                f"renderer must be one of {', '.join(WaferMap.PNG_RENDERERS)}"
+            )
+        if renderer == "raster":
+            image = raster.rasterize(
+                self.map.get_root(),
+                [
+                    (-self.wafer_radius, -self.wafer_radius),
+                    (self.wafer_radius, self.wafer_radius),
+                ],
+                resolution or WaferMap.IMAGE_RESOLUTION,
+                WaferMap.MAP_PADDING,
+                self._map_bg_color,
+            )
         else:
-            self.map.save(output_file)
-            return output_file
+            if browser_pool is not None and resolution is not None:
+                if browser_pool.resolution != tuple(resolution):
+                    raise ValueError("resolution must match that of browser_pool")
+            # turn on/off relevant layers/controls
+            zoom_control = self.map.options.get("zoomControl", True)
+            self.map.options["zoomControl"] = False
+            try:
+                html = StringIO()
+                writer.write_html(self.map.get_root(), html)
+            finally:
+                self.map.options["zoomControl"] = zoom_control
+            if browser_pool is None:
+                with BrowserPool(
+                    resolution=resolution or WaferMap.IMAGE_RESOLUTION
+                ) as browser_pool:
+                    png = browser_pool.screenshot(html.getvalue())
+            else:
+                png = browser_pool.screenshot(html.getvalue())
+            with Image.open(BytesIO(png)) as screenshot:
+                image = screenshot.convert("RGB")
+
+        if autocrop:
+            image = WaferMap._autocrop(image)
+        if max_size is not None:
+            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+        return image
+
+    def to_array(self, *args, **kwargs) -> numpy.ndarray:
+        """
+        Render current Folium Map to an (height, width, 3) uint8 array of RGB pixels,
+        the arguments are those of to_image.
+        """
+        return numpy.asarray(self.to_image(*args, **kwargs))
 
     def save_png(
-        self, output_file: str = "wafermap.png", autocrop: bool = False
-    ) -> Union[str, None]:
-        """Save current Folium Map to a PNG image. html2image is required. autocrop will crop the white parts of the screenshot"""
-        # turn on/off relevant layers/controls
-        self.map.options["zoomControl"] = False
-        hti = Html2Image(
-            output_path=os.path.dirname(output_file),
-            custom_flags=[
-                "--default-background-color=FFFFFF",
-                "--start-fullscreen",
-                "--headless",
-                "--virtual-time-budget=600",
-                "--hide-scrollbars",
-                f"--window-size={WaferMap.IMAGE_RESOLUTION[0]},{WaferMap.IMAGE_RESOLUTION[1]}",
-            ],
-        )
-        html = self.map.get_root().render()
-        screenshot_files = hti.screenshot(
-            html_str=html, save_as=os.path.basename(output_file)
-        )  # TODO: to use size=(width, height) instead of cropping with Pillow when functionality is fixed in chromium (m113) (still valid on 10/3/2025)
-        screenshot_file = screenshot_files[0]
+        self,
+        output_file: Union[str, None] = "wafermap.png",
+        autocrop: bool = False,
+        renderer: str = "browser",
+        resolution: Union[tuple[int, int], None] = None,
+        browser_pool: Union[BrowserPool, None] = None,
+        max_size: Union[tuple[int, int], None] = None,
+        image_format: Union[str, None] = None,
+        compress_level: int = 6,
+        quality: Union[int, None] = None,
+    ) -> Union[str, bytes]:
+        """
+        Save current Folium Map to a PNG image. autocrop will crop the white parts of the screenshot
+        If output_file is None, then return the encoded image as bytes.
+        :param renderer: Options of 'browser', 'raster'. Option 'browser' takes a
+        screenshot of the page in a headless Chromium. Option 'raster' draws the
+        visible layers directly with NumPy and PIL, without a browser.
+        :param resolution: (width, height) of the image in pixels. If None,
+        IMAGE_RESOLUTION, or the resolution of browser_pool.
+        :param browser_pool: A BrowserPool of running browsers to take the screenshot
+        with, instead of starting a browser, for the 'browser' renderer.
+        :param max_size: If given, the image is downscaled to fit (width, height) in
+        pixels, keeping its aspect ratio.
+        :param image_format: Options of 'png', 'webp', 'jpeg'. If None, the format of
+        the extension of output_file, else 'png'.
+        :param compress_level: The zlib compression level of PNG images, 0-9.
+        :param quality: The quality of WebP and JPEG images, 0-100. If None, the
+        Pillow default.
+        """
+        if image_format is None:
+            extension = os.path.splitext(output_file or "")[1].lower().lstrip(".")
+            extension = {"jpg": "jpeg"}.get(extension, extension)
+            image_format = extension if extension in WaferMap.IMAGE_FORMATS else "png"
+        if image_format not in WaferMap.IMAGE_FORMATS:
+            raise ValueError(
+                f"image_format must be one of {', '.join(WaferMap.IMAGE_FORMATS)}"
+            )
+        image = self.to_image(renderer, autocrop, resolution, max_size, browser_pool)
+        if image_format == "png":
+            options = {"compress_level": compress_level}
+        else:
+            options = {} if quality is None else {"quality": quality}
 
+        if output_file is None:
+            output_image = BytesIO()
+            image.save(output_image, WaferMap.IMAGE_FORMATS[image_format], **options)
+            return output_image.getvalue()
+        image.save(output_file, WaferMap.IMAGE_FORMATS[image_format], **options)
+        return output_file
+
+    def save_svg(
+        self,
+        output_file: Union[str, None] = "wafermap.svg",
+        autocrop: bool = False,
+        resolution: Union[tuple[int, int], None] = None,
+    ) -> str:
+        """
+        Save current Folium Map to an SVG image, drawn from the visible layers without
+        a browser. If output_file is None, then return the SVG as string.
+        The SVG is framed as the PNG images, in pixels at the given resolution.
+        :param autocrop: Frame the square of the wafer only.
+        :param resolution: (width, height) of the SVG in pixels. If None,
+        IMAGE_RESOLUTION.
+        """
+        width, height = resolution or WaferMap.IMAGE_RESOLUTION
         if autocrop:
-            # crop rest of controls out of image
-            # TODO: Implement auto detection of border
-            image = Image.open(screenshot_file)
-            width, height = image.size
-            min_dim = min(width, height)
-            max_dim = max(width, height)
-            image = image.crop(
-                (
-                    int((max_dim - min_dim) / 2),
-                    0,
-                    int((max_dim + min_dim) / 2),
-                    min_dim,
+            width = height = min(width, height)
+        output_svg = svg.write_svg(
+            self.map.get_root(),
+            [
+                (-self.wafer_radius, -self.wafer_radius),
+                (self.wafer_radius, self.wafer_radius),
+            ],
+            (width, height),
+            WaferMap.MAP_PADDING,
+            self._map_bg_color,
+        )
+        if output_file is None:
+            return output_svg
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(output_svg)
+        return output_file
+
+    @staticmethod
+    def save_pngs(
+        wafer_maps: Sequence["WaferMap"],
+        output_files: Sequence[str],
+        autocrop: bool = False,
+        browser_pool: Union[BrowserPool, None] = None,
+        pool_size: int = 2,
+        timeout: float = 60.0,
+    ) -> list[str]:
+        """
+        Save many maps to PNG images with the 'browser' renderer, screenshot
+        concurrently by a pool of browsers that are started once for the batch.
+        :param wafer_maps: The maps to save.
+        :param output_files: The PNG file of each map.
+        :param browser_pool: A BrowserPool to use, kept open. If None, a pool of
+        pool_size browsers with a timeout per map in seconds is started and shut down
+        at the end of the batch.
+        :return: The PNG files.
+        """
+        if len(wafer_maps) != len(output_files):
+            raise ValueError("wafer_maps and output_files must be of the same length")
+        if browser_pool is None:
+            with BrowserPool(
+                pool_size, timeout, WaferMap.IMAGE_RESOLUTION
+            ) as browser_pool:
+                return WaferMap.save_pngs(
+                    wafer_maps, output_files, autocrop, browser_pool
                 )
-            )  # (left, top, right, bottom), origin (0,0) is at the top left of the image
-            image.save(screenshot_file)
 
-        return screenshot_file
+        def save(wafer_map: WaferMap, output_file: str) -> str:
+            return wafer_map.save_png(
+                output_file, autocrop=autocrop, browser_pool=browser_pool
+            )
+
+        with ThreadPoolExecutor(max_workers=browser_pool.size) as executor:
+            return list(executor.map(save, wafer_maps, output_files))
+
+    @staticmethod
+    def _autocrop(image: Image.Image) -> Image.Image:
+        """
+        Crop an image to the box of the map in its centered square, the controls of
+        the map lie outside of it
+        """
+        width, height = image.size
+        size = min(width, height)
+        left, top = (width - size) // 2, (height - size) // 2
+        square = image.crop((left, top, left + size, top + size))
+        return square.crop(utils.content_box(numpy.asarray(square)))
 
     def add_image(
         self,
@@ -519,27 +594,71 @@ class WaferMap(WaferMapGrid):
          the bottom left corner.
         """
 
-        if marker_style is None:
-            marker_style = WaferMap.DEFAULT_MARKER_STYLE
         if not os.path.isfile(image_source_file):
             raise ValueError(f"Image file {image_source_file} does not exist.")
+        thumbnail = WaferMap.THUMBNAIL_CACHE.get(
+            image_source_file, WaferMap.IMAGE_SIZE_IN_POPUP
+        )
+        self._add_thumbnail(thumbnail, marker_style, cell, offset)
+
+    def add_images(
+        self,
+        image_source_files: Sequence[str],
+        cells: Union[Sequence[tuple[int, int]], None] = None,
+        offsets: Union[Sequence[tuple[float, float]], None] = None,
+        marker_style=None,
+        max_workers: Union[int, None] = None,
+    ):
+        """
+        Add many images in one call, see add_image. The image files are read in a
+        thread pool, and the thumbnails are cached across maps.
+        :param image_source_files: The paths to the image files.
+        :param cells: (n, 2) cell indices (x,y). If None is passed, the offsets are
+        interpreted as (x,y) wafer coordinates.
+        :param offsets: (n, 2) (x,y) offsets from cell origin in mm. If None, the images
+        are placed at the cell origin.
+        :param marker_style: see add_image, the same for all images.
+        :param max_workers: The number of threads reading the images. If None, the
+        default of concurrent.futures.ThreadPoolExecutor.
+        """
+        if marker_style is None:
+            marker_style = WaferMap.DEFAULT_MARKER_STYLE
+        if offsets is None:
+            offsets = [(0.0, 0.0)] * len(image_source_files)
+        cells = [None] * len(image_source_files) if cells is None else cells
+        if not len(cells) == len(offsets) == len(image_source_files):
+            raise ValueError("cells, offsets and image_source_files must match")
+        for image_source_file in image_source_files:
+            if not os.path.isfile(image_source_file):
+                raise ValueError(f"Image file {image_source_file} does not exist.")
+
+        # the popups need the encoded thumbnails, the overlays only their size
+        thumbnails = WaferMap.THUMBNAIL_CACHE.get_many(
+            image_source_files,
+            WaferMap.IMAGE_SIZE_IN_POPUP,
+            encode=bool(marker_style),
+            max_workers=max_workers,
+        )
+        for thumbnail, cell, offset in zip(thumbnails, cells, offsets):
+            self._add_thumbnail(thumbnail, marker_style, cell, offset)
+
+    def _add_thumbnail(
+        self,
+        thumbnail: Thumbnail,
+        marker_style: Union[dict, None],
+        cell: Union[tuple[int, int], None],
+        offset: tuple[float, float],
+    ):
+        if marker_style is None:
+            marker_style = WaferMap.DEFAULT_MARKER_STYLE
 
         # given in (x,y) but internally we use (y,x) = (long, lat)
-        if cell:
-            cell = cell[1], cell[0]
+        if cell is not None:
+            cell = int(cell[1]), int(cell[0])
         offset = offset[1] * self.conversion_factor, offset[0] * self.conversion_factor
         image_origin = self.cell_to_wafer_coordinates(cell, offset)
+        image_width, image_height = thumbnail.size
 
-        # Open and read image
-        with Image.open(image_source_file) as imf:
-            try:
-                imf.thumbnail(WaferMap.IMAGE_SIZE_IN_POPUP)
-                image_width, image_height = imf.size
-                buffered = BytesIO()
-                imf.save(buffered, "JPEG")
-                image_file = base64.b64encode(buffered.getvalue())
-            except IOError:
-                print(f"Error: Cannot create thumbnail for {image_source_file}")
         # find position to put image
         if cell:
             image_coordinates = (
@@ -573,28 +692,93 @@ class WaferMap(WaferMapGrid):
             cell_bounds = image_bounds
 
         if not marker_style:
-            # add image as ImageOverlay
-            folium.raster_layers.ImageOverlay(
-                image=image_source_file,
+            # add image as ImageOverlay, the file is read when the map is saved
+            ImageFileOverlay(
+                image_file=thumbnail.path,
                 bounds=utils.bounded_rectangle(rect=image_bounds, bounds=cell_bounds),
-                origin="lower",
                 pixelated=False,
             ).add_to(self._images_layer)
         else:
-            html_popup = (
-                f'<html><head></head><body><img src="data:image/jpeg;base64,'
-                f'{image_file.decode("utf-8")}" '
-                f'alt="{os.path.basename(image_source_file)}"></body><html>'
-            )
-            iframe = IFrame(
-                html_popup, width=str(image_width + 20), height=str(image_height + 20)
+            # the thumbnail is encoded when the map is saved
+            image_popup = folium.Popup(
+                ThumbnailFrame(thumbnail, os.path.basename(thumbnail.path)),
+                parse_html=True,
+                max_width=800,
             )
-            image_popup = folium.Popup(iframe, parse_html=True, max_width=800)
 
             folium.CircleMarker(
                 location=image_coordinates, radius=2, popup=image_popup, **marker_style
             ).add_to(self._markers_layer)
 
+    def add_image_tiles(
+        self,
+        image_source_file: str,
+        tiles_dir: str,
+        cell: Union[tuple[int, int], None] = None,
+        bounds: Union[tuple[tuple[float, float], tuple[float, float]], None] = None,
+        image_format: str = "png",
+        tile_size: int = 256,
+    ):
+        """
+        Add a large image, like a full wafer scan or a stitched die mosaic, as a tile
+        pyramid. The image is cut into tiles of all zoom levels, in a subdirectory of
+        tiles_dir per image, and the browser only loads the tiles in view at the
+        current zoom. The tiles are referenced relative to the saved HTML, so tiles_dir
+        must be kept along with it.
+        :param image_source_file: The path to the image file.
+        :param tiles_dir: The directory to write the tiles to.
+        :param cell: The cell index (x,y) of the image. If None, bounds are wafer
+        coordinates.
+        :param bounds: The ((x0, y0), (x1, y1)) lower left and upper right corners of
+        the image in mm, from the cell origin if a cell is given. If None, the image
+        covers the cell, or the whole wafer.
+        :param image_format: 'png' or 'jpeg', the format of the tiles.
+        :param tile_size: The size of the square tiles in pixels.
+        """
+        if not os.path.isfile(image_source_file):
+            raise ValueError(f"Image file {image_source_file} does not exist.")
+        if image_format not in TILE_FORMATS:
+            raise ValueError(f"image_format must be one of {', '.join(TILE_FORMATS)}")
+
+        # given in (x,y) but internally we use (y,x) = (long, lat)
+        if bounds is not None:
+            (x0, y0), (x1, y1) = bounds
+            lower_left = y0 * self.conversion_factor, x0 * self.conversion_factor
+            upper_right = y1 * self.conversion_factor, x1 * self.conversion_factor
+        if cell is not None:
+            cell = int(cell[1]), int(cell[0])
+            if bounds is None:
+                row = self._cell_map.row(cell)
+                if row < 0:
+                    raise ValueError(f"{str(cell)} does not exist in wafermap.")
+                lower_left = tuple(self._cell_map.bounds[row, 0].tolist())
+                upper_right = tuple(self._cell_map.bounds[row, 3].tolist())
+            else:
+                lower_left = self.cell_to_wafer_coordinates(cell, lower_left)
+                upper_right = self.cell_to_wafer_coordinates(cell, upper_right)
+        elif bounds is None:
+            lower_left = (-self.wafer_radius, -self.wafer_radius)
+            upper_right = (self.wafer_radius, self.wafer_radius)
+        image_bounds = [list(lower_left), list(upper_right)]
+
+        pyramid_dir, *zooms = build_tile_pyramid(
+            image_source_file,
+            tiles_dir,
+            image_bounds,
+            tile_size=tile_size,
+            min_zoom=self._tile_layer.options["min_zoom"],
+            image_format=image_format,
+        )
+        ImageTileLayer(
+            pyramid_dir,
+            image_bounds,
+            zooms,
+            extension=TILE_FORMATS[image_format][1],
+            tile_size=tile_size,
+            max_zoom=self._tile_layer.options["max_zoom"],
+            control=False,
+        ).add_to(self._images_layer)
+
     def add_vector(
         self,
         vector_points: list[tuple[float, float]],
@@ -627,11 +811,13 @@ class WaferMap(WaferMapGrid):
         # given in (x,y) but internally we use (y,x) = (long, lat)
         if cell:
             cell = cell[1], cell[0]
-        for i, vector_point in enumerate(vector_points):
-            vector_points[i] = (
+        vector_points = [
+            (
                 vector_point[1] * self.conversion_factor,
                 vector_point[0] * self.conversion_factor,
             )
+            for vector_point in vector_points
+        ]
 
         # convert vector_points to wafer coordinates
         vector_starting_point = self.cell_to_wafer_coordinates(cell, vector_points[0])
@@ -655,12 +841,68 @@ class WaferMap(WaferMapGrid):
                 self._vectors_layer
             )
 
-        vector_line = folium.PolyLine(vector_points, **vector_style).add_to(
-            self._vectors_layer
-        )
-        plugins.PolyLineTextPath(vector_line, "", repeat=False, offset=5).add_to(
-            self._vectors_layer
-        )
+        folium.PolyLine(vector_points, **vector_style).add_to(self._vectors_layer)
+
+    def add_vectors(
+        self,
+        cells: Union[numpy.ndarray, None],
+        starts: numpy.ndarray,
+        deltas: numpy.ndarray,
+        vector_length_scale: float = 1.0,
+        colormap: Union[str, list, dict, Callable, None] = None,
+        vmin: Union[float, None] = None,
+        vmax: Union[float, None] = None,
+        vector_style=None,
+        root_style=None,
+    ):
+        """
+        Add many vectors in one call, e.g. an overlay error or stage drift map. The
+        vectors are drawn on canvas as a single layer. The inputs are not modified.
+        :param cells: (n, 2) array of cell indices (x, y). If None is passed, the starts
+        are interpreted as wafer coordinates.
+        :param starts: (n, 2) array of (x, y) vector starts in mm. Cell origin is the
+        bottom left corner.
+        :param deltas: (n, 2) array of (x, y) vectors in mm.
+        :param vector_length_scale: Value to multiply the vector lengths by
+        :param colormap: If given, the vectors are colored by their magnitude (before
+        scaling), see style_cells for the colormap options.
+        :param vmin: Magnitude of the lower end of the colormap, the minimum if None.
+        :param vmax: Magnitude of the upper end of the colormap, the maximum if None.
+        :param vector_style: A dict with style options.
+        :param root_style: If given, the vectors will have a point as root with the
+        given style.
+        """
+
+        if vector_style is None:
+            vector_style = WaferMap.DEFAULT_VECTOR_STYLE
+        if vector_style != WaferMap.DEFAULT_VECTOR_STYLE:
+            vector_style = {**WaferMap.DEFAULT_VECTOR_STYLE, **vector_style}
+
+        wafer_starts, valid = self.cell_to_wafer(cells, starts)
+        if not valid.all():
+            missing = tuple(numpy.asarray(cells).reshape(-1, 2)[~valid][0].tolist())
+            raise ValueError(f"{str(missing)} does not exist in wafermap.")
+        deltas = numpy.asarray(deltas, dtype=float).reshape(-1, 2)
+        if len(deltas) != len(wafer_starts):
+            raise ValueError("starts and deltas must have the same length")
+
+        colors = None
+        if colormap is not None:
+            palette, color_index = self._value_colors(
+                numpy.hypot(deltas[:, 0], deltas[:, 1]), colormap, vmin, vmax
+            )
+            # vectors without a magnitude color (index -1) keep the style color
+            colors = numpy.asarray(palette + [vector_style["color"]])[color_index]
+
+        wafer_starts = wafer_starts * self.conversion_factor
+        VectorLayer(
+            wafer_starts,
+            deltas * (vector_length_scale * self.conversion_factor),
+            vector_style,
+            colors=colors,
+        ).add_to(self._vectors_layer)
+        if root_style:
+            PointLayer(wafer_starts, root_style).add_to(self._vectors_layer)
 
     def add_point(
         self,
@@ -695,6 +937,56 @@ class WaferMap(WaferMapGrid):
             location=point_origin, popup=popup_text, **point_style
         ).add_to(self._markers_layer)
 
+    def add_points(
+        self,
+        cells: Union[numpy.ndarray, None],
+        offsets: numpy.ndarray,
+        colors: Union[Sequence[str], None] = None,
+        sizes: Union[numpy.ndarray, float, None] = None,
+        popup_texts: Union[Sequence[str], None] = None,
+        point_style=None,
+    ):
+        """
+        Add many points in one call. The points are drawn on canvas as a single layer.
+        :param cells: (n, 2) array of cell indices (x, y). If None is passed, the
+        offsets are interpreted as wafer coordinates.
+        :param offsets: (n, 2) array of (x, y) offsets from the cell origin in mm. Cell
+        origin is the bottom left corner.
+        :param colors: (n,) color per point. If None, the point_style color is used.
+        :param sizes: (n,) radius in pixels per point. If None, the point_style radius
+        is used.
+        :param popup_texts: (n,) text to display as a popup upon clicking each point. If
+        None, no popup will be shown.
+        :param point_style: Draw the points with the given style
+        """
+
+        if point_style is None:
+            point_style = WaferMap.DEFAULT_POINT_STYLE
+        if point_style != WaferMap.DEFAULT_POINT_STYLE:
+            point_style = {**WaferMap.DEFAULT_POINT_STYLE, **point_style}
+
+        wafer_coordinates, valid = self.cell_to_wafer(cells, offsets)
+        if not valid.all():
+            missing = tuple(numpy.asarray(cells).reshape(-1, 2)[~valid][0].tolist())
+            raise ValueError(f"{str(missing)} does not exist in wafermap.")
+        for column in (colors, popup_texts, sizes):
+            if (
+                column is not None
+                and numpy.ndim(column) > 0
+                and len(column) != len(wafer_coordinates)
+            ):
+                raise ValueError(
+                    "colors, sizes and popup_texts must have one value per point"
+                )
+
+        PointLayer(
+            wafer_coordinates * self.conversion_factor,
+            point_style,
+            colors=colors,
+            radii=sizes,
+            popups=popup_texts,
+        ).add_to(self._markers_layer)
+
     def add_label(
         self,
         cell: Union[tuple[int, int], None] = (0, 0),
@@ -743,6 +1035,56 @@ class WaferMap(WaferMapGrid):
             popup=popup_text,
         ).add_to(self._labels_layer)
 
+    def add_labels(
+        self,
+        cells: Union[numpy.ndarray, None],
+        offsets: numpy.ndarray,
+        label_texts: Sequence[str],
+        label_html_style: Union[str, Sequence[str], None] = None,
+        popup_texts: Union[Sequence[str], None] = None,
+        min_zoom: Union[float, None] = None,
+    ):
+        """
+        Add many labels in one call, e.g. a bin code or a value per cell. The labels are
+        shown only when the zoom level makes them readable, and each distinct style is
+        written once.
+        :param cells: (n, 2) array of cell indices (x, y). If None is passed, the
+        offsets are interpreted as wafer coordinates.
+        :param offsets: (n, 2) array of (x, y) offsets of the label centers from the
+        cell origin in mm. Cell origin is the bottom left corner.
+        :param label_texts: (n,) texts of the labels.
+        :param label_html_style: The HTML style of all labels, or (n,) style per label,
+        e.g: 'font-size: 8pt; color: black; text-align: center'
+        :param popup_texts: (n,) text to display as a popup upon clicking each label. If
+        None, no popup will be shown.
+        :param min_zoom: Zoom level from which the labels are shown. If None, labels are
+        shown once they are spread enough on screen not to overlap.
+        """
+
+        if label_html_style is None:
+            label_html_style = WaferMap.DEFAULT_LABEL_HTML_STYLE
+
+        wafer_coordinates, valid = self.cell_to_wafer(cells, offsets)
+        if not valid.all():
+            missing = tuple(numpy.asarray(cells).reshape(-1, 2)[~valid][0].tolist())
+            raise ValueError(f"{str(missing)} does not exist in wafermap.")
+        columns = [label_texts, popup_texts]
+        if not isinstance(label_html_style, str):
+            columns.append(label_html_style)
+        for column in columns:
+            if column is not None and len(column) != len(wafer_coordinates):
+                raise ValueError("label columns must have one value per label")
+
+        LabelLayer(
+            wafer_coordinates * self.conversion_factor,
+            label_texts,
+            label_html_style,
+            popups=popup_texts,
+            # 1pt is 1.333px
+            font_size_px=WaferMap.DEFAULT_LABEL_FONT_SIZE * 1.333,
+            min_zoom=min_zoom,
+        ).add_to(self._labels_layer)
+
     def style_cell(
         self,
         cell: Union[tuple[int, int], None] = (0, 0),
@@ -758,11 +1100,155 @@ class WaferMap(WaferMapGrid):
             cell = cell[1], cell[0]
 
         if not cell:
-            cells_to_style = [c for c in self._cell_map]
+            rows_to_style = numpy.arange(len(self._cell_map))
         else:
-            if cell not in self._cell_map:
+            row = self._cell_map.row(cell)
+            if row < 0:
                 raise ValueError(f"{str(cell)} does not exist in wafermap.")
-            cells_to_style = [cell]
+            rows_to_style = numpy.array([row])
 
-        for cell_to_style in cells_to_style:
-            self._cell_map[cell_to_style][5].options |= cell_style
+        self._merge_cell_styles(
+            rows_to_style, [cell_style], numpy.zeros(len(rows_to_style), dtype=int)
+        )
+
+    def style_cells(
+        self,
+        cells: Union[numpy.ndarray, None],
+        values: Union[numpy.ndarray, None] = None,
+        colormap: Union[str, list, dict, Callable] = "viridis",
+        vmin: Union[float, None] = None,
+        vmax: Union[float, None] = None,
+        cell_style: Union[dict, None] = None,
+    ):
+        """
+        Style many cells in one call, e.g. to color a bin map or a parametric map.
+        :param cells: (n, 2) array of cell indices (x, y). If None is passed, all cells
+        are styled and values are given in the order of the cell_indices.
+        :param values: (n,) array of a value per cell. If None, cell_style is applied to
+        all cells. Cells with a NaN value are not styled.
+        :param colormap: The fill color of the values. A dict of value -> color for
+        categorical values (bins). For continuous values, a branca colormap name (e.g.
+        'viridis'), a list of colors or any callable of value -> color, that is sampled
+        at COLORMAP_LEVELS levels between vmin and vmax.
+        :param vmin: Value of the lower end of a continuous colormap, the minimum value
+        if None.
+        :param vmax: Value of the upper end of a continuous colormap, the maximum value
+        if None.
+        :param cell_style: Style merged into the style of the cells, on top of the
+        DEFAULT_BIN_STYLE and the fill color of the values.
+        """
+        if cells is None:
+            rows = numpy.arange(len(self._cell_map))
+        else:
+            cells = numpy.asarray(cells).reshape(-1, 2)
+            # given in (x,y) but internally we use (y,x) = (long, lat)
+            rows = self._cell_map.rows(cells[:, ::-1])
+            if (rows < 0).any():
+                missing = tuple(cells[numpy.argmax(rows < 0)].tolist())
+                raise ValueError(f"{str(missing)} does not exist in wafermap.")
+
+        if values is None:
+            if cell_style is None:
+                raise ValueError("Either values or cell_style is required")
+            self._merge_cell_styles(
+                rows, [cell_style], numpy.zeros(len(rows), dtype=int)
+            )
+            return
+
+        values = numpy.asarray(values).ravel()
+        if len(values) != len(rows):
+            raise ValueError("values must have one value per cell")
+        colors, color_index = self._value_colors(values, colormap, vmin, vmax)
+        styled = color_index >= 0
+        base_style = WaferMap.DEFAULT_BIN_STYLE | (cell_style or {})
+        self._merge_cell_styles(
+            rows[styled],
+            [base_style | {"fillColor": color} for color in colors],
+            color_index[styled],
+        )
+
+    @staticmethod
+    def _value_colors(
+        values: numpy.ndarray,
+        colormap: Union[str, list, dict, Callable],
+        vmin: Union[float, None],
+        vmax: Union[float, None],
+    ) -> tuple[list[str], numpy.ndarray]:
+        """
+        Map values to colors.
+        :return: (colors, color_index) the distinct colors and the index of the color
+        of each value, -1 for values without a color (NaN)
+        """
+        if isinstance(colormap, dict):
+            # categorical values, NaN values are left without a color
+            values = numpy.asarray(values).ravel()
+            if values.dtype.kind in "fc":
+                valid = numpy.isfinite(values)
+            else:
+                valid = numpy.array(
+                    [
+                        not (isinstance(value, float) and numpy.isnan(value))
+                        for value in values.tolist()
+                    ],
+                    dtype=bool,
+                )
+            bins, valid_index = numpy.unique(values[valid], return_inverse=True)
+            missing = [value for value in bins.tolist() if value not in colormap]
+            if missing:
+                raise ValueError(f"No color for the values {missing}")
+            color_index = numpy.full(len(values), -1)
+            color_index[valid] = valid_index.ravel()
+            return [colormap[value] for value in bins.tolist()], color_index
+
+        values = values.astype(float)
+        valid = numpy.isfinite(values)
+        if not valid.any():
+            return [], numpy.full(len(values), -1)
+        vmin = numpy.min(values[valid]) if vmin is None else vmin
+        vmax = numpy.max(values[valid]) if vmax is None else vmax
+        if isinstance(colormap, str):
+            colormap = getattr(branca.colormap.linear, colormap).scale(vmin, vmax)
+        elif not callable(colormap):
+            colormap = branca.colormap.LinearColormap(colormap, vmin=vmin, vmax=vmax)
+
+        levels = WaferMap.COLORMAP_LEVELS
+        colors = [colormap(level) for level in numpy.linspace(vmin, vmax, levels)]
+        span = (vmax - vmin) or 1.0
+        color_index = numpy.full(len(values), -1)
+        color_index[valid] = numpy.clip(
+            numpy.rint((values[valid] - vmin) / span * (levels - 1)), 0, levels - 1
+        )
+        return colors, color_index
+
+    def _merge_cell_styles(
+        self, rows: numpy.ndarray, cell_styles: list[dict], style_index: numpy.ndarray
+    ):
+        """Merge cell_styles[style_index[i]] into the current style of rows[i]"""
+        if not len(rows):
+            return
+        # each distinct (current style, new style) pair becomes one style of the table
+        pairs, pair_index = numpy.unique(
+            numpy.column_stack((self._cell_style_ids[rows], style_index)),
+            axis=0,
+            return_inverse=True,
+        )
+        pair_ids = numpy.array(
+            [
+                self._register_cell_style(self._cell_styles[current] | cell_styles[new])
+                for current, new in pairs.tolist()
+            ],
+            dtype=self._cell_style_ids.dtype,
+        )
+        self._cell_style_ids[rows] = pair_ids[pair_index.ravel()]
+
+    @staticmethod
+    def _style_key(style: dict) -> str:
+        return json.dumps(style, sort_keys=True, default=str)
+
+    def _register_cell_style(self, style: dict) -> int:
+        """Return the index of style in the cell style table, adding it if new"""
+        key = self._style_key(style)
+        if key not in self._cell_style_index:
+            self._cell_style_index[key] = len(self._cell_styles)
+            self._cell_styles.append(style)
+        return self._cell_style_index[key]
@@ -0,0 +1,197 @@
+"""Streaming HTML writer of folium figures"""
+
+import gzip
+import shutil
+import tempfile
+from typing import TextIO
+
+from branca.element import Element, Figure
+
+SCRIPT_MARKER = "<!-- wafermap scripts -->"
+
+
+# the HTML elements whose content is kept as it is, and the end of each
+RAW_HTML_ELEMENTS = {"<pre": "</pre", "<textarea": "</textarea", "<!--": "-->"}
+
+
+class Minifier:
+    """
+    Line based minifier of HTML and JS. It strips the indentation and the blank
+    lines, and the // comment lines of scripts. The lines inside JS string literals,
+    <pre>, <textarea> and HTML comments are kept as they are, so that the content of
+    the page is unchanged. Lines are kept, so that automatic semicolon insertion is
+    not affected. The state is kept between calls, so a page can be minified in
+    parts.
+    :param script: Whether the text starts in a script, else in HTML.
+    """
+
+    def __init__(self, script: bool = False):
+        self.script = script
+        # the quote of the open JS string literal, or "/*" in a block comment
+        self.quote = None
+        # the end of the open raw HTML element
+        self.raw_end = None
+
+    @property
+    def _verbatim(self) -> bool:
+        return self.raw_end is not None or self.quote in ("'", '"', "`")
+
+    def _scan_script(self, line: str, i: int) -> int:
+        """Scan JS from i, return where the script ends, or the end of the line"""
+        while i < len(line):
+            if self.quote == "/*":
+                end = line.find("*/", i)
+                if end < 0:
+                    return len(line)
+                self.quote = None
+                i = end + 2
+            elif self.quote is not None:
+                if line[i] == "\\":
+                    i += 2
+                    continue
+                if line[i] == self.quote:
+                    self.quote = None
+                i += 1
+            elif line.startswith("//", i):
+                return len(line)
+            elif line.startswith("/*", i):
+                self.quote = "/*"
+                i += 2
+            elif line[i] in "'\"`":
+                self.quote = line[i]
+                i += 1
+            elif line[i : i + 8].lower() == "</script":
+                self.script = False
+                return i
+            else:
+                i += 1
+        # only template literals, and escaped line ends, continue on the next line
+        if self.quote in ("'", '"') and not line.endswith("\\"):
+            self.quote = None
+        return i
+
+    def _scan_html(self, line: str, i: int) -> int:
+        """Scan HTML from i, return where a script starts, or the end of the line"""
+        lower = line.lower()
+        while i < len(line):
+            if self.raw_end is not None:
+                end = lower.find(self.raw_end, i)
+                if end < 0:
+                    return len(line)
+                i = end + len(self.raw_end)
+                self.raw_end = None
+                continue
+            i = lower.find("<", i)
+            if i < 0:
+                return len(line)
+            for start, end in RAW_HTML_ELEMENTS.items():
+                if lower.startswith(start, i) and (
+                    start == "<!--"
+                    or lower[i + len(start) : i + len(start) + 1] in "> "
+                ):
+                    self.raw_end = end
+                    i += len(start)
+                    break
+            else:
+                if lower.startswith("<script", i):
+                    self.script = True
+                    tag_end = line.find(">", i)
+                    return len(line) if tag_end < 0 else tag_end + 1
+                i += 1
+        return i
+
+    def minify(self, text: str) -> str:
+        lines = []
+        for line in text.splitlines():
+            starts_verbatim = self._verbatim
+            starts_in_script = self.script
+            i = 0
+            while i < len(line):
+                i = (
+                    self._scan_script(line, i)
+                    if self.script
+                    else self._scan_html(line, i)
+                )
+            ends_verbatim = self._verbatim
+            if not starts_verbatim:
+                line = line.lstrip()
+                if not line or (starts_in_script and line.startswith("//")):
+                    continue
+            if not ends_verbatim:
+                line = line.rstrip()
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def minify(text: str, script: bool = False) -> str:
+    """Minify HTML, or JS if script, see Minifier"""
+    return Minifier(script).minify(text)
+
+
+class ScriptSpool(Element):
+    """
+    Stand-in for the script of a figure while it is rendered, that writes the script
+    of each element to a file as it is added instead of keeping it.
+    """
+
+    def __init__(self, spool: TextIO, minified: bool = False):
+        super().__init__()
+        self._name = "ScriptSpool"
+        self.spool = spool
+        self.minified = minified
+        self._names = set()
+
+    def add_child(self, child: Element, name: str = None, index: int = None):
+        if name is None:
+            name = child.get_name()
+        # an element rendered twice adds the same script
+        if name not in self._names:
+            self._names.add(name)
+            script = child.render()
+            # chunks are kept on their own lines, for automatic semicolon insertion,
+            # as the children of an Element are rendered
+            self.spool.write(
+                minify(script, script=True) + "\n"
+                if self.minified
+                else "\n    " + script
+            )
+        child._parent = self
+        return self
+
+    def render(self, **kwargs) -> str:
+        return SCRIPT_MARKER
+
+
+def write_html(figure: Figure, file: TextIO, minified: bool = False):
+    """
+    Render a figure to a file, element by element. The scripts of the elements are
+    spooled to a temporary file while the figure is rendered, since the header is
+    only complete at the end, so the memory used is bounded by the largest element
+    rather than by the whole page. Scripts added to the figure by earlier renders are
+    not repeated.
+    """
+    script = figure.script
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as spool:
+        figure.script = ScriptSpool(spool, minified)
+        figure.script._parent = figure
+        try:
+            page = figure.render()
+        finally:
+            figure.script = script
+        head, _, tail = page.rpartition(SCRIPT_MARKER)
+        # the tail continues the head, from within its script element
+        minifier = Minifier()
+        file.write(minifier.minify(head) + "\n" if minified else head)
+        spool.seek(0)
+        shutil.copyfileobj(spool, file)
+        file.write(minifier.minify(tail) if minified else tail)
+
+
+def save_html(figure: Figure, output_file: str, minified: bool = False):
+    """Write a figure to an HTML file, gzip compressed if it ends with .gz"""
+    if output_file.lower().endswith(".gz"):
+        with gzip.open(output_file, "wt", encoding="utf-8", newline="") as f:
+            write_html(figure, f, minified)
+    else:
+        with open(output_file, "w", encoding="utf-8", newline="") as f:
+            write_html(figure, f, minified)